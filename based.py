@@ -29,10 +29,10 @@
 
 # Script dependencies
 import os
-import pandas as pd
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import CountVectorizer
+import logging
 import streamlit as st
 
 st.set_page_config(page_title="Movie Recommender", page_icon="🎬")
@@ -44,11 +44,12 @@ import streamlit as st
 st.set_page_config(page_title="Movie Recommender", page_icon="🎬")
 
 # Data handling dependencies
-import pandas as pd
 import numpy as np
 
 # Custom Libraries
 from utils.data_loader import load_movie_titles
+from recommenders.top_charts import get_top_charts
+from recommenders.movie_search import get_movie_search
 from recommenders.collaborative_based import collab_model
 from recommenders.content_based import content_model
 
@@ -118,7 +119,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i + 1) + '. ' + j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -131,7 +134,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i + 1) + '. ' + j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -148,12 +153,26 @@ def main():
     elif page_selection == "Search Movies":
         st.title("Search Movies")
         search_query = st.text_input("Enter the title of the movie you want to search:")
+        # Title index over the catalogue, built once per process
+        movie_search = get_movie_search()
+        fuzzy = st.checkbox("Fuzzy matching (tolerates typos)")
+        genre = st.selectbox("Genre", ['All genres'] + list(movie_search.genre_matrix.genres),
+                             key='search_genre')
+        year = st.number_input("Release year (0 for any year)", min_value=0, max_value=2100,
+                               value=0, step=1)
         if search_query:
-            search_results = [title for title in title_list if search_query.lower() in title.lower()]
-            if search_results:
-                st.write("Search Results:")
-                for result in search_results:
-                    st.write(result)
+            results = movie_search.search(search_query, page=st.session_state.get('search_page', 1),
+                                          fuzzy=fuzzy, year=year or None,
+                                          genre=None if genre == 'All genres' else genre)
+            if results.total:
+                st.write(f"Search Results ({results.total}):")
+                # The whole page in one element instead of one per title
+                st.text('\n'.join(results.titles))
+                if results.n_pages > 1:
+                    # The page number of a previous, longer search may be out of range
+                    st.session_state['search_page'] = results.page
+                    st.number_input(f"Page (of {results.n_pages})", min_value=1,
+                                    max_value=results.n_pages, key='search_page')
             else:
                 st.write("No matching movies found.")
 
@@ -162,32 +181,16 @@ def main():
 
         st.title("Top Charts")
 
-        # Load movie ratings data
-
-        ratings_df = pd.read_csv('resources/data/ratings.csv')
-
-        # Load movie titles data
-
-        titlelist = load_movie_titles('resources/data/movies.csv')
-
-        # Merge ratings_df and title_list on 'movieId' column
-
-        merged_df = pd.merge(ratings_df, titlelist, on='movieId')
-
-        # Calculate average rating for each movie
-
-        avg_ratings = merged_df.groupby('movieId')['rating'].mean()
-
-        # Sort movies based on average rating
-
-        top_movies = avg_ratings.sort_values(ascending=False).head(10)
+        # Per-movie rating aggregates, kept up to date with ratings logged in the app
+        charts = get_top_charts()
+        genre = st.selectbox("Genre", ['All genres'] + list(charts.genre_matrix.genres))
+        # Ranked by the Bayesian-weighted score, among movies with enough ratings
+        top_movies = charts.chart(n=10, genre=None if genre == 'All genres' else genre)
 
         st.write("Top 10 Rated Movies:")
 
-        for movie_id, rating in top_movies.items():
-            movie_title = merged_df.loc[merged_df['movieId'] == movie_id, 'title'].iloc[0]
-
-            st.write(f"{movie_title}: {rating:.2f}")
+        for movie in top_movies.itertuples(index=False):
+            st.write(f"{movie.title}: {movie.mean:.2f} ({movie.count} ratings)")
 
 # Custom Libraries
 from utils.data_loader import load_movie_titles
@@ -232,7 +235,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i + 1) + '. ' + j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -245,7 +250,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i + 1) + '. ' + j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -261,27 +268,41 @@ def main():
     elif page_selection == "Search Movies":
         st.title("Search Movies")
         search_query = st.text_input("Enter the title of the movie you want to search:")
+        # Title index over the catalogue, built once per process
+        movie_search = get_movie_search()
+        fuzzy = st.checkbox("Fuzzy matching (tolerates typos)")
+        genre = st.selectbox("Genre", ['All genres'] + list(movie_search.genre_matrix.genres),
+                             key='search_genre')
+        year = st.number_input("Release year (0 for any year)", min_value=0, max_value=2100,
+                               value=0, step=1)
         if search_query:
-            search_results = [title for title in title_list if search_query.lower() in title.lower()]
-            if search_results:
-                st.write("Search Results:")
-                for result in search_results:
-                    st.write(result)
+            results = movie_search.search(search_query, page=st.session_state.get('search_page', 1),
+                                          fuzzy=fuzzy, year=year or None,
+                                          genre=None if genre == 'All genres' else genre)
+            if results.total:
+                st.write(f"Search Results ({results.total}):")
+                # The whole page in one element instead of one per title
+                st.text('\n'.join(results.titles))
+                if results.n_pages > 1:
+                    # The page number of a previous, longer search may be out of range
+                    st.session_state['search_page'] = results.page
+                    st.number_input(f"Page (of {results.n_pages})", min_value=1,
+                                    max_value=results.n_pages, key='search_page')
             else:
                 st.write("No matching movies found.")
 
     elif page_selection == "Top Charts":
         st.title("Top Charts")
-        # Load movie ratings data
-        ratings_df = pd.read_csv('resources/data/ratings.csv')
-        # Calculate average rating for each movie
-        avg_ratings = ratings_df.groupby('movieId')['rating'].mean()
-        # Sort movies based on average rating
-        top_movies = avg_ratings.sort_values(ascending=False).head(10)
+        # Per-movie rating aggregates, kept up to date with ratings logged in the app
+        charts = get_top_charts()
+        genre = st.selectbox("Genre", ['All genres'] + list(charts.genre_matrix.genres))
+        # Ranked by the Bayesian-weighted score, among movies with enough ratings
+        top_movies = charts.chart(n=10, genre=None if genre == 'All genres' else genre)
+
         st.write("Top 10 Rated Movies:")
-        for movie_id, rating in top_movies.items():
-            movie_title = title_list[movie_id]
-            st.write(f"{movie_title}: {rating:.2f}")
+
+        for movie in top_movies.itertuples(index=False):
+            st.write(f"{movie.title}: {movie.mean:.2f} ({movie.count} ratings)")
 
     elif page_selection == "User Profile":
         st.title("User Profile")
@@ -0,0 +1,254 @@
+"""
+
+    Recommender benchmarks.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures the latency, throughput and memory of every
+    recommender on synthetic MovieLens-shaped data (see
+    `benchmarks.synthetic_data`). Every (algorithm, scale) pair runs in a
+    fresh worker process whose working directory holds the synthetic
+    data laid out like this repository, so each measurement includes its
+    own data loading and index building, and peak RSS is not shared
+    between runs.
+
+    Request latencies are reported as p50/p95/p99 (ms) together with
+    requests per second; training is timed once. The report is written as
+    JSON, tagged with the commit it was measured on, and can be compared
+    with the report of another commit:
+
+        python -m benchmarks.run --scales 10k 1m --output benchmarks/results/new.json
+        python -m benchmarks.run --scales 10k 1m --compare benchmarks/results/old.json
+
+    Generated data is kept under `benchmarks/data/<scale>` and reused.
+
+"""
+
+# Script dependencies
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import argparse
+import subprocess
+import numpy as np
+from benchmarks.synthetic_data import SCALES, write_dataset
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'data')
+# Recommenders served per request, by module and function
+RECOMMENDERS = {
+    'content_based': ('recommenders.content_based', 'content_model'),
+    'content_based2': ('recommenders.content_based2', 'content_model'),
+    'collab_model': ('recommenders.collaborative_based', 'collab_model'),
+}
+TRAINING = {'svd_pp'}
+ALGORITHMS = list(RECOMMENDERS) + sorted(TRAINING)
+# Model trained by `svd_pp` and served by `collab_model`
+MODEL_PATH = 'resources/models/SVDpp_model.pkl'
+N_FAVOURITES = 3
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (reported in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency_summary(latencies, elapsed):
+    """Percentiles (ms) and throughput of a series of request latencies (s)."""
+    latencies = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'requests': len(latencies), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'mean_ms': latencies.mean(), 'max_ms': latencies.max(),
+            'requests_per_s': len(latencies) / elapsed}
+
+
+def train_model():
+    """Train the collaborative model of the current directory's data."""
+    from resources.models.train_colbased import svd_pp
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    svd_pp(MODEL_PATH)
+
+
+def bench_recommender(algorithm, n_requests, seed=0):
+    """Serve random favourite lists and time every request.
+
+    The first request is reported separately as the cold start, which
+    includes loading data and models. Results are not cached between
+    requests, so every request is computed.
+
+    """
+    import importlib
+    if algorithm == 'collab_model' and not os.path.exists(MODEL_PATH):
+        # The model is trained outside of the measurement
+        train_model()
+    module_name, function_name = RECOMMENDERS[algorithm]
+    baseline_rss = peak_rss_mb()
+    module = importlib.import_module(module_name)
+    recommender = getattr(module, function_name)
+    recommender = getattr(recommender, 'uncached', recommender)
+
+    from recommenders.catalogue import get_catalogue
+    catalogue = get_catalogue()
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    requests = [catalogue.titles_of_rows(rng.choice(len(catalogue), N_FAVOURITES, replace=False))
+                for _ in range(n_requests + 1)]
+
+    start = time.perf_counter()
+    recommender(requests[0], top_n=10)
+    cold_start = time.perf_counter() - start
+
+    latencies = []
+    start = time.perf_counter()
+    for movie_list in requests[1:]:
+        request_start = time.perf_counter()
+        recommender(movie_list, top_n=10)
+        latencies.append(time.perf_counter() - request_start)
+    elapsed = time.perf_counter() - start
+    return dict(latency_summary(latencies, elapsed), cold_start_ms=1000 * cold_start,
+                baseline_rss_mb=baseline_rss)
+
+
+def bench_training():
+    """Time one training run of the collaborative model."""
+    baseline_rss = peak_rss_mb()
+    start = time.perf_counter()
+    train_model()
+    return {'fit_s': time.perf_counter() - start, 'baseline_rss_mb': baseline_rss}
+
+
+def run_worker(algorithm, n_requests):
+    """Benchmark one algorithm on the data of the working directory."""
+    if algorithm in TRAINING:
+        result = bench_training()
+    else:
+        result = bench_recommender(algorithm, n_requests)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_algorithm(algorithm, scale, n_requests, data_dir=DATA_DIR):
+    """Run one benchmark in a fresh worker process.
+
+    Returns
+    -------
+    dict
+        Measurements of the worker, or the error it failed with.
+
+    """
+    root = os.path.join(data_dir, scale)
+    write_dataset(root, scale)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    command = [sys.executable, '-m', 'benchmarks.run', '--worker', algorithm,
+               '--requests', str(n_requests)]
+    process = subprocess.run(command, cwd=root, env=env, capture_output=True, text=True)
+    result = {'algorithm': algorithm, 'scale': scale, **SCALES[scale]}
+    if process.returncode != 0:
+        result['error'] = process.stderr.strip().splitlines()[-1:] or ['unknown error']
+        return result
+    # The measurements are the last line of the worker's output
+    result.update(json.loads(process.stdout.strip().splitlines()[-1]))
+    return result
+
+
+def git_commit():
+    """Commit of the benchmarked code, or None outside of a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(algorithms, scales, n_requests, data_dir=DATA_DIR):
+    """Benchmark every algorithm at every scale.
+
+    Returns
+    -------
+    dict
+        Report with the environment and one result per (algorithm, scale).
+
+    """
+    results = []
+    for scale in scales:
+        for algorithm in algorithms:
+            result = run_algorithm(algorithm, scale, n_requests, data_dir)
+            print(format_result(result), file=sys.stderr)
+            results.append(result)
+    return {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'requests': n_requests, 'results': results}
+
+
+def format_result(result):
+    """One line summary of a result."""
+    name = f"{result['algorithm']:>15} {result['scale']:>4}"
+    if 'error' in result:
+        return f"{name}  failed: {' '.join(result['error'])}"
+    if 'fit_s' in result:
+        return f"{name}  fit {result['fit_s']:.1f}s  peak RSS {result['peak_rss_mb']:.0f} MiB"
+    return (f"{name}  p50 {result['p50_ms']:.2f}ms  p95 {result['p95_ms']:.2f}ms  "
+            f"p99 {result['p99_ms']:.2f}ms  {result['requests_per_s']:.0f} req/s  "
+            f"peak RSS {result['peak_rss_mb']:.0f} MiB")
+
+
+def compare_reports(baseline, report, metrics=('p50_ms', 'p95_ms', 'p99_ms', 'fit_s',
+                                               'peak_rss_mb')):
+    """Ratios of the metrics of a report to those of a baseline report.
+
+    Returns
+    -------
+    list (dict)
+        One entry per (algorithm, scale) measured in both reports; a
+        ratio above 1 is a regression.
+
+    """
+    previous = {(result['algorithm'], result['scale']): result
+                for result in baseline['results']}
+    changes = []
+    for result in report['results']:
+        old = previous.get((result['algorithm'], result['scale']))
+        if old is None:
+            continue
+        ratios = {metric: result[metric] / old[metric] for metric in metrics
+                  if old.get(metric) and metric in result}
+        changes.append({'algorithm': result['algorithm'], 'scale': result['scale'], **ratios})
+    return changes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--algorithms', nargs='+', choices=ALGORITHMS, default=ALGORITHMS)
+    parser.add_argument('--scales', nargs='+', choices=sorted(SCALES), default=['10k'])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output', help="file to write the JSON report to (default: stdout)")
+    parser.add_argument('--compare', help="JSON report of a previous run to compare with")
+    parser.add_argument('--worker', choices=ALGORITHMS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.requests)))
+        sys.exit(0)
+
+    # Training first, so that the collaborative model is served from its output
+    algorithms = sorted(args.algorithms, key=lambda algorithm: algorithm not in TRAINING)
+    report = run_benchmarks(algorithms, args.scales, args.requests,
+                            os.path.abspath(args.data_dir))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['baseline_commit'] = baseline.get('commit')
+        report['changes'] = compare_reports(baseline, report)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
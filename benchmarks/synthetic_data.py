@@ -0,0 +1,145 @@
+"""
+
+    Synthetic MovieLens-shaped data for benchmarks.
+
+    Author: Explore Data Science Academy.
+
+    Description: Generates `movies.csv` and `ratings.csv` files with the
+    columns, value ranges and skew of the MovieLens data: movie
+    popularity and user activity follow long-tailed distributions, every
+    movie has one to four pipe-separated genres, and ratings are
+    half-stars between 0.5 and 5. Data is generated from a fixed seed, so
+    every scale is reproducible between runs and machines.
+
+"""
+
+# Script dependencies
+import os
+import numpy as np
+import pandas as pd
+
+GENRES = ['Drama', 'Comedy', 'Thriller', 'Romance', 'Action', 'Horror', 'Crime',
+          'Documentary', 'Adventure', 'Sci-Fi', 'Children', 'Animation', 'Mystery',
+          'Fantasy', 'War', 'Western', 'Musical', 'Film-Noir', 'IMAX']
+# Share of ratings at every half-star, roughly as in MovieLens
+RATING_VALUES = np.arange(1, 11) / 2
+RATING_SHARES = np.array([1.6, 3.3, 1.7, 7.2, 4.9, 19.6, 13.1, 26.6, 8.8, 13.2])
+# Ratings, users and movies of every benchmark scale
+SCALES = {
+    '10k': {'n_ratings': 10_000, 'n_users': 100, 'n_movies': 2_000},
+    '1m': {'n_ratings': 1_000_000, 'n_users': 6_000, 'n_movies': 10_000},
+    '25m': {'n_ratings': 25_000_000, 'n_users': 162_000, 'n_movies': 62_000},
+}
+CHUNK_SIZE = 1_000_000
+
+
+def generate_movies(n_movies, seed=0):
+    """Movies with unique titles and one to four genres each.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `movieId`, `title` and `genres`.
+
+    """
+    rng = np.random.default_rng(seed)
+    # Genres are drawn with a popularity skew, like Drama and Comedy in MovieLens
+    genre_weights = 1 / np.arange(1, len(GENRES) + 1)
+    genre_weights /= genre_weights.sum()
+    n_genres = rng.choice(4, n_movies, p=[0.45, 0.35, 0.15, 0.05]) + 1
+    genres = ['|'.join(rng.choice(GENRES, n, replace=False, p=genre_weights))
+              for n in n_genres]
+    years = rng.integers(1920, 2020, n_movies)
+    # Gaps in the ids, as MovieLens ids are not contiguous
+    movie_ids = np.cumsum(rng.integers(1, 4, n_movies))
+    titles = [f"Movie {movie_id} ({year})" for movie_id, year in zip(movie_ids, years)]
+    return pd.DataFrame({'movieId': movie_ids, 'title': titles, 'genres': genres})
+
+
+def generate_ratings(n_ratings, n_users, movie_ids, seed=0):
+    """Ratings with long-tailed user activity and movie popularity.
+
+    Every (user, movie) pair is rated at most once.
+
+    Parameters
+    ----------
+    n_ratings : int
+        Number of ratings to generate.
+    n_users : int
+        Number of distinct users to draw from.
+    movie_ids : numpy.ndarray
+        MovieLens-style ids of the movies to rate.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `userId`, `movieId`, `rating` and `timestamp`, sorted by
+        user and timestamp like the MovieLens files.
+
+    """
+    rng = np.random.default_rng(seed)
+    n_movies = len(movie_ids)
+    if n_ratings > n_users * n_movies:
+        raise ValueError("More ratings requested than (user, movie) pairs")
+    user_weights = rng.lognormal(0, 1.2, n_users)
+    user_weights /= user_weights.sum()
+    movie_weights = 1 / np.arange(1, n_movies + 1) ** 0.9
+    movie_weights = rng.permutation(movie_weights / movie_weights.sum())
+
+    # Drawing pairs in chunks and dropping repeats until enough are unique
+    keys = np.empty(0, dtype=np.int64)
+    while len(keys) < n_ratings:
+        size = min(CHUNK_SIZE, 2 * (n_ratings - len(keys)) + 1000)
+        users = rng.choice(n_users, size, p=user_weights)
+        movies = rng.choice(n_movies, size, p=movie_weights)
+        keys = np.unique(np.concatenate((keys, users.astype(np.int64) * n_movies + movies)))
+    keys = np.sort(rng.choice(keys, n_ratings, replace=False))
+
+    return pd.DataFrame({
+        'userId': keys // n_movies + 1,
+        'movieId': np.asarray(movie_ids)[keys % n_movies],
+        'rating': rng.choice(RATING_VALUES, n_ratings, p=RATING_SHARES / RATING_SHARES.sum()),
+        'timestamp': np.sort(rng.integers(820_000_000, 1_570_000_000, n_ratings)),
+    })
+
+
+def write_dataset(root, scale, seed=0):
+    """Write the data of a scale under `root/resources/data`.
+
+    Existing files are kept, so a scale is only generated once per
+    directory.
+
+    Parameters
+    ----------
+    root : str
+        Directory laid out like this repository.
+    scale : str
+        One of `SCALES`.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    str
+        Directory holding `movies.csv` and `ratings.csv`.
+
+    """
+    spec = SCALES[scale]
+    data_dir = os.path.join(root, 'resources', 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(os.path.join(root, 'resources', 'models'), exist_ok=True)
+    movies_path = os.path.join(data_dir, 'movies.csv')
+    ratings_path = os.path.join(data_dir, 'ratings.csv')
+    if os.path.exists(movies_path) and os.path.exists(ratings_path):
+        return data_dir
+    movies = generate_movies(spec['n_movies'], seed)
+    ratings = generate_ratings(spec['n_ratings'], spec['n_users'],
+                               movies['movieId'].to_numpy(), seed)
+    # Written under temporary names, so an interrupted run is regenerated
+    movies.to_csv(movies_path + '.tmp', index=False)
+    ratings.to_csv(ratings_path + '.tmp', index=False, chunksize=CHUNK_SIZE)
+    os.replace(movies_path + '.tmp', movies_path)
+    os.replace(ratings_path + '.tmp', ratings_path)
+    return data_dir
@@ -1,16 +1,32 @@
 # Streamlit dependencies
+import logging
 import streamlit as st
 
 st.set_page_config(page_title="Movie Recommender", page_icon="🎬")
 
-# Data handling dependencies
-import pandas as pd
-import numpy as np
-
 # Custom Libraries
 from utils.data_loader import load_movie_titles
 from recommenders.collaborative_based import collab_model
 from recommenders.content_based import content_model
+from recommenders.online_updates import new_user_id, submit_rating
+from recommenders.catalogue import get_catalogue
+from recommenders.top_charts import get_top_charts
+from recommenders.movie_search import get_movie_search, warm_movie_search
+from recommenders.lazy import warm_in_background
+from recommenders.service_client import remote
+from recommenders.tracing import serve_metrics_from_env
+
+# Recommendations are scored by the recommendation service when
+# RECOMMENDER_SERVICE_URL is set, and in this process otherwise
+content_model = remote(content_model, 'content_based')
+collab_model = remote(collab_model, 'collaborative_based')
+
+# Latency histograms on /metrics when RECOMMENDER_METRICS_PORT is set
+serve_metrics_from_env()
+
+# The search index and top charts take seconds to build; start on them
+# as soon as the app is up instead of on the first visit to their pages
+warm_in_background(warm_movie_search, get_top_charts)
 
 # Data Loading
 title_list = load_movie_titles('resources/data/movies.csv')
@@ -78,7 +94,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i + 1) + '. ' + j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -91,7 +109,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i + 1) + '. ' + j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -108,12 +128,26 @@ def main():
     elif page_selection == "Search Movies":
         st.title("Search Movies")
         search_query = st.text_input("Enter the title of the movie you want to search:")
+        # Title index over the catalogue, built once per process
+        movie_search = get_movie_search()
+        fuzzy = st.checkbox("Fuzzy matching (tolerates typos)")
+        genre = st.selectbox("Genre", ['All genres'] + list(movie_search.genre_matrix.genres),
+                             key='search_genre')
+        year = st.number_input("Release year (0 for any year)", min_value=0, max_value=2100,
+                               value=0, step=1)
         if search_query:
-            search_results = [title for title in title_list if search_query.lower() in title.lower()]
-            if search_results:
-                st.write("Search Results:")
-                for result in search_results:
-                    st.write(result)
+            results = movie_search.search(search_query, page=st.session_state.get('search_page', 1),
+                                          fuzzy=fuzzy, year=year or None,
+                                          genre=None if genre == 'All genres' else genre)
+            if results.total:
+                st.write(f"Search Results ({results.total}):")
+                # The whole page in one element instead of one per title
+                st.text('\n'.join(results.titles))
+                if results.n_pages > 1:
+                    # The page number of a previous, longer search may be out of range
+                    st.session_state['search_page'] = results.page
+                    st.number_input(f"Page (of {results.n_pages})", min_value=1,
+                                    max_value=results.n_pages, key='search_page')
             else:
                 st.write("No matching movies found.")
 
@@ -122,32 +156,16 @@ def main():
 
         st.title("Top Charts")
 
-        # Load movie ratings data
-
-        ratings_df = pd.read_csv('resources/data/ratings.csv')
-
-        # Load movie titles data
-
-        titlelist = load_movie_titles('resources/data/movies.csv')
-
-        # Merge ratings_df and title_list on 'movieId' column
-
-        merged_df = pd.merge(ratings_df, titlelist, on='movieId')
-
-        # Calculate average rating for each movie
-
-        avg_ratings = merged_df.groupby('movieId')['rating'].mean()
-
-        # Sort movies based on average rating
-
-        top_movies = avg_ratings.sort_values(ascending=False).head(10)
+        # Per-movie rating aggregates, kept up to date with ratings logged in the app
+        charts = get_top_charts()
+        genre = st.selectbox("Genre", ['All genres'] + list(charts.genre_matrix.genres))
+        # Ranked by the Bayesian-weighted score, among movies with enough ratings
+        top_movies = charts.chart(n=10, genre=None if genre == 'All genres' else genre)
 
         st.write("Top 10 Rated Movies:")
 
-        for movie_id, rating in top_movies.items():
-            movie_title = merged_df.loc[merged_df['movieId'] == movie_id, 'title'].iloc[0]
-
-            st.write(f"{movie_title}: {rating:.2f}")
+        for movie in top_movies.itertuples(index=False):
+            st.write(f"{movie.title}: {movie.mean:.2f} ({movie.count} ratings)")
 
 
     elif page_selection == "User Profile":
@@ -191,7 +209,12 @@ def main():
             feedback = st.text_area("Feedback")
 
             if st.button("Submit"):
-                # Placeholder for saving rating and feedback to database
+                # Saving the rating to the ratings log and folding it into the models
+                if 'user_id' not in st.session_state:
+                    st.session_state['user_id'] = new_user_id()
+                submit_rating(st.session_state['user_id'],
+                              get_catalogue().movie_id_of_title(selected_movie),
+                              rating, feedback)
                 st.success(
                     f"Thank you for rating '{selected_movie}' with {rating} stars and providing feedback:\n{feedback}")
 
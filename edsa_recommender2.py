@@ -26,6 +26,7 @@
 
 """
 # Streamlit dependencies
+import logging
 import streamlit as st
 
 # Data handling dependencies
@@ -78,7 +79,9 @@ def main():
                     st.title("We think you'll like:")
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm doesn't work.\
                               We'll need to fix it!")
 
@@ -92,7 +95,9 @@ def main():
                     st.title("We think you'll like:")
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm doesn't work.\
                               We'll need to fix it!")
 
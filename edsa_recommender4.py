@@ -17,6 +17,7 @@
     https://docs.streamlit.io/en/latest/
 """
 # Streamlit dependencies
+import logging
 import streamlit as st
 
 # Import seaborn library
@@ -33,49 +34,30 @@ import plotly.express as px
 
 # Data handling dependencies
 import pandas as pd
-import numpy as np
 import codecs
 
 # Custom Libraries
 from utils.data_loader import load_movie_titles
 from recommenders.collaborative_based import collab_model
 from recommenders.content_based import content_model
+from recommenders.catalogue import get_catalogue
+from recommenders.online_updates import new_user_id, submit_rating
+from recommenders.eda_cube import get_eda_cube
 st.set_option('deprecation.showPyplotGlobalUse', False)
 # Data Loading
 title_list = load_movie_titles('resources/data/movies.csv')
 
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv')
-train = pd.read_csv('resources/data/ratings.csv')
-df_imdb = pd.read_csv('resources/data/imdb_data.csv')
-
-# Merging the train and the movies
-df_merge1 = train.merge(movies, on = 'movieId')
-
-from datetime import datetime
-# Convert timestamp to year column representing the year the rating was made on merged dataframe
-df_merge1['rating_year'] = df_merge1['timestamp'].apply(lambda timestamp: datetime.fromtimestamp(timestamp).year)
-df_merge1.drop('timestamp', axis=1, inplace=True)
-
 # -------------- Create a Figure that shows us that shows us how the Ratigs are distriuted. ----------------#
-# Get the data
-data = df_merge1['rating'].value_counts().sort_index(ascending=False)
-
-ratings_df = pd.DataFrame()
-ratings_df['Mean_Rating'] = df_merge1.groupby('title')['rating'].mean().values
-ratings_df['Num_Ratings'] = df_merge1.groupby('title')['rating'].count().values
-
-genre_df = pd.DataFrame(df_merge1['genres'].str.split('|').tolist(), index=df_merge1['movieId']).stack()
-genre_df = genre_df.reset_index([0, 'movieId'])
-genre_df.columns = ['movieId', 'Genre']
-
-def make_bar_chart(dataset, attribute, bar_color='#3498db', edge_color='#2980b9', title='Title', xlab='X', ylab='Y', sort_index=False):
-    if sort_index == False:
-        xs = dataset[attribute].value_counts().index
-        ys = dataset[attribute].value_counts().values
+def make_bar_chart(dataset, attribute, bar_color='#3498db', edge_color='#2980b9', title='Title', xlab='X', ylab='Y', sort_index=False, weights=None):
+    # Rows count once each, or as many times as their `weights` column says
+    if weights is None:
+        counts = dataset[attribute].value_counts()
     else:
-        xs = dataset[attribute].value_counts().sort_index().index
-        ys = dataset[attribute].value_counts().sort_index().values
+        counts = dataset.groupby(attribute)[weights].sum().sort_values(ascending=False)
+    if sort_index:
+        counts = counts.sort_index()
+    xs = counts.index
+    ys = counts.values
 
 
     fig, ax = plt.subplots(figsize=(14, 7))
@@ -88,44 +70,7 @@ def make_bar_chart(dataset, attribute, bar_color='#3498db', edge_color='#2980b9'
     plt.bar(x=xs, height=ys, color=bar_color, edgecolor=edge_color, linewidth=2)
     plt.xticks(rotation=45)
 
- # Merging the merge data earlier on with the df_imbd
-df_merge3 = df_merge1.merge(df_imdb, on = "movieId" )
-
-num_ratings = pd.DataFrame(df_merge3.groupby('movieId').count()['rating']).reset_index()
-df_merge3 = pd.merge(left=df_merge3, right=num_ratings, on='movieId')
-df_merge3.rename(columns={'rating_x': 'rating', 'rating_y': 'numRatings'}, inplace=True)
-
-# pre_process the budget column
-
-# remove commas
-df_merge3['budget'] = df_merge3['budget'].str.replace(',', '')
-# remove currency signs like "$" and "GBP"
-df_merge3['budget'] = df_merge3['budget'].str.extract('(\d+)', expand=False)
-#convert the feature into a float
-df_merge3['budget'] = df_merge3['budget'].astype(float)
-#remove nan values and replacing with 0
-df_merge3['budget'] = df_merge3['budget'].replace(np.nan,0)
-#convert the feature into an integer
-df_merge3['budget'] = df_merge3['budget'].astype(int)
-
-df_merge3['release_year'] = df_merge3.title.str.extract('(\(\d\d\d\d\))', expand=False)
-df_merge3['release_year'] = df_merge3.release_year.str.extract('(\d\d\d\d)', expand=False)
-
-data_1= df_merge3.drop_duplicates('movieId')
-
-# Movies published by year:
-
-years = []
-
-for title in df_merge3['title']:
-    year_subset = title[-5:-1]
-    try: years.append(int(year_subset))
-    except: years.append(9999)
-
-df_merge3['moviePubYear'] = years
-print('The Number of Movies Published each year:',len(df_merge3[df_merge3['moviePubYear'] == 9999]))
-
-def make_histogram(dataset, attribute, bins=25, bar_color='#3498db', edge_color='#2980b9', title='Title', xlab='X', ylab='Y', sort_index=False):
+def make_histogram(dataset, attribute, bins=25, bar_color='#3498db', edge_color='#2980b9', title='Title', xlab='X', ylab='Y', sort_index=False, weights=None):
     if attribute == 'moviePubYear':
         dataset = dataset[dataset['moviePubYear'] != 9999]
 
@@ -137,7 +82,8 @@ def make_histogram(dataset, attribute, bins=25, bar_color='#3498db', edge_color=
     #ax.set_yticklabels([yticklabels(item, 'M') for item in ax.get_yticks()])
     ax.set_ylabel(ylab, fontsize=16, labelpad=20)
 
-    plt.hist(dataset[attribute], bins=bins, color=bar_color, ec=edge_color, linewidth=2)
+    plt.hist(dataset[attribute], bins=bins, color=bar_color, ec=edge_color, linewidth=2,
+             weights=None if weights is None else dataset[weights])
 
     plt.xticks(rotation=45)
 
@@ -217,7 +163,9 @@ def main():
                     st.title("We think you'll like:")
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -231,7 +179,9 @@ def main():
                     st.title("We think you'll like:")
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -299,21 +249,34 @@ def main():
         st.markdown("""EDA is the Exploratory Data Analsis used to gain insight into the dataset""")
         st.sidebar.header("Select Visuals to Display")
         #st.sidebar.subheader("Available Visuals obtained from the sections below:")
-        all_cols = df_merge1.columns.values
-        numeric_cols = df_merge1.columns.values
-        obj_cols = df_merge1.columns.values
+
+        # Importing data: summaries aggregated offline, see recommenders/eda_cube.py,
+        # only loaded once this page is opened
+        cube = get_eda_cube()
+        # Get the data
+        data = cube.rating_counts.sort_index(ascending=False)
+
+        ratings_df = pd.DataFrame()
+        ratings_df['Mean_Rating'] = cube.movies['meanRating'].values
+        ratings_df['Num_Ratings'] = cube.movies['numRatings'].values
+
+        # One row per genre, with the number of ratings of its movies
+        genre_df = cube.genres
+        # Movies published by year, with the number of ratings of those
+        # movies that have IMDB metadata
+        releases_df = cube.releases
 
 
 
         if st.sidebar.checkbox("Visuals on Ratings"):
             if st.checkbox("Ratings count by year"):
                 fig, ax = plt.subplots(1, 1, figsize = (12, 6))
-                ax1 = df_merge1.groupby('rating_year')['rating'].count().plot(kind='bar', title='Ratings by year')
+                ax1 = cube.rating_years.plot(kind='bar', title='Ratings by year')
                 st.write(fig)
 
 
             if st.checkbox("How ratings are distributed: histogram"):
-                f = px.histogram(df_merge1["rating"], x="rating", nbins=10, title="The Distribution of the Movie Ratings")
+                f = px.bar(x=data.index, y=data.values, title="The Distribution of the Movie Ratings")
                 f.update_xaxes(title="Ratings")
                 f.update_yaxes(title="Number of Movies per rating")
                 st.plotly_chart(f)
@@ -330,12 +293,12 @@ def main():
 
         if st.sidebar.checkbox("Visuals on Genres"):
             st.info("The number of movie per genre")
-            fig=make_bar_chart(genre_df, 'Genre', title='Most Popular Movie Genres', xlab='Genre', ylab='Counts')
+            fig=make_bar_chart(genre_df, 'Genre', title='Most Popular Movie Genres', xlab='Genre', ylab='Counts', weights='numRatings')
             st.pyplot(fig)
 
         if st.sidebar.checkbox("Movie published"):
             st.info("Movies published by year")
-            st.pyplot(make_histogram(df_merge3, 'moviePubYear', title='Movies Published per Year', xlab='Year', ylab='Counts'))
+            st.pyplot(make_histogram(releases_df, 'moviePubYear', title='Movies Published per Year', xlab='Year', ylab='Counts', weights='imdbRatings'))
 
 
 
@@ -422,7 +385,12 @@ def main():
             feedback = st.text_area("Feedback")
 
             if st.button("Submit"):
-                # Placeholder for saving rating and feedback to database
+                # Saving the rating to the ratings log and folding it into the models
+                if 'user_id' not in st.session_state:
+                    st.session_state['user_id'] = new_user_id()
+                submit_rating(st.session_state['user_id'],
+                              get_catalogue().movie_id_of_title(selected_movie),
+                              rating, feedback)
                 st.success(
                     f"Thank you for rating '{selected_movie}' with {rating} stars and providing feedback:\n{feedback}")
 
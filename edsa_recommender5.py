@@ -29,6 +29,7 @@
 from recommenders.content_based import content_model
 from recommenders.collaborative_based import collab_model
 from utils.data_loader import load_movie_titles
+import logging
 import streamlit as st
 
 # Data handling dependencies
@@ -38,9 +39,7 @@ import warnings
 import matplotlib.pyplot as plt
 import matplotlib.style as style
 import seaborn as sns
-from datetime import datetime
-from eda import EDA as eda
-from utils import data_loader as dl
+from recommenders.eda_cube import get_eda_cube
 import plotly
 plt.rcParams['figure.dpi'] = 180
 warnings.filterwarnings('ignore')
@@ -59,6 +58,17 @@ title_list = load_movie_titles('resources/data/movies.csv')
 path_to_s3 = ('../unsupervised_data/')
 
 
+def plot_ratings(cube, count=10000, n=10, color='#4D17A0', best=True):
+    """Bar chart of the n best (or worst) mean rated movies with at
+    least `count` ratings."""
+    chart = cube.movie_chart(n=n, min_count=count, best=best)
+    fig = plt.figure(figsize=(12, 8))
+    plt.barh(chart['title'][::-1], chart['meanRating'][::-1], color=color)
+    plt.title(('Best' if best else 'Worst') + ' rated movies', fontsize=14)
+    plt.xlabel('Mean rating')
+    return fig
+
+
 # App declaration
 def main():
 
@@ -98,7 +108,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -111,7 +123,9 @@ def main():
                     st.title("We think you'll like:")
                     for i, j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -126,25 +140,8 @@ def main():
     # or to provide your business pitch.
     if page_selection == 'Analysis':
 
-        # Loading EDA Data
-        train_df = dl.load_dataframe(
-            '../unsupervised_data/unsupervised_movie_data/train.csv', index=None)
-        imdb_df = dl.load_dataframe(
-            '../unsupervised_data/unsupervised_movie_data/imdb_data.csv', index=None)
-        movies_df = dl.load_dataframe(
-            '../unsupervised_data/unsupervised_movie_data/movies.csv', index='movieId')
-
-        # Merging movie and train data for EDA
-        new_df = train_df.merge(movies_df, on='movieId')
-        # Converting time to datetime
-        new_df['rating_year'] = new_df['timestamp'].apply(
-            lambda timestamp: datetime.fromtimestamp(timestamp).year)
-        # Dropping the non converted timestamp
-        new_df.drop('timestamp', axis=1, inplace=True)
-        # Creating a release year column from title
-        new_df['release_year'] = new_df['title'].apply(eda.get_release_dates)
-        # Excluding one user with inaccurate data
-        eda_df = new_df[new_df['userId'] != 72315]
+        # Loading EDA Data: summaries aggregated offline, see recommenders/eda_cube.py
+        cube = get_eda_cube()
 
         st.header("Exploratory Data Analysis")
         st.markdown('Exploratory Data Analysis is an approach to analyzing data sets to summarize their main characteristics, often with visual methods. A statistical model can be used or not, but primarily EDA is for seeing what the data can tell us beyond the formal modeling or hypothesis testing task. \n The visuals shows the kind of data provided, they will be split into the following categories.')
@@ -156,11 +153,11 @@ def main():
 
         # Total movies released per year
         pre_95_releases = pd.DataFrame({'release_year': list(range(1874, 1995)),
-                                       'count': eda.get_releases_by_year(new_df, range(1874, 1995))})
+                                       'count': cube.releases_by_year(range(1874, 1995))})
         post_94_releases = pd.DataFrame({'release_year': list(range(1995, 2022)),
-                                         'count': eda.get_releases_by_year(new_df, range(1995, 2022))})
+                                         'count': cube.releases_by_year(range(1995, 2022))})
         overall_movies = pd.DataFrame({'release_year': list(range(1874, 2022)),
-                                      'count': eda.get_releases_by_year(new_df, range(1874, 2022))})
+                                      'count': cube.releases_by_year(range(1874, 2022))})
 
         st.subheader('Total  overall movies count   per year')
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
@@ -193,7 +190,7 @@ def main():
         st.subheader('The total number of movies per genre')
         fig = plt.figure(figsize=(12, 8))
         ax = sns.barplot(
-            y=eda.genres['genres'], x=eda.genres['count'], palette=("Blues_d"), orient='h')
+            y=cube.genres['Genre'], x=cube.genres['movies'], palette=("Blues_d"), orient='h')
         plt.title('Number of Movies Per genres', fontsize=14)
         plt.ylabel('genres')
         plt.xlabel('Number of Movies')
@@ -208,23 +205,21 @@ def main():
         ns = st.number_input('Choose n movies', min_value=5,
                              max_value=20, value=10, step=5)
         st.subheader('Top Best movies by Genre')
-        eda.plot_ratings(count=counts, n=ns, color='#4D17A0',
-                         best=True, method='mean')
+        fig = plot_ratings(cube, count=counts, n=ns, color='#4D17A0', best=True)
         # plt.tight_layout()
-        st.pyplot()
+        st.pyplot(fig)
         st.write('By filtering movies with less than 10000 ratings, we find that the most popular movies are unsurprising titles. The Shawshank Redemption and The Godfather unsurprisingly top the list. What is interesting is that Movies made post 2000 do not feature often. Do users have a preference to Older movies?')
 
         st.subheader('Worst movies by Genre')
-        eda.plot_ratings(count=counts, n=ns, color='#4DA017',
-                         best=False, method='mean')
+        fig = plot_ratings(cube, count=counts, n=ns, color='#4DA017', best=False)
         # plt.tight_layout()
-        st.pyplot()
+        st.pyplot(fig)
         st.write('Obviously, users did not like Battlefield too much and with 1200 ratings, they really wanted it to be known. It is interesting how many sequels appear in the list')
 
         # Total ratings per year
         st.subheader('The total rating of movies per year')
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
-        ax1 = new_df.groupby('rating_year')['rating'].count().plot(
+        ax1 = cube.rating_years.plot(
             kind='bar', title='Ratings by year')
         fig.tight_layout()
         st.pyplot(fig)
@@ -26,6 +26,7 @@
 
 """
 # Streamlit dependencies
+import logging
 import streamlit as st
 
 # Data handling dependencies
@@ -108,7 +109,9 @@ def main():
                     st.success("##### We think you'll like:")
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -123,7 +126,9 @@ def main():
                     st.success("##### We think you'll like:")
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception:
+                    # Logged with its traceback instead of being swallowed
+                    logging.exception("Recommendation failed")
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -0,0 +1,150 @@
+"""
+
+    Movie catalogue index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Hash maps between movie titles, MovieLens movie IDs and
+    catalogue rows, built once per process. Catalogue rows follow the
+    order of the movie data file (with incomplete records dropped), which
+    is also the row order of the similarity and genre matrices used by
+    the content-based recommenders. The id arrays are shared by all
+    processes through `recommenders.data_plane`.
+
+"""
+
+# Script dependencies
+import threading
+import numpy as np
+import pandas as pd
+from recommenders.data_cache import load_movies, movies_version, source_stamp
+from recommenders.data_plane import plane_version, set_name, shared_arrays
+from recommenders.lazy import register_warmup
+
+MOVIES_PATH = 'resources/data/movies.csv'
+
+_catalogues = {}
+_catalogues_lock = threading.Lock()
+
+
+class Catalogue:
+    """Constant-time lookups between titles, movie IDs and rows.
+
+    Where a title occurs more than once in the catalogue, it resolves to
+    its first occurrence.
+
+    Attributes
+    ----------
+    titles : list (str)
+        Title of every catalogue row.
+    movie_ids : numpy.ndarray
+        MovieLens movie ID of every catalogue row (read-only).
+    source : dict
+        Stamp of the movie data the catalogue was built from.
+
+    """
+
+    def __init__(self, movies, source=None, id_arrays=None):
+        self.titles = movies['title'].tolist()
+        if id_arrays is None:
+            id_arrays = movie_id_arrays(movies['movieId'].to_numpy())
+        self.movie_ids = id_arrays['movie_ids']
+        self.movie_ids.setflags(write=False)
+        self.source = source
+        self._title_rows = {}
+        for row, title in enumerate(self.titles):
+            self._title_rows.setdefault(title, row)
+        self._movie_id_rows = {movie_id: row
+                               for row, movie_id in enumerate(self.movie_ids.tolist())}
+        # Sorted movie IDs for vectorised lookups
+        self._movie_id_order = id_arrays['order']
+        self._sorted_movie_ids = id_arrays['sorted_ids']
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title):
+        return title in self._title_rows
+
+    def row_of_title(self, title):
+        """Catalogue row of a title; raises KeyError if unknown."""
+        return self._title_rows[title]
+
+    def row_of_movie_id(self, movie_id):
+        """Catalogue row of a movie ID; raises KeyError if unknown."""
+        return self._movie_id_rows[movie_id]
+
+    def movie_id_of_title(self, title):
+        """MovieLens movie ID of a title; raises KeyError if unknown."""
+        return int(self.movie_ids[self._title_rows[title]])
+
+    def title_of_movie_id(self, movie_id):
+        """Title of a MovieLens movie ID; raises KeyError if unknown."""
+        return self.titles[self._movie_id_rows[movie_id]]
+
+    def rows_of_titles(self, titles):
+        """Catalogue rows of several titles."""
+        return [self._title_rows[title] for title in titles]
+
+    def rows_of_movie_ids(self, movie_ids):
+        """Catalogue rows of an array of movie IDs; unknown IDs map to -1."""
+        movie_ids = np.asarray(movie_ids)
+        slots = np.searchsorted(self._sorted_movie_ids, movie_ids)
+        slots = np.minimum(slots, len(self) - 1)
+        found = self._sorted_movie_ids[slots] == movie_ids
+        return np.where(found, self._movie_id_order[slots], -1)
+
+    def titles_of_rows(self, rows):
+        """Titles of several catalogue rows."""
+        return [self.titles[row] for row in rows]
+
+    def titles_of_movie_ids(self, movie_ids):
+        """Titles of several MovieLens movie IDs."""
+        return [self.titles[self._movie_id_rows[movie_id]] for movie_id in movie_ids]
+
+
+def movie_id_arrays(movie_ids):
+    """Movie IDs of the catalogue rows, with their sorting order."""
+    order = np.argsort(movie_ids, kind='stable')
+    return {'movie_ids': movie_ids, 'order': order, 'sorted_ids': movie_ids[order]}
+
+
+def release_years(titles):
+    """Release year from the `Title (Year)` titles, or -1 if missing."""
+    years = pd.Series(titles, dtype=object).str.extract(r'\((\d{4})\)\s*$')[0]
+    return years.fillna(-1).astype(np.int64).to_numpy()
+
+
+@register_warmup
+def get_catalogue(movies_path=MOVIES_PATH):
+    """Return the shared catalogue index, building it on first use.
+
+    The index is rebuilt when the movie data file has changed since it
+    was last built.
+
+    Parameters
+    ----------
+    movies_path : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+
+    Returns
+    -------
+    Catalogue
+        Shared catalogue index.
+
+    """
+    cached = _catalogues.get(movies_path)
+    if cached is None or cached.source != source_stamp(movies_path):
+        with _catalogues_lock:
+            cached = _catalogues.get(movies_path)
+            if cached is None or cached.source != source_stamp(movies_path):
+                source = source_stamp(movies_path)
+                movies = load_movies(movies_path).dropna()
+                version = plane_version(movies_version(movies_path))
+                id_arrays = shared_arrays(
+                    set_name('catalogue', movies_path), version,
+                    lambda: movie_id_arrays(movies['movieId'].to_numpy()))
+                cached = Catalogue(movies, source, id_arrays)
+                _catalogues[movies_path] = cached
+    return cached
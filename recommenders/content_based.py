@@ -29,15 +29,25 @@
 
 # Script dependencies
 import os
-import pandas as pd
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
+from recommenders.similarity_index import INDEX_DIR, get_similarity_index
+from recommenders.catalogue import get_catalogue
+from recommenders.ranking import combine_scores, top_n_rows
+from recommenders.data_cache import load_movies
+from recommenders.lazy import Lazy
+from recommenders.result_cache import cached_recommender
+from recommenders.tracing import span, traced
+
+MOVIES_PATH = 'resources/data/movies.csv'
+
+def _load_movies():
+    # Importing data
+    movies = load_movies(MOVIES_PATH)
+    movies.dropna(inplace=True)
+    movies.reset_index(drop=True, inplace=True)
+    return movies
+
+# Data is only loaded on first use, keeping the import cheap
+_movies = Lazy(_load_movies)
 
 def data_preprocessing(subset_size):
     """Prepare data for use within Content filtering algorithm.
@@ -53,14 +63,54 @@ def data_preprocessing(subset_size):
         Subset of movies selected for content-based filtering.
 
     """
+    movies = _movies.get()
     # Split genre data into individual words.
     movies['keyWords'] = movies['genres'].str.replace('|', ' ')
     # Subset of the data
     movies_subset = movies[:subset_size]
     return movies_subset
 
+def content_recommendations(seeds, weights=None, top_n=10, how='max'):
+    """Recommend movies similar to any number of seed movies.
+
+    Parameters
+    ----------
+    seeds : list (str)
+        Titles of the seed movies.
+    weights : list (float), optional
+        Weight of every seed; all seeds weigh 1 by default.
+    top_n : int
+        Number of top recommendations to return to the user.
+    how : str
+        How the seeds' similarity scores are combined: `max` or `sum`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations, best first.
+
+    """
+    # Loading the precomputed top-k neighbour index (memory-mapped)
+    with span('content_based.load_index'):
+        index = get_similarity_index()
+    with span('content_based.load_catalogue'):
+        catalogue = get_catalogue()
+    # Getting the catalogue rows of the seed movies
+    rows = catalogue.rows_of_titles(seeds)
+    with span('content_based.similarity'):
+        score_rows = index.score_rows(rows)
+    with span('content_based.rank'):
+        # Combining the similarity rows of all seeds in one reduction
+        scores = combine_scores(score_rows, weights, how)
+        # Selecting the best movies other than the seeds
+        top_indexes = top_n_rows(scores, top_n, exclude=rows)
+    with span('content_based.titles'):
+        return catalogue.titles_of_rows(top_indexes)
+
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@traced('content_based.content_model')
+@cached_recommender(sources=(MOVIES_PATH, os.path.join(INDEX_DIR, 'meta.json')))
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -78,35 +128,4 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
-    return recommended_movies
+    return content_recommendations(movie_list, top_n=top_n)
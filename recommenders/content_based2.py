@@ -29,15 +29,11 @@
 
 # Script dependencies
 import os
-import pandas as pd
-import numpy as np
-from sklearn.neighbors import  NearestNeighbors
 import random
-
-# Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',delimiter=',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies_df.dropna(inplace=True)
+from recommenders.catalogue import get_catalogue
+from recommenders.genre_encoding import get_genre_matrix
+from recommenders.genre_neighbours import get_neighbour_index
+from recommenders.tracing import span, traced
 
 def data_preprocessing(subset_size):
     """Prepare data for use within Content filtering algorithm.
@@ -53,31 +49,16 @@ def data_preprocessing(subset_size):
         Subset of movies selected for content-based filtering.
 
     """
-    # Create a new dataframe to make genres into list format
-    movies = movies_df.copy()
-    # Split the genres feature so that each genres will be in a list format 
-    movies['genres'] = movies.genres.str.split('|')
-
-    #Copying the movie dataframe into a new one since we won't need to use the genre information in our first case.
-    moviesWithGenres_df = movies.copy()
-
-    #For every row in the dataframe, iterate through the list of genres and place a 1 into the corresponding column
-    for index, row in movies.iterrows():
-        for genre in row['genres']:
-            moviesWithGenres_df.at[index, genre] = 1
-    #Filling in the NaN values with 0 to show that a movie doesn't have that column's genre
-    moviesWithGenres_df = moviesWithGenres_df.fillna(0)
-
-    # Deleting the genres column 
-    moviesWithGenres_df.drop(['genres'],axis =1, inplace = True)
-
-    # Slice the data to the desired size
-    movies_subset = moviesWithGenres_df[:subset_size]
+    # One-hot genre encoding, built once per process and shared
+    genre_matrix = get_genre_matrix()
+    movies_subset = genre_matrix.to_frame(subset_size).reset_index()
+    movies_subset.insert(1, 'title', get_catalogue().titles[:subset_size])
 
     return movies_subset
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@traced('content_based2.content_model')
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -98,65 +79,28 @@ def content_model(movie_list,top_n=10):
     # Initializing the empty list of recommended movies
     recommended_movies = []
     
-    # Preprocess the data 
-    data = data_preprocessing(27000)
-    
-    # Create a new DataFrame
-    data1 = data.copy()
-    data2 = data.copy()
-
-    # Change the index of the DataFrame
-    data2 = data2.set_index('title')
-
-    # Delete the columns the unneccesary columns 
-    data1.drop(['title'],axis = 1,inplace=True)
-    
-    # Generating the count matrix for each genres
-    data1 = data1.set_index('movieId')
-
-    # Instantiating the model and fitting the model to the count matrix
-    nn = NearestNeighbors(algorithm='brute',metric='cosine',n_neighbors=10)
-    nn.fit(data1)
-
-    # Create an Empty list for the movieids
-    movieids = []
-
-    # Getting the movieids
-    ind1 = data2.loc[movie_list[0],'movieId']
-    ind2 = data2.loc[movie_list[1],'movieId']
-    ind3 = data2.loc[movie_list[2],'movieId']
-
-    # Adding the movieids to the list
-    movieids.extend([ind1,ind2,ind3])
-    # Setting a list of indexes
-    index_list = []
-
-    # Getting the suggestions in form of indexes
-    for i in range(len(movieids)):
-        distances,suggestions=nn.kneighbors(data1.loc[movieids[i],:].values.reshape(1,-1),n_neighbors=15)
-
-        for j in range(15):
-            index_list.append(suggestions[0,j])
-
-    # Creating an empty list to store the movie ids 
-    movieids2 = []
-    
-    # Create a for loop get the titles of the movies
-    for i in range(len(index_list)):
-        id = data1.index.values[index_list[i]]
-        movieids2.append(id)
-
-    # Create a list to store all the titles
-    title_list = []
-
-    # Create a new dataframe to get the titles of the movies and change the index to movieId 
-    data3 = data.copy()
-    data3 = data3.set_index('movieId')
-
-    for i in range(len(movieids2)):
-        title = data3.loc[movieids2[i],'title']
-        if(title not in movie_list):
-            title_list.append(title)
+    # Loading the shared sparse genre matrix (rows are catalogue rows)
+    with span('content_based2.load_genres'):
+        genre_matrix = get_genre_matrix().matrix
+
+    # Loading the neighbour index, fitted offline and shared by the process
+    with span('content_based2.load_index'):
+        nn = get_neighbour_index()
+
+    # Getting the rows of the chosen movies from the catalogue index
+    with span('content_based2.load_catalogue'):
+        catalogue = get_catalogue()
+    rows = catalogue.rows_of_titles(movie_list[:3])
+
+    # Getting the suggestions for all chosen movies in a single batched query
+    with span('content_based2.kneighbors'):
+        distances,suggestions = nn.kneighbors(genre_matrix[rows],n_neighbors=15)
+    index_list = suggestions.ravel().tolist()
+
+    # Rows of the genre matrix are catalogue rows, so titles are a direct lookup
+    with span('content_based2.titles'):
+        title_list = [title for title in catalogue.titles_of_rows(index_list)
+                      if title not in movie_list]
 
     # recommended movies 
     recommended_movies.extend(random.sample(title_list,top_n))
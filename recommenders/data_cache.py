@@ -0,0 +1,235 @@
+"""
+
+    Columnar binary cache for the MovieLens data files.
+
+    Author: Explore Data Science Academy.
+
+    Description: Converts `movies.csv` and `ratings.csv` once into a
+    typed, columnar cache of raw `.npy` arrays with compact dtypes
+    (int32 ids, float32 ratings, categorical genres). Later loads
+    memory-map the cached arrays instead of re-parsing the CSV files.
+
+    Each build lives in its own versioned directory named after the
+    content hash of the source file. A small pointer file records which
+    version belongs to the current file, and the cache is rebuilt only
+    when the file's mtime/size and its hash have both changed.
+
+"""
+
+# Script dependencies
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from recommenders.tracing import span
+
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+CACHE_DIR = 'resources/models/data_cache'
+FORMAT_VERSION = 1
+
+# Compact dtypes of the numeric columns of each data file
+MOVIES_DTYPES = {'movieId': np.int32}
+RATINGS_DTYPES = {'userId': np.int32, 'movieId': np.int32,
+                  'rating': np.float32, 'timestamp': np.int64}
+
+
+def source_stamp(path):
+    """Identify the current version of a source data file."""
+    stat = os.stat(path)
+    return {'path': path, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Compute the SHA-1 hash of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    """Write a json file atomically, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _write_strings(table_dir, name, values):
+    """Store a string column as int32 codes into a UTF-8 category buffer."""
+    codes, categories = pd.factorize(values)
+    encoded = [category.encode('utf-8') for category in categories]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    np.save(os.path.join(table_dir, name + '.codes.npy'), codes.astype(np.int32))
+    np.save(os.path.join(table_dir, name + '.offsets.npy'), offsets)
+    np.save(os.path.join(table_dir, name + '.buffer.npy'),
+            np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+
+def _read_strings(table_dir, name, categorical, mmap_mode):
+    codes = np.load(os.path.join(table_dir, name + '.codes.npy'), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(table_dir, name + '.offsets.npy')).tolist()
+    buffer = np.load(os.path.join(table_dir, name + '.buffer.npy')).tobytes()
+    categories = [buffer[start:stop].decode('utf-8')
+                  for start, stop in zip(offsets[:-1], offsets[1:])]
+    values = pd.Categorical.from_codes(codes, categories)
+    if categorical:
+        return values
+    return np.asarray(values, dtype=object)
+
+
+def _write_table(df, table_dir, dtypes, categorical):
+    columns = []
+    for name in df.columns:
+        if name in dtypes:
+            np.save(os.path.join(table_dir, name + '.npy'),
+                    df[name].to_numpy(dtype=dtypes[name]))
+            columns.append({'name': name, 'kind': 'numeric'})
+        else:
+            _write_strings(table_dir, name, df[name])
+            columns.append({'name': name, 'kind': 'string',
+                            'categorical': name in categorical})
+    schema = {'format': FORMAT_VERSION, 'rows': len(df), 'columns': columns}
+    with open(os.path.join(table_dir, 'schema.json'), 'w') as f:
+        json.dump(schema, f)
+
+
+def _read_table(table_dir, mmap_mode):
+    with open(os.path.join(table_dir, 'schema.json')) as f:
+        schema = json.load(f)
+    data = {}
+    for column in schema['columns']:
+        name = column['name']
+        if column['kind'] == 'numeric':
+            data[name] = np.load(os.path.join(table_dir, name + '.npy'), mmap_mode=mmap_mode)
+        else:
+            data[name] = _read_strings(table_dir, name, column['categorical'], mmap_mode)
+    # copy=False keeps the memory-mapped arrays as the column buffers
+    return pd.DataFrame(data, copy=False)
+
+
+def _cache_name(path):
+    """Name the cache of a data file after its stem and absolute path."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return f'{stem}-{path_hash[:8]}'
+
+
+def ensure_cache(path, dtypes, categorical=(), cache_dir=CACHE_DIR):
+    """Make sure an up-to-date cache of a data file exists.
+
+    Parameters
+    ----------
+    path : str
+        Path to the source data file in .csv format.
+    dtypes : dict
+        Numeric columns and the dtype to store them with. All other
+        columns are stored as strings.
+    categorical : tuple (str)
+        String columns to load back as pandas categoricals.
+    cache_dir : str
+        Directory holding the cache.
+
+    Returns
+    -------
+    str
+        Directory of the cached table for the current version of the file.
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    name = _cache_name(path)
+    pointer_path = os.path.join(cache_dir, name + '.json')
+    stamp = source_stamp(path)
+    pointer = _read_json(pointer_path)
+    if pointer is not None and pointer['format'] == FORMAT_VERSION \
+            and os.path.isdir(os.path.join(cache_dir, pointer['version'])):
+        if pointer['source'] == stamp:
+            return os.path.join(cache_dir, pointer['version'])
+        # The file was touched; only rebuild if its contents changed
+        digest = file_digest(path)
+        if digest == pointer['sha1']:
+            pointer['source'] = stamp
+            _write_json(pointer_path, pointer)
+            return os.path.join(cache_dir, pointer['version'])
+    else:
+        digest = file_digest(path)
+
+    version = f'{name}-v{FORMAT_VERSION}-{digest[:16]}'
+    table_dir = os.path.join(cache_dir, version)
+    if not os.path.isdir(table_dir):
+        build_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.build-')
+        with span('data_cache.parse_csv'):
+            _write_table(pd.read_csv(path), build_dir, dtypes, categorical)
+        try:
+            os.rename(build_dir, table_dir)
+        except OSError:
+            # Another process published the same version first
+            shutil.rmtree(build_dir, ignore_errors=True)
+    _write_json(pointer_path, {'format': FORMAT_VERSION, 'version': version,
+                               'sha1': digest, 'source': stamp})
+    return table_dir
+
+
+def cache_version(path, dtypes, categorical=(), cache_dir=CACHE_DIR):
+    """Version identifier of the current cache of a data file."""
+    return os.path.basename(ensure_cache(path, dtypes, categorical, cache_dir))
+
+
+def load_table(path, dtypes, categorical=(), cache_dir=CACHE_DIR, mmap=True):
+    """Load a data file through the columnar cache.
+
+    Parameters
+    ----------
+    path : str
+        Path to the source data file in .csv format.
+    dtypes : dict
+        Numeric columns and the dtype to store them with.
+    categorical : tuple (str)
+        String columns to load as pandas categoricals.
+    cache_dir : str
+        Directory holding the cache.
+    mmap : bool
+        Memory-map the numeric columns read-only instead of reading
+        them into memory.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Contents of the data file with compact dtypes.
+
+    """
+    table_dir = ensure_cache(path, dtypes, categorical, cache_dir)
+    return _read_table(table_dir, 'r' if mmap else None)
+
+
+def load_movies(path=MOVIES_PATH, cache_dir=CACHE_DIR, mmap=True):
+    """Load the movie catalogue with int32 ids and categorical genres."""
+    return load_table(path, MOVIES_DTYPES, ('genres',), cache_dir, mmap)
+
+
+def load_ratings(path=RATINGS_PATH, cache_dir=CACHE_DIR, mmap=True):
+    """Load the ratings with int32 ids and float32 ratings."""
+    return load_table(path, RATINGS_DTYPES, (), cache_dir, mmap)
+
+
+def movies_version(path=MOVIES_PATH, cache_dir=CACHE_DIR):
+    """Version identifier of the cached movie catalogue."""
+    return cache_version(path, MOVIES_DTYPES, ('genres',), cache_dir)
+
+
+def ratings_version(path=RATINGS_PATH, cache_dir=CACHE_DIR):
+    """Version identifier of the cached ratings."""
+    return cache_version(path, RATINGS_DTYPES, (), cache_dir)
@@ -0,0 +1,195 @@
+"""
+
+    Read-only arrays shared by all app and service processes.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every Streamlit process and every worker of the
+    recommendation service used to derive its own copy of the large
+    read-only arrays (the catalogue id index, the ratings grouped by user
+    and by movie in CSR layout, the augmented item vectors of the MIPS
+    index), so memory grew linearly with the number of workers. Here the
+    first process to need a set of arrays publishes it once as raw `.npy`
+    files under `resources/models/data_plane`; every process then
+    attaches to the files as read-only, memory-mapped numpy views, which
+    share one physical copy through the page cache.
+
+    Each set of arrays is published under a version derived from the
+    data it was computed from, so a process never attaches to arrays of
+    other data. Once a newer version is published, all but the newest
+    previous one are removed; a process racing the removal finds the
+    files gone, and falls back to the current version.
+    Publish everything ahead of time, e.g. before starting the workers,
+    with:
+
+        python -m recommenders.data_plane
+
+"""
+
+# Script dependencies
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from recommenders.tracing import span
+
+PLANE_DIR = 'resources/models/data_plane'
+# Bumped whenever the layout of a published set changes
+PLANE_FORMAT = 1
+
+
+def plane_version(*parts):
+    """Short version id of arrays derived from data identified by `parts`."""
+    key = json.dumps([PLANE_FORMAT] + list(parts), sort_keys=True, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def set_name(stem, *paths):
+    """Name of a set derived from some data files, e.g. `ratings_1a2b3c4d`.
+
+    Sets derived from other files get other names, so that publishing
+    one does not prune the other.
+
+    """
+    key = '\n'.join(os.path.abspath(path) for path in paths)
+    return f"{stem}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+
+def _set_dir(name, version, plane_dir):
+    return os.path.join(plane_dir, f'{name}-{version}')
+
+
+def publish(name, version, arrays, plane_dir=PLANE_DIR):
+    """Write a set of arrays under its version, in one step.
+
+    Parameters
+    ----------
+    name : str
+        Name of the set, see `set_name`.
+    version : str
+        Version of the data the arrays were derived from.
+    arrays : dict
+        Arrays of the set, by name.
+    plane_dir : str
+        Directory holding the published sets.
+
+    Returns
+    -------
+    str
+        Directory of the published set.
+
+    """
+    os.makedirs(plane_dir, exist_ok=True)
+    set_dir = _set_dir(name, version, plane_dir)
+    if os.path.isdir(set_dir):
+        return set_dir
+    build_dir = tempfile.mkdtemp(dir=plane_dir, prefix='.build-')
+    for key, array in arrays.items():
+        np.save(os.path.join(build_dir, key + '.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+        json.dump({'format': PLANE_FORMAT, 'name': name, 'version': version,
+                   'arrays': list(arrays)}, f)
+    try:
+        os.rename(build_dir, set_dir)
+    except OSError:
+        # Another process published the same version first
+        shutil.rmtree(build_dir, ignore_errors=True)
+    prune(name, version, plane_dir)
+    return set_dir
+
+
+def attach(name, version, plane_dir=PLANE_DIR):
+    """Memory-map a published set read-only, or None if not published.
+
+    A set removed while it is being attached counts as not published.
+
+    Returns
+    -------
+    dict
+        Read-only `numpy.memmap` views of the arrays, by name.
+
+    """
+    set_dir = _set_dir(name, version, plane_dir)
+    meta_path = os.path.join(set_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['format'] != PLANE_FORMAT:
+            return None
+        return {key: np.load(os.path.join(set_dir, key + '.npy'), mmap_mode='r')
+                for key in meta['arrays']}
+    except FileNotFoundError:
+        # Pruned by a process that published a newer version meanwhile
+        return None
+
+
+def prune(name, keep_version, plane_dir=PLANE_DIR):
+    """Remove the versions of a set older than the previous one.
+
+    The newest other version is kept, as processes that have not seen
+    the change yet may still be attaching to it. Processes attached to a
+    removed version keep their views; the files are only freed once they
+    are unmapped.
+
+    """
+    prefix = f'{name}-'
+    others = []
+    for entry in os.listdir(plane_dir):
+        if entry.startswith(prefix) and entry != f'{name}-{keep_version}' \
+                and '-' not in entry[len(prefix):]:
+            try:
+                others.append((os.path.getmtime(os.path.join(plane_dir, entry)), entry))
+            except FileNotFoundError:
+                continue
+    for _, entry in sorted(others)[:-1]:
+        shutil.rmtree(os.path.join(plane_dir, entry), ignore_errors=True)
+
+
+def shared_arrays(name, version, build, plane_dir=PLANE_DIR):
+    """Attach to a set of arrays, publishing it first if needed.
+
+    Parameters
+    ----------
+    name : str
+        Name of the set.
+    version : str
+        Version of the data the arrays are derived from, see
+        `plane_version`.
+    build : callable
+        Computes the arrays (a dict) when this version is not published.
+    plane_dir : str
+        Directory holding the published sets.
+
+    Returns
+    -------
+    dict
+        Read-only memory-mapped arrays, by name; the arrays built by
+        this process if the set was pruned before it could be attached.
+
+    """
+    arrays = attach(name, version, plane_dir)
+    if arrays is None:
+        with span('data_plane.publish'):
+            built = build()
+            publish(name, version, built, plane_dir)
+        arrays = attach(name, version, plane_dir)
+        if arrays is None:
+            # Already superseded and pruned; this process keeps its own copy
+            arrays = built
+    return arrays
+
+
+if __name__ == '__main__':
+    from recommenders.catalogue import get_catalogue
+    from recommenders.ratings_store import get_ratings_store
+    get_catalogue()
+    get_ratings_store()
+    for entry in sorted(os.listdir(PLANE_DIR)):
+        set_dir = os.path.join(PLANE_DIR, entry)
+        if os.path.isdir(set_dir) and not entry.startswith('.'):
+            size = sum(os.path.getsize(os.path.join(set_dir, f)) for f in os.listdir(set_dir))
+            print(f"{entry}: {size / 2 ** 20:.1f} MiB")
@@ -0,0 +1,227 @@
+"""
+
+    Pre-aggregated EDA summaries.
+
+    Author: Explore Data Science Academy.
+
+    Description: The analysis pages only chart summaries of the ratings:
+    ratings per year, the rating distribution, the mean and number of
+    ratings of every movie, movies and ratings per genre, and releases
+    per year. An offline job aggregates these once, at movie, genre,
+    year and rating-bucket granularity, into a small cube file under
+    `resources/models`, so the pages render from a few thousand rows
+    instead of holding a ratings-sized join in every Streamlit process.
+    The cube records the content version of the data files it was
+    aggregated from, so it is rebuilt when their contents change, and a
+    cube built on another host is used as long as the data is the same.
+    Build it ahead of time with:
+
+        python -m recommenders.eda_cube
+
+"""
+
+# Script dependencies
+import os
+import json
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from recommenders.catalogue import get_catalogue
+from recommenders.eda_features import (MOVIES_PATH, RATINGS_PATH, IMDB_PATH,
+                                       UNKNOWN_YEAR, features_version, get_eda_features)
+from recommenders.lazy import register_warmup
+from recommenders.result_cache import sources_version
+
+CUBE_PATH = 'resources/models/eda_cube.npz'
+# Ratings are given in half stars
+BUCKET_WIDTH = 0.5
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+class EDACube:
+    """Summaries of the ratings charted by the analysis pages.
+
+    Attributes
+    ----------
+    rating_years : Pandas Series
+        Number of ratings made in every year.
+    rating_counts : Pandas Series
+        Number of ratings of every rating value.
+    movies : Pandas Dataframe
+        One row per rated movie: `movieId`, `numRatings`, `meanRating`
+        and `moviePubYear` (`UNKNOWN_YEAR` if the title has none).
+    genres : Pandas Dataframe
+        One row per genre: `Genre`, number of catalogue `movies` and
+        `numRatings` of those movies, most movies first.
+    releases : Pandas Dataframe
+        One row per known publication year: `moviePubYear`, number of
+        rated `movies` and `numRatings` of those movies, and the same
+        for the movies with IMDB metadata (`imdbMovies`, `imdbRatings`).
+    source : str, optional
+        Content version of the data files the cube was aggregated from,
+        see `eda_features.features_version`.
+
+    """
+
+    def __init__(self, rating_years, rating_counts, movies, genres, releases, source=None):
+        self.rating_years = rating_years
+        self.rating_counts = rating_counts
+        self.movies = movies
+        self.genres = genres
+        self.releases = releases
+        self.source = source
+
+    def releases_by_year(self, years, column='movies'):
+        """Rated movies (or their `numRatings`) released in every year."""
+        counts = self.releases.set_index('moviePubYear')[column]
+        return counts.reindex(list(years), fill_value=0).to_numpy()
+
+    def movie_chart(self, n=10, min_count=0, best=True, movies_path=MOVIES_PATH):
+        """Titles, means and counts of the n best (or worst) rated movies.
+
+        Parameters
+        ----------
+        n : int
+            Number of movies.
+        min_count : int
+            Only movies with at least this many ratings.
+        best : bool
+            Highest mean ratings first, or the lowest first.
+
+        Returns
+        -------
+        Pandas Dataframe
+            `title`, `meanRating` and `numRatings` of the movies.
+
+        """
+        movies = self.movies[self.movies['numRatings'] >= min_count]
+        movies = movies.sort_values(['meanRating', 'numRatings'],
+                                    ascending=[not best, False]).head(n)
+        catalogue = get_catalogue(movies_path)
+        rows = catalogue.rows_of_movie_ids(movies['movieId'].to_numpy())
+        titles = [catalogue.titles[row] if row >= 0 else str(movie_id)
+                  for row, movie_id in zip(rows.tolist(), movies['movieId'].tolist())]
+        return pd.DataFrame({'title': titles, 'meanRating': movies['meanRating'].to_numpy(),
+                             'numRatings': movies['numRatings'].to_numpy()})
+
+
+def build_eda_cube(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH, imdb_path=IMDB_PATH):
+    """Aggregate the EDA summaries from the derived EDA tables.
+
+    The only ratings-sized work is two `bincount` passes over the
+    memory-mapped rating years and values.
+
+    Returns
+    -------
+    EDACube
+        The aggregated summaries.
+
+    """
+    features = get_eda_features(movies_path, ratings_path, imdb_path)
+    years = features.ratings['rating_year'].to_numpy()
+    first_year = int(years.min()) if len(years) else 0
+    year_counts = np.bincount(years - first_year) if len(years) else np.empty(0, dtype=np.int64)
+    rating_years = pd.Series(year_counts, index=np.arange(first_year, first_year + len(year_counts)))
+    rating_years = rating_years[rating_years > 0]
+    buckets = np.rint(features.ratings['rating'].to_numpy() / BUCKET_WIDTH).astype(np.int64)
+    bucket_counts = np.bincount(buckets) if len(buckets) else np.empty(0, dtype=np.int64)
+    rating_counts = pd.Series(bucket_counts, index=np.arange(len(bucket_counts)) * BUCKET_WIDTH)
+    rating_counts = rating_counts[rating_counts > 0]
+    # Everything else comes from the movie-level tables
+    rated = features.movies[features.movies['numRatings'] > 0]
+    movies = pd.DataFrame({'movieId': rated['movieId'].to_numpy(),
+                           'numRatings': rated['numRatings'].to_numpy(),
+                           'meanRating': rated['meanRating'].to_numpy(),
+                           'moviePubYear': rated['moviePubYear'].to_numpy()})
+    genres = features.genres.groupby('Genre', observed=True)['numRatings'] \
+        .agg(movies='count', numRatings='sum').reset_index()
+    genres = genres.sort_values('movies', ascending=False, kind='stable', ignore_index=True)
+    genres['Genre'] = genres['Genre'].astype(str)
+    # The publication year charts count the movies joined to the IMDB data
+    # separately, as the analysis pages did before the cube
+    known = rated[rated['moviePubYear'] != UNKNOWN_YEAR]
+    has_imdb = known['has_imdb'].to_numpy()
+    known = pd.DataFrame({'moviePubYear': known['moviePubYear'].to_numpy(),
+                          'numRatings': known['numRatings'].to_numpy(np.int64),
+                          'imdbMovies': has_imdb.astype(np.int64),
+                          'imdbRatings': np.where(has_imdb, known['numRatings'].to_numpy(np.int64), 0)})
+    releases = known.groupby('moviePubYear').agg(
+        movies=('numRatings', 'count'), numRatings=('numRatings', 'sum'),
+        imdbMovies=('imdbMovies', 'sum'), imdbRatings=('imdbRatings', 'sum')).reset_index()
+    return EDACube(rating_years, rating_counts, movies, genres, releases, features.version)
+
+
+def save_eda_cube(cube, path=CUBE_PATH):
+    """Store the cube, replacing the previous file in one step."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {'rating_years': cube.rating_years.index.to_numpy(),
+              'rating_year_counts': cube.rating_years.to_numpy(),
+              'ratings': cube.rating_counts.index.to_numpy(),
+              'rating_counts': cube.rating_counts.to_numpy(),
+              'genres': cube.genres['Genre'].to_numpy(dtype=str)}
+    for name, table in (('movies', cube.movies), ('genre', cube.genres.drop(columns='Genre')),
+                        ('releases', cube.releases)):
+        for column in table.columns:
+            arrays[f'{name}.{column}'] = table[column].to_numpy()
+    # A temp file of its own, so that concurrent builds do not clobber it
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps({'source': cube.source})), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_eda_cube(path=CUBE_PATH, movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH,
+                  imdb_path=IMDB_PATH):
+    """Load the stored cube, or None if missing or out of date."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as stored:
+        source = features_version(movies_path, ratings_path, imdb_path)
+        if json.loads(str(stored['meta']))['source'] != source:
+            return None
+
+        def table(name):
+            prefix = name + '.'
+            return pd.DataFrame({key[len(prefix):]: stored[key]
+                                 for key in stored.files if key.startswith(prefix)})
+        genres = table('genre')
+        genres.insert(0, 'Genre', stored['genres'].astype(object))
+        return EDACube(pd.Series(stored['rating_year_counts'], index=stored['rating_years']),
+                       pd.Series(stored['rating_counts'], index=stored['ratings']),
+                       table('movies'), genres, table('releases'), source)
+
+
+@register_warmup
+def get_eda_cube(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH, imdb_path=IMDB_PATH,
+                 path=CUBE_PATH):
+    """Return the shared EDA cube, aggregating and storing it if needed.
+
+    Checking that the cube is up to date costs a `stat` call per data
+    file; the contents are only hashed again once a file was touched.
+
+    """
+    key = (movies_path, ratings_path, imdb_path, path)
+    stamp = sources_version((movies_path, ratings_path, imdb_path))
+    cached = _cubes.get(key)
+    if cached is None or cached[0] != stamp:
+        with _cubes_lock:
+            cached = _cubes.get(key)
+            if cached is None or cached[0] != stamp:
+                cube = load_eda_cube(path, movies_path, ratings_path, imdb_path)
+                if cube is None:
+                    cube = build_eda_cube(movies_path, ratings_path, imdb_path)
+                    save_eda_cube(cube, path)
+                cached = (stamp, cube)
+                _cubes[key] = cached
+    return cached[1]
+
+
+if __name__ == '__main__':
+    cube = build_eda_cube()
+    save_eda_cube(cube)
+    print(f"EDA cube written to {CUBE_PATH} ({os.path.getsize(CUBE_PATH) / 1024:.0f} KiB): "
+          f"{len(cube.movies)} movies, {len(cube.genres)} genres, "
+          f"{len(cube.rating_years)} rating years, {len(cube.releases)} release years")
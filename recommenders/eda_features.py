@@ -0,0 +1,233 @@
+"""
+
+    Feature pipeline for the EDA pages.
+
+    Author: Explore Data Science Academy.
+
+    Description: Derives the columns the EDA pages chart (the year every
+    rating was made, the release year, the genres and the budget of every
+    movie, and per-movie rating counts and means) with vectorised
+    datetime, string and explode operations. Everything that depends only
+    on the movie is computed on the movie-level table, before anything is
+    joined to the ratings; the only ratings-sized work is a single numpy
+    conversion of the timestamps to years.
+
+    The derived tables are stored in the columnar format of
+    `recommenders.data_cache`, in a directory versioned by the contents
+    of the movie, ratings and IMDB files, so a process starting against
+    unchanged data memory-maps them instead of recomputing them. They
+    are only read to aggregate `recommenders.eda_cube`, and are not kept
+    in memory afterwards. Build them ahead of time with:
+
+        python -m recommenders.eda_features
+
+"""
+
+# Script dependencies
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from recommenders.data_cache import (load_movies, load_ratings, movies_version,
+                                     ratings_version, file_digest,
+                                     _write_table, _read_table)
+from recommenders.tracing import span
+
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+IMDB_PATH = 'resources/data/imdb_data.csv'
+FEATURES_DIR = 'resources/models/eda_features'
+# Bumped whenever the derived columns or their layout change
+FEATURES_FORMAT = 1
+# Publication year of movies whose title does not end with one
+UNKNOWN_YEAR = 9999
+
+# Compact dtypes of the numeric columns of each derived table
+MOVIE_DTYPES = {'movieId': np.int32, 'moviePubYear': np.int16, 'budget': np.int64,
+                'numRatings': np.int32, 'meanRating': np.float32, 'has_imdb': np.bool_}
+GENRE_DTYPES = {'movieId': np.int32, 'numRatings': np.int32}
+RATING_DTYPES = {'rating_year': np.int16}
+
+
+class EDAFeatures:
+    """Derived tables of the EDA pages.
+
+    Attributes
+    ----------
+    movies : Pandas Dataframe
+        One row per movie: `movieId`, `title`, `genres`, `moviePubYear`
+        (`UNKNOWN_YEAR` if the title has none), `budget` (0 if unknown),
+        `numRatings`, `meanRating` and `has_imdb`.
+    genres : Pandas Dataframe
+        One row per movie and genre: `movieId`, `Genre` and the movie's
+        `numRatings`.
+    ratings : Pandas Dataframe
+        The ratings file with the `rating_year` of every rating.
+    version : str
+        Version of the data the tables were derived from.
+
+    """
+
+    def __init__(self, movies, genres, ratings, version=None):
+        self.movies = movies
+        self.genres = genres
+        self.ratings = ratings
+        self.version = version
+
+
+def rating_years(timestamps):
+    """Calendar year (UTC) of every Unix timestamp."""
+    years = np.asarray(timestamps).astype('datetime64[s]').astype('datetime64[Y]')
+    return (years.astype(np.int64) + 1970).astype(np.int16)
+
+
+def publication_years(titles):
+    """Year from the four characters before a title's closing bracket.
+
+    Titles without a year there get `UNKNOWN_YEAR`.
+
+    """
+    years = pd.Series(titles, dtype=object).str.slice(-5, -1)
+    years = pd.to_numeric(years.where(years.str.fullmatch(r'\d{4}')), errors='coerce')
+    return years.fillna(UNKNOWN_YEAR).astype(np.int16).to_numpy()
+
+
+def parse_budgets(budgets):
+    """Amount of every budget string, without currency or separators.
+
+    Missing or unparseable budgets are 0.
+
+    """
+    amounts = pd.Series(budgets, dtype=object).str.replace(',', '', regex=False)
+    amounts = amounts.str.extract(r'(\d+)', expand=False)
+    return pd.to_numeric(amounts, errors='coerce').fillna(0).astype(np.int64).to_numpy()
+
+
+def explode_genres(movies):
+    """One row per movie and genre of the `genres` column."""
+    genres = movies[['movieId', 'genres', 'numRatings']].copy()
+    genres['Genre'] = genres.pop('genres').astype(str).str.split('|')
+    genres = genres.explode('Genre', ignore_index=True)
+    return genres[['movieId', 'Genre', 'numRatings']]
+
+
+def build_movie_table(movies, ratings, imdb=None):
+    """Movie-level features, joined to the rating counts and means.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        The movie catalogue.
+    ratings : Pandas Dataframe
+        Ratings with `movieId` and `rating` columns.
+    imdb : Pandas Dataframe, optional
+        IMDB metadata with `movieId` and `budget` columns.
+
+    Returns
+    -------
+    Pandas Dataframe
+        One row per movie, in catalogue order.
+
+    """
+    table = pd.DataFrame({'movieId': movies['movieId'].to_numpy(),
+                          'title': np.asarray(movies['title'], dtype=object),
+                          'genres': np.asarray(movies['genres'], dtype=object)})
+    table['moviePubYear'] = publication_years(table['title'])
+    # Rating counts and means per movie in one grouped pass
+    grouped = pd.Series(ratings['rating'].to_numpy(np.float64)).groupby(
+        ratings['movieId'].to_numpy()).agg(['count', 'mean'])
+    grouped = grouped.reindex(table['movieId'])
+    table['numRatings'] = grouped['count'].fillna(0).astype(np.int64).to_numpy()
+    table['meanRating'] = grouped['mean'].to_numpy()
+    if imdb is not None:
+        budgets = imdb.drop_duplicates('movieId').set_index('movieId')['budget']
+        table['budget'] = parse_budgets(budgets.reindex(table['movieId']).to_numpy())
+        table['has_imdb'] = table['movieId'].isin(budgets.index).to_numpy()
+    else:
+        table['budget'] = 0
+        table['has_imdb'] = False
+    return table
+
+
+def features_version(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH, imdb_path=IMDB_PATH):
+    """Version of the derived tables for the current data files."""
+    key = {'format': FEATURES_FORMAT, 'movies': movies_version(movies_path),
+           'ratings': ratings_version(ratings_path),
+           'imdb': file_digest(imdb_path) if os.path.exists(imdb_path) else None}
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'eda-v{FEATURES_FORMAT}-{digest[:16]}'
+
+
+def build_features(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH, imdb_path=IMDB_PATH):
+    """Derive the EDA tables from the data files.
+
+    Returns
+    -------
+    EDAFeatures
+        The derived tables, held in memory.
+
+    """
+    ratings = load_ratings(ratings_path)
+    imdb = pd.read_csv(imdb_path, usecols=['movieId', 'budget']) \
+        if os.path.exists(imdb_path) else None
+    movies = build_movie_table(load_movies(movies_path), ratings, imdb)
+    ratings = ratings.assign(rating_year=rating_years(ratings['timestamp'].to_numpy()))
+    return EDAFeatures(movies, explode_genres(movies), ratings)
+
+
+def save_features(features, version, features_dir=FEATURES_DIR):
+    """Store derived tables under their version, in one step."""
+    os.makedirs(features_dir, exist_ok=True)
+    version_dir = os.path.join(features_dir, version)
+    build_dir = tempfile.mkdtemp(dir=features_dir, prefix='.build-')
+    for name, df, dtypes in (('movies', features.movies, MOVIE_DTYPES),
+                             ('genres', features.genres, GENRE_DTYPES),
+                             ('ratings', features.ratings[['rating_year']], RATING_DTYPES)):
+        os.makedirs(os.path.join(build_dir, name))
+        _write_table(df, os.path.join(build_dir, name), dtypes, ('Genre',))
+    try:
+        os.rename(build_dir, version_dir)
+    except OSError:
+        # Another process published the same version first
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return version_dir
+
+
+def load_features(version, ratings_path=RATINGS_PATH, features_dir=FEATURES_DIR):
+    """Memory-map stored derived tables, or None if not built yet."""
+    version_dir = os.path.join(features_dir, version)
+    if not os.path.isdir(version_dir):
+        return None
+    ratings = load_ratings(ratings_path)
+    rating_year = _read_table(os.path.join(version_dir, 'ratings'), 'r')['rating_year']
+    return EDAFeatures(_read_table(os.path.join(version_dir, 'movies'), 'r'),
+                       _read_table(os.path.join(version_dir, 'genres'), 'r'),
+                       ratings.assign(rating_year=rating_year.to_numpy()), version)
+
+
+def get_eda_features(movies_path=MOVIES_PATH, ratings_path=RATINGS_PATH,
+                     imdb_path=IMDB_PATH, features_dir=FEATURES_DIR):
+    """Return the EDA tables, deriving and storing them if needed.
+
+    The tables are not cached: they hold a ratings-sized frame, and are
+    only needed while the EDA cube is aggregated. The caller drops them
+    once done.
+
+    """
+    version = features_version(movies_path, ratings_path, imdb_path)
+    features = load_features(version, ratings_path, features_dir)
+    if features is None:
+        with span('eda_features.build'):
+            save_features(build_features(movies_path, ratings_path, imdb_path),
+                          version, features_dir)
+        features = load_features(version, ratings_path, features_dir)
+    return features
+
+
+if __name__ == '__main__':
+    features = get_eda_features()
+    print(f"EDA features {features.version}: {len(features.movies)} movies, "
+          f"{len(features.genres)} movie genres, {len(features.ratings)} ratings")
@@ -0,0 +1,236 @@
+"""
+
+    Fold-in collaborative recommender over a trained factor model.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommends movies for an anonymous app user described by
+    their favourite movies alone. The favourites are projected into the
+    latent space of an SVD/SVD++ model as a pseudo-user, by solving for
+    the user factors from the favourites' item factors, and the movies
+    scoring highest against that pseudo-user are retrieved from an inner
+    product index over the item factors. No MovieLens users are involved.
+
+    Two things keep the results personal. Favourites the model was not
+    trained on are stood in for by the model's movies of the most similar
+    genres, instead of being dropped. And the items are ranked by the
+    direction of the pseudo-user's factors plus a down-weighted item
+    bias: a user solved from a few top ratings has small factors, so the
+    plain estimated rating is mostly the item bias and would give every
+    user the same well-rated movies.
+
+    `collaborative_based` and `collaborative_based2` each serve one model
+    through a `FoldInRecommender`.
+
+"""
+
+# Script dependencies
+import os
+import threading
+import numpy as np
+from sklearn.preprocessing import normalize
+from recommenders.catalogue import get_catalogue
+from recommenders.genre_encoding import get_genre_matrix
+from recommenders.lazy import Lazy
+from recommenders.mips_index import augmented_query, get_mips_index, index_path
+from recommenders.model_registry import load_scorer, pointer_path
+from recommenders.online_updates import LOG_PATH, OnlineUpdater
+from recommenders.ratings_store import get_ratings_store
+from recommenders.result_cache import sources_version
+from recommenders.svd_scoring import bundle_path
+from recommenders.tracing import span
+
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+# Item retrieval for the pseudo-user: `exact`, or `ivf` to trade recall for speed
+MIPS_MODE = 'exact'
+# Weight of the item bias against the unit-length pseudo-user factors
+BIAS_WEIGHT = 0.5
+# Model movies standing in for a favourite the model was not trained on
+PROXY_ITEMS = 10
+
+
+class FoldInRecommender:
+    """Recommends movies from the latent space of one trained model.
+
+    Parameters
+    ----------
+    name : str
+        Name the model is published under, see `model_registry`.
+    model_path : str
+        Pickle file of the model, used when no version is published.
+    span_prefix : str
+        Prefix of the tracing spans, e.g. `collaborative_based`.
+    mips_mode : str
+        Item retrieval index, `exact` or `ivf`.
+
+    Attributes
+    ----------
+    sources : tuple (str)
+        Files the recommendations depend on.
+
+    """
+
+    def __init__(self, name, model_path, span_prefix, mips_mode=MIPS_MODE):
+        self.name = name
+        self.model_path = model_path
+        self.span_prefix = span_prefix
+        self.mips_mode = mips_mode
+        self.mips_index_dir = index_path(bundle_path(model_path))
+        # Files identifying the model version; the pointer changes on publishing
+        self.model_sources = (model_path, pointer_path(name),
+                              os.path.join(bundle_path(model_path), 'meta.json'))
+        self.sources = (MOVIES_PATH, RATINGS_PATH) + self.model_sources + (LOG_PATH,)
+        # Model parameters are only loaded on first use, keeping the import
+        # cheap. The published version from train_colbased.py is used if
+        # there is one, memory-mapped from its numpy bundle where available.
+        self._scorer = Lazy(lambda: load_scorer(name, model_path))
+        # Ratings submitted in the app are folded into the model as they arrive
+        self._updater = OnlineUpdater(self._scorer, get_ratings_store)
+        self._model_version = None
+        self._lock = threading.Lock()
+        # Catalogue rows and genres of the model items, kept alongside the
+        # parameters and catalogue they belong to
+        self._item_side = (None, None, None)
+
+    def _span(self, stage):
+        return span(f'{self.span_prefix}.{stage}')
+
+    def _load_scorer(self):
+        """Current model parameters, with the logged ratings folded in.
+
+        The parameters are loaded again, and the whole log folded into
+        them again, when another version of the model has been published
+        or exported since they were loaded. Results are cached under the
+        model version, so they must never come from older parameters.
+
+        """
+        version = sources_version(self.model_sources)
+        if version != self._model_version:
+            with self._lock:
+                if version != self._model_version:
+                    if self._model_version is not None:
+                        self._scorer.reset()
+                        self._updater.reset()
+                    self._model_version = version
+        # Folding in ratings logged since the last request
+        self._updater.refresh()
+        return self._scorer.get()
+
+    def _items(self, scorer, catalogue):
+        """Catalogue rows of the model items and genres of those in the catalogue.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray, scipy.sparse.csr_matrix)
+            Catalogue row of every model item (-1 if not in the
+            catalogue), the model rows of the items in the catalogue, and
+            their L2-normalised genre vectors.
+
+        """
+        cached = self._item_side
+        if cached[0] is not scorer or cached[1] is not catalogue:
+            item_catalogue_rows = catalogue.rows_of_movie_ids(scorer.raw_iids)
+            listed = np.flatnonzero(item_catalogue_rows >= 0)
+            genres = get_genre_matrix().matrix[item_catalogue_rows[listed]]
+            cached = (scorer, catalogue,
+                      (item_catalogue_rows, listed, normalize(genres.astype(np.float32))))
+            self._item_side = cached
+        return cached[2]
+
+    def _proxy_items(self, scorer, items, rows):
+        """Model movies of the most similar genres to some catalogue movies.
+
+        Among equally similar movies the ones with the highest item bias,
+        i.e. the best received, are used.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Model rows of the proxies and their weights; the proxies of
+            every movie weigh 1 in total.
+
+        """
+        if not len(rows):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        _, listed, listed_genres = items
+        genres = normalize(get_genre_matrix().matrix[rows].astype(np.float32))
+        similarity = (listed_genres @ genres.T).toarray()
+        item_bias = np.asarray(scorer.item_bias)[listed]
+        proxies, weights = [], []
+        for column in similarity.T:
+            best = np.lexsort((-item_bias, -column))[:PROXY_ITEMS]
+            best = best[column[best] > 0]
+            if len(best):
+                proxies.append(listed[best])
+                weights.append(column[best] / column[best].sum())
+        if not proxies:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(proxies), np.concatenate(weights).astype(np.float32)
+
+    def recommend(self, seeds, weights=None, top_n=10):
+        """Recommend movies for a user described by their favourites.
+
+        The favourites are treated as top ratings when solving for the
+        pseudo-user's factors. The movies whose factors align best with
+        the pseudo-user's, adjusted by their item bias, are then
+        retrieved from the item index.
+
+        Parameters
+        ----------
+        seeds : list (str)
+            Titles of the favourite movies.
+        weights : list (float), optional
+            Weight of every favourite; all favourites weigh 1 by default.
+        top_n : int
+            Number of top recommendations to return to the user.
+
+        Returns
+        -------
+        list (str)
+            Titles of the top-n movie recommendations, best first.
+
+        """
+        with self._span('load_model'):
+            scorer = self._load_scorer()
+        with self._span('load_catalogue'):
+            catalogue = get_catalogue()
+        items = self._items(scorer, catalogue)
+        item_catalogue_rows = items[0]
+        seed_rows = np.asarray(catalogue.rows_of_titles(seeds), dtype=np.int64)
+        seed_weights = np.ones(len(seed_rows), dtype=np.float32) if weights is None \
+            else np.asarray(weights, dtype=np.float32)
+        # Model rows of the favourites; those unknown to the model get proxies
+        seed_items = scorer.item_rows(catalogue.movie_ids[seed_rows])
+        known = seed_items >= 0
+        with self._span('proxies'):
+            proxies, proxy_weights = self._proxy_items(scorer, items, seed_rows[~known])
+        fold_items = np.concatenate((seed_items[known], proxies))
+        fold_weights = np.concatenate((seed_weights[known], proxy_weights))
+        factors = np.zeros(scorer.item_factors.shape[1], dtype=np.float32)
+        if len(fold_items):
+            # Solving for the pseudo-user, treating every favourite as a top rating
+            ratings = np.full(len(fold_items), scorer.rating_scale[1], dtype=np.float32)
+            with self._span('fold_in'):
+                factors, _ = scorer.fold_in(fold_items, ratings, fold_weights)
+            norm = np.linalg.norm(factors)
+            if norm > 0:
+                factors = factors / norm
+        # Retrieving the items best aligned with the pseudo-user, with the item
+        # bias down-weighted so that it does not drown out the favourites
+        with self._span('load_index'):
+            index = get_mips_index(scorer, self.mips_mode, self.mips_index_dir,
+                                   shared=not self._updater.items_updated)
+        query = augmented_query(factors, BIAS_WEIGHT)
+        k = top_n + len(seed_rows)
+        with self._span('retrieve'):
+            while True:
+                items, _ = index.search(query, k)
+                rows = item_catalogue_rows[items]
+                # Dropping the favourites and movies missing from the catalogue
+                rows = rows[(rows >= 0) & ~np.isin(rows, seed_rows)]
+                if len(rows) >= top_n or k >= len(index):
+                    break
+                k *= 2
+        with self._span('titles'):
+            return catalogue.titles_of_rows(rows[:top_n])
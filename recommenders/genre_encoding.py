@@ -0,0 +1,119 @@
+"""
+
+    One-hot genre encoding of the movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds a sparse CSR matrix with one row per catalogue
+    movie and one uint8 column per genre. The `genres` strings are split
+    once per distinct genre combination (a few thousand, against tens of
+    thousands of movies) and expanded to every movie by indexing, so no
+    per-row Python loop is involved. The matrix is built once per process
+    and shared by the content-based recommenders.
+
+"""
+
+# Script dependencies
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from recommenders.data_cache import load_movies, source_stamp
+from recommenders.lazy import register_warmup
+
+MOVIES_PATH = 'resources/data/movies.csv'
+
+_genre_matrices = {}
+_genre_matrices_lock = threading.Lock()
+
+
+class GenreMatrix:
+    """Sparse one-hot genre matrix over the movie catalogue.
+
+    Attributes
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        uint8 matrix of shape (movies, genres); row `i` is catalogue row `i`.
+    genres : list (str)
+        Genre name of every column.
+    movie_ids : numpy.ndarray
+        MovieLens movie ID of every row.
+    source : dict
+        Stamp of the movie data the matrix was built from.
+
+    """
+
+    def __init__(self, matrix, genres, movie_ids, source=None):
+        self.matrix = matrix
+        self.genres = genres
+        self.movie_ids = movie_ids
+        self.source = source
+
+    def to_frame(self, subset_size=None):
+        """Dense Dataframe view with one 0/1 column per genre."""
+        rows = slice(None, subset_size)
+        return pd.DataFrame(self.matrix[rows].toarray(), columns=self.genres,
+                            index=pd.Index(self.movie_ids[rows], name='movieId'))
+
+
+def build_genre_matrix(movies):
+    """One-hot encode the genres of a movie catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie catalogue with `movieId` and `genres` columns.
+
+    Returns
+    -------
+    GenreMatrix
+        Sparse genre matrix over the rows of `movies`.
+
+    """
+    combinations = pd.Categorical(movies['genres'])
+    # Split each distinct genre combination only once
+    split = [combination.split('|') for combination in combinations.categories]
+    genres = sorted({genre for combination in split for genre in combination})
+    columns = {genre: column for column, genre in enumerate(genres)}
+    rows = np.repeat(np.arange(len(split)), [len(combination) for combination in split])
+    cols = np.array([columns[genre] for combination in split for genre in combination],
+                    dtype=np.int32)
+    # The extra, empty last row encodes missing genres (code -1)
+    combination_matrix = sp.csr_matrix(
+        (np.ones(len(cols), dtype=np.uint8), (rows, cols)),
+        shape=(len(split) + 1, len(genres)))
+    combination_matrix.sum_duplicates()
+    combination_matrix.data[:] = 1
+    # Expand to one row per movie by indexing with the combination codes
+    matrix = combination_matrix[np.asarray(combinations.codes)]
+    return GenreMatrix(matrix.tocsr(), genres, movies['movieId'].to_numpy())
+
+
+@register_warmup
+def get_genre_matrix(movies_path=MOVIES_PATH):
+    """Return the shared genre matrix, building it on first use.
+
+    The matrix covers the same rows as the catalogue index and is
+    rebuilt when the movie data file has changed.
+
+    Parameters
+    ----------
+    movies_path : str
+        Path to the movie catalogue in .csv format.
+
+    Returns
+    -------
+    GenreMatrix
+        Shared, read-only genre matrix.
+
+    """
+    cached = _genre_matrices.get(movies_path)
+    if cached is None or cached.source != source_stamp(movies_path):
+        with _genre_matrices_lock:
+            cached = _genre_matrices.get(movies_path)
+            if cached is None or cached.source != source_stamp(movies_path):
+                source = source_stamp(movies_path)
+                cached = build_genre_matrix(load_movies(movies_path).dropna())
+                cached.source = source
+                _genre_matrices[movies_path] = cached
+    return cached
@@ -0,0 +1,267 @@
+"""
+
+    Persisted nearest-neighbour index over the genre matrix.
+
+    Author: Explore Data Science Academy.
+
+    Description: Fits the neighbour structure used by `content_based2`
+    offline, serialises it next to the other model binaries and loads it
+    once per process. Three index types are available:
+
+        brute      Exact cosine neighbours (scikit-learn, sparse input).
+        ball_tree  Exact neighbours from a ball tree over the compact,
+                   L2-normalised genre vectors.
+        lsh        Approximate neighbours from random-projection hashing,
+                   for catalogues much larger than MovieLens.
+
+    Usage (from the root of this repository):
+
+        python -m recommenders.genre_neighbours [brute|ball_tree|lsh]
+
+"""
+
+# Script dependencies
+import os
+import sys
+import tempfile
+import threading
+import joblib
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+from recommenders.data_cache import movies_version, source_stamp
+from recommenders.genre_encoding import get_genre_matrix
+from recommenders.lazy import register_warmup
+
+MOVIES_PATH = 'resources/data/movies.csv'
+MODELS_DIR = 'resources/models'
+METHODS = ('brute', 'ball_tree', 'lsh')
+DEFAULT_METHOD = 'brute'
+# Number of catalogue rows the neighbours are drawn from
+SUBSET_SIZE = 27000
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _unit_vectors(vectors):
+    """Dense float32 rows scaled to unit length."""
+    return normalize(vectors.astype(np.float32), norm='l2').toarray()
+
+
+class RandomProjectionLSH:
+    """Approximate cosine neighbours through random hyperplane hashing.
+
+    Every table hashes a vector to the signs of its projections onto
+    `n_bits` random hyperplanes. Candidates are the vectors sharing a
+    bucket with the query in any table; they are then ranked by their
+    exact cosine distance. More tables raise recall, more bits shrink the
+    buckets and lower latency.
+
+    """
+
+    def __init__(self, n_tables=8, n_bits=10, random_state=0):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.random_state = random_state
+
+    def _hash(self, vectors):
+        projections = np.einsum('nd,tdb->tnb', vectors, self.planes_)
+        return (projections > 0) @ (1 << np.arange(self.n_bits, dtype=np.int64))
+
+    def fit(self, vectors):
+        rng = np.random.default_rng(self.random_state)
+        self.vectors_ = vectors
+        self.planes_ = rng.standard_normal(
+            (self.n_tables, vectors.shape[1], self.n_bits)).astype(np.float32)
+        codes = self._hash(vectors)
+        # Sorting each table's codes turns a bucket lookup into a binary search
+        self.order_ = np.argsort(codes, axis=1, kind='stable')
+        self.sorted_codes_ = np.take_along_axis(codes, self.order_, axis=1)
+        return self
+
+    def kneighbors(self, vectors, n_neighbors):
+        codes = self._hash(vectors)
+        distances = np.empty((len(vectors), n_neighbors), dtype=np.float32)
+        indices = np.empty((len(vectors), n_neighbors), dtype=np.int64)
+        for q, vector in enumerate(vectors):
+            buckets = []
+            for t in range(self.n_tables):
+                start, stop = np.searchsorted(self.sorted_codes_[t], [codes[t, q], codes[t, q] + 1])
+                buckets.append(self.order_[t, start:stop])
+            candidates = np.unique(np.concatenate(buckets))
+            if len(candidates) < n_neighbors:
+                # Too few collisions: fall back to an exact scan
+                candidates = np.arange(len(self.vectors_))
+            candidate_distances = 1 - self.vectors_[candidates] @ vector
+            top = np.argpartition(candidate_distances, n_neighbors - 1)[:n_neighbors]
+            top = top[np.argsort(candidate_distances[top], kind='stable')]
+            distances[q] = candidate_distances[top]
+            indices[q] = candidates[top]
+        return distances, indices
+
+
+class GenreNeighbours:
+    """Fitted neighbour index over the first rows of the genre matrix.
+
+    Neighbour indices are catalogue rows and distances are cosine
+    distances, whatever the index type.
+
+    """
+
+    def __init__(self, method, estimator, subset_size, source=None):
+        self.method = method
+        self.estimator = estimator
+        self.subset_size = subset_size
+        self.source = source
+
+    def kneighbors(self, vectors, n_neighbors=15):
+        """Find the neighbours of a batch of genre vectors.
+
+        Parameters
+        ----------
+        vectors : scipy.sparse.csr_matrix
+            Rows of the genre matrix to query, one per seed movie.
+        n_neighbors : int
+            Number of neighbours per query.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Cosine distances and catalogue rows, one row per query.
+
+        """
+        if self.method == 'brute':
+            return self.estimator.kneighbors(vectors, n_neighbors=n_neighbors)
+        distances, indices = self.estimator.kneighbors(_unit_vectors(vectors), n_neighbors)
+        if self.method == 'ball_tree':
+            # Euclidean distance between unit vectors maps onto cosine distance
+            distances = distances ** 2 / 2
+        return distances, indices
+
+
+def build_neighbour_index(genre_matrix, method=DEFAULT_METHOD, subset_size=SUBSET_SIZE):
+    """Fit a neighbour index over the first rows of a genre matrix.
+
+    Parameters
+    ----------
+    genre_matrix : scipy.sparse.csr_matrix
+        One-hot genre matrix over the catalogue.
+    method : str
+        One of `brute`, `ball_tree` or `lsh`.
+    subset_size : int
+        Number of catalogue rows to index.
+
+    Returns
+    -------
+    GenreNeighbours
+        Fitted neighbour index.
+
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown neighbour index method: {method}")
+    data = genre_matrix[:subset_size]
+    if method == 'brute':
+        estimator = NearestNeighbors(algorithm='brute', metric='cosine').fit(data)
+    elif method == 'ball_tree':
+        estimator = NearestNeighbors(algorithm='ball_tree').fit(_unit_vectors(data))
+    else:
+        estimator = RandomProjectionLSH().fit(_unit_vectors(data))
+    return GenreNeighbours(method, estimator, subset_size)
+
+
+def index_path(method=DEFAULT_METHOD, models_dir=MODELS_DIR):
+    """Location of the serialised index of a given type."""
+    return os.path.join(models_dir, f'genre_neighbours_{method}.joblib')
+
+
+def save_neighbour_index(index, path):
+    """Serialise an index, replacing the previous file in one step.
+
+    Other processes may be loading the previous file meanwhile, so the
+    index is dumped to a temp file next to it first.
+
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        joblib.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def load_neighbour_index(method=DEFAULT_METHOD, movies_path=MOVIES_PATH,
+                         models_dir=MODELS_DIR, subset_size=SUBSET_SIZE):
+    """Load a serialised neighbour index, fitting and saving it if needed.
+
+    The index is refitted when it is missing or was fitted on a different
+    version of the movie data.
+
+    Parameters
+    ----------
+    method : str
+        One of `brute`, `ball_tree` or `lsh`.
+    movies_path : str
+        Path to the movie catalogue in .csv format.
+    models_dir : str
+        Directory holding the serialised index.
+    subset_size : int
+        Number of catalogue rows to index.
+
+    Returns
+    -------
+    GenreNeighbours
+        Fitted neighbour index.
+
+    """
+    source = movies_version(movies_path)
+    path = index_path(method, models_dir)
+    if os.path.exists(path):
+        index = joblib.load(path)
+        if index.source == source and index.subset_size == subset_size:
+            return index
+    index = build_neighbour_index(get_genre_matrix(movies_path).matrix, method, subset_size)
+    index.source = source
+    save_neighbour_index(index, path)
+    return index
+
+
+@register_warmup
+def get_neighbour_index(method=DEFAULT_METHOD, movies_path=MOVIES_PATH):
+    """Return the process-wide neighbour index, loading it on first use.
+
+    The index is loaded again when the movie data file has changed.
+
+    Parameters
+    ----------
+    method : str
+        One of `brute`, `ball_tree` or `lsh`.
+    movies_path : str
+        Path to the movie catalogue in .csv format.
+
+    Returns
+    -------
+    GenreNeighbours
+        Shared, fitted neighbour index.
+
+    """
+    key = (method, movies_path)
+    stamp, index = _indexes.get(key, (None, None))
+    if index is None or stamp != source_stamp(movies_path):
+        with _indexes_lock:
+            stamp, index = _indexes.get(key, (None, None))
+            if index is None or stamp != source_stamp(movies_path):
+                stamp = source_stamp(movies_path)
+                index = load_neighbour_index(method, movies_path)
+                _indexes[key] = (stamp, index)
+    return index
+
+
+if __name__ == '__main__':
+    # Fitted through the importable module, so that the pickled index
+    # refers to its classes there rather than to __main__
+    from recommenders.genre_neighbours import build_neighbour_index, save_neighbour_index
+    method = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_METHOD
+    index = build_neighbour_index(get_genre_matrix(MOVIES_PATH).matrix, method)
+    index.source = movies_version(MOVIES_PATH)
+    save_neighbour_index(index, index_path(method))
+    print(f"Fitted {method} neighbour index saved to: {index_path(method)}")
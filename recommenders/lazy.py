@@ -0,0 +1,130 @@
+"""
+
+    Lazily initialised, thread-safe resources.
+
+    Author: Explore Data Science Academy.
+
+    Description: Lets the recommender modules defer loading their data
+    and models until first use, so importing them is cheap. Every lazy
+    resource registers itself, and `warmup()` loads them all up front,
+    e.g. from a readiness probe:
+
+        python -m recommenders.lazy
+
+    Scripts re-run on every interaction, like the Streamlit app, can
+    instead start their loaders once per process in the background.
+
+"""
+
+# Script dependencies
+import importlib
+import threading
+
+# Modules whose resources are loaded by `warmup`
+RECOMMENDER_MODULES = (
+    'recommenders.content_based',
+    'recommenders.content_based2',
+    'recommenders.collaborative_based',
+    'recommenders.collaborative_based2',
+)
+# Modules of the app pages, also loaded by `warmup`
+PAGE_MODULES = (
+    'recommenders.movie_search',
+    'recommenders.top_charts',
+)
+
+_warmup_hooks = []
+_background_hooks = set()
+_background_lock = threading.Lock()
+
+
+def register_warmup(hook):
+    """Register a callable that loads a resource during `warmup`."""
+    _warmup_hooks.append(hook)
+    return hook
+
+
+class Lazy:
+    """A value computed by `loader` on first access, exactly once.
+
+    Concurrent first accesses block until the single load has finished.
+
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+        register_warmup(self.get)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        """Return the value, loading it first if needed."""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._loader()
+                    self._loaded = True
+        return self._value
+
+    def set(self, value):
+        """Replace the value, e.g. with an updated model, in one step."""
+        with self._lock:
+            self._value = value
+            self._loaded = True
+
+    def reset(self):
+        """Drop the value so that the next access loads it again."""
+        with self._lock:
+            self._loaded = False
+            self._value = None
+
+
+def warmup(modules=RECOMMENDER_MODULES + PAGE_MODULES):
+    """Import the recommenders and load all of their lazy resources.
+
+    Parameters
+    ----------
+    modules : tuple (str)
+        Names of the recommender modules to warm up.
+
+    """
+    for name in modules:
+        importlib.import_module(name)
+    for hook in list(_warmup_hooks):
+        hook()
+
+
+def warm_in_background(*hooks):
+    """Run loaders in a daemon thread, each at most once per process.
+
+    The first use of a resource still being loaded waits for that load
+    instead of starting another.
+
+    Parameters
+    ----------
+    hooks : callable
+        Loaders to run, e.g. `warm_movie_search`.
+
+    """
+    with _background_lock:
+        hooks = [hook for hook in hooks if hook not in _background_hooks]
+        _background_hooks.update(hooks)
+    if hooks:
+        threading.Thread(target=_run_hooks, args=(hooks,), daemon=True).start()
+
+
+def _run_hooks(hooks):
+    for hook in hooks:
+        hook()
+
+
+if __name__ == '__main__':
+    # Run through the importable module, which holds the shared registry
+    lazy = importlib.import_module('recommenders.lazy')
+    lazy.warmup()
+    print(f"Warm-up completed: {len(lazy._warmup_hooks)} resources loaded.")
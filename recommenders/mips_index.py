@@ -0,0 +1,307 @@
+"""
+
+    Top-N item retrieval over SVD item factors.
+
+    Author: Explore Data Science Academy.
+
+    Description: Maximum inner product search (MIPS) index over the item
+    side of a factor model. A user's estimated rating of item `i` is,
+    up to terms that are the same for every item, `bi + qi . pu`, so the
+    items are indexed as the augmented vectors `[qi, bi]` and queried
+    with `[pu, 1]`. Two index types are available:
+
+        exact  Blocked, float32 matrix products (BLAS) over all items,
+               keeping only a running top-k, so memory stays bounded.
+        ivf    Approximate inverted-file index: items are clustered
+               offline and a query only scores the items of the
+               `n_probe` clusters whose centroids match it best. Raising
+               `n_probe` trades latency for recall.
+
+    The IVF index is built offline next to the model parameters and
+    compared with brute force on random users from the model:
+
+        python -m recommenders.mips_index resources/models/SVD.pkl
+
+    The augmented item vectors are published once through
+    `recommenders.data_plane` and shared by all processes.
+
+"""
+
+# Script dependencies
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from recommenders.data_plane import shared_arrays
+
+BLOCK_SIZE = 16384
+N_LISTS = 64
+N_PROBE = 8
+# Bumped whenever the layout of a stored index changes
+INDEX_FORMAT = 1
+
+# Index per (mode, index location), kept alongside the item factors it covers
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def augmented_items(scorer):
+    """Item vectors `[qi, bi]` whose inner products rank the items."""
+    return np.hstack((np.asarray(scorer.item_factors, dtype=np.float32),
+                      np.asarray(scorer.item_bias, dtype=np.float32)[:, None]))
+
+
+def augmented_query(user_factors, bias_weight=1.0):
+    """Query vector `[pu, w]` for a user's factors.
+
+    With the default weight of 1 the inner products are the estimated
+    ratings, up to the user's bias and the global mean.
+
+    """
+    return np.append(np.asarray(user_factors, dtype=np.float32), np.float32(bias_weight))
+
+
+def items_digest(scorer):
+    """Hash of the item side of a model, to match indexes to models."""
+    digest = hashlib.sha1()
+    for array in (scorer.item_factors, scorer.item_bias, scorer.raw_iids):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def _merge_top_k(rows, scores, k):
+    """The k best (row, score) pairs, best first."""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[best], scores[best]
+    order = np.lexsort((rows, -scores))
+    return rows[order], scores[order]
+
+
+class ExactMIPS:
+    """Exact top-k inner products, one block of items at a time."""
+
+    def __init__(self, vectors, block_size=BLOCK_SIZE):
+        self.vectors = vectors
+        self.block_size = block_size
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query, k):
+        """Rows and scores of the k items with the largest inner product."""
+        k = min(k, len(self.vectors))
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_size):
+            block_scores = self.vectors[start:start + self.block_size] @ query
+            rows = np.concatenate((best_rows, start + np.arange(len(block_scores))))
+            scores = np.concatenate((best_scores, block_scores))
+            best_rows, best_scores = _merge_top_k(rows, scores, k)
+        return best_rows, best_scores
+
+
+class IVFMIPS:
+    """Approximate top-k inner products over clustered items.
+
+    Attributes
+    ----------
+    centroids : numpy.ndarray
+        Mean vector of every cluster.
+    indptr, items : numpy.ndarray
+        Items of cluster `c` are `items[indptr[c]:indptr[c + 1]]`.
+    n_probe : int
+        Number of clusters scored per query.
+
+    """
+
+    def __init__(self, vectors, centroids, indptr, items, n_probe=N_PROBE):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.indptr = indptr
+        self.items = items
+        self.n_probe = n_probe
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, n_lists=N_LISTS, n_iter=20, n_probe=N_PROBE, seed=0):
+        """Cluster the items with k-means on their directions."""
+        rng = np.random.default_rng(seed)
+        n_lists = min(n_lists, len(vectors))
+        directions = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        centroids = directions[rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignment = np.argmax(directions @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = directions[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        assignment = np.argmax(directions @ centroids.T, axis=1)
+        # Probing uses the clusters' mean item vectors, norms included
+        sums = np.zeros((n_lists, vectors.shape[1]), dtype=np.float32)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_lists)
+        mean_vectors = sums / np.maximum(counts, 1)[:, None]
+        items = np.argsort(assignment, kind='stable').astype(np.int64)
+        indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls(vectors, mean_vectors.astype(np.float32), indptr, items, n_probe)
+
+    def search(self, query, k, n_probe=None):
+        """Approximate rows and scores of the k best items.
+
+        Falls back to more clusters when the probed ones hold fewer than
+        `k` items.
+
+        """
+        n_probe = n_probe or self.n_probe
+        centroid_order = np.argsort(-(self.centroids @ query), kind='stable')
+        probed = centroid_order[:n_probe]
+        while (self.indptr[probed + 1] - self.indptr[probed]).sum() < k \
+                and len(probed) < len(centroid_order):
+            probed = centroid_order[:2 * len(probed)]
+        rows = np.concatenate([self.items[self.indptr[c]:self.indptr[c + 1]] for c in probed])
+        return _merge_top_k(rows, self.vectors[rows] @ query, min(k, len(rows)))
+
+    def save(self, index_dir, digest):
+        """Store the clusters, tagged with the digest of the model's items."""
+        os.makedirs(index_dir, exist_ok=True)
+        for name in ('centroids', 'indptr', 'items'):
+            np.save(os.path.join(index_dir, name + '.npy'), getattr(self, name))
+        with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+            json.dump({'format': INDEX_FORMAT, 'items_sha1': digest,
+                       'n_items': len(self), 'n_probe': self.n_probe}, f)
+
+    @classmethod
+    def load(cls, index_dir, vectors, digest):
+        """Memory-map a stored index, or None if it belongs to other items."""
+        meta_path = os.path.join(index_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT or meta['items_sha1'] != digest:
+            return None
+        arrays = {name: np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r')
+                  for name in ('centroids', 'indptr', 'items')}
+        return cls(vectors, n_probe=meta['n_probe'], **arrays)
+
+
+def index_path(bundle_dir):
+    """Location of the IVF index of a model bundle."""
+    return bundle_dir.rstrip(os.sep) + '_ivf'
+
+
+def build_mips_index(scorer, mode='exact', index_dir=None, shared=True, previous=None):
+    """Item retrieval index over a model's parameters.
+
+    Parameters
+    ----------
+    scorer : SVDScorer
+        Model parameters.
+    mode : str
+        `exact`, or `ivf` for the approximate index.
+    index_dir : str, optional
+        Where the IVF index is stored. It is loaded from there when it
+        matches the model, and built (and stored) otherwise.
+    shared : bool
+        Whether the items are those of a published model. Items updated
+        online differ per update, so they are only indexed in process
+        memory: nothing is published or stored for them.
+    previous : IVFMIPS, optional
+        Index of the same items before an online update, whose clusters
+        are reused instead of clustering the items again.
+
+    Returns
+    -------
+    ExactMIPS or IVFMIPS
+        Index over the augmented item vectors.
+
+    """
+    if mode not in ('exact', 'ivf'):
+        raise ValueError(f"Unknown MIPS index mode: {mode}")
+    if not shared:
+        vectors = augmented_items(scorer)
+        if mode == 'exact':
+            return ExactMIPS(vectors)
+        if isinstance(previous, IVFMIPS) and len(previous) == len(vectors):
+            return IVFMIPS(vectors, previous.centroids, previous.indptr, previous.items,
+                           previous.n_probe)
+        return IVFMIPS.build(vectors)
+    digest = items_digest(scorer)
+    # Named after the items themselves, so the sets of several models coexist
+    vectors = shared_arrays(f'mips_items_{digest[:8]}', digest[8:24],
+                            lambda: {'vectors': augmented_items(scorer)})['vectors']
+    if mode == 'exact':
+        return ExactMIPS(vectors)
+    index = IVFMIPS.load(index_dir, vectors, digest) if index_dir else None
+    if index is None:
+        index = IVFMIPS.build(vectors)
+        if index_dir:
+            index.save(index_dir, digest)
+    return index
+
+
+def get_mips_index(scorer, mode='exact', index_dir=None, shared=True):
+    """Shared index over a model's items, rebuilt when the items change.
+
+    Online updates that only replace user factors keep the item arrays,
+    and with them the index of the previous parameters. See
+    `build_mips_index` for `shared`.
+
+    """
+    key = (mode, index_dir)
+    cached = _indexes.get(key)
+    if cached is None or cached[0] is not scorer.item_factors:
+        with _indexes_lock:
+            cached = _indexes.get(key)
+            if cached is None or cached[0] is not scorer.item_factors:
+                previous = cached[1] if cached is not None else None
+                cached = (scorer.item_factors,
+                          build_mips_index(scorer, mode, index_dir, shared, previous))
+                _indexes[key] = cached
+    return cached[1]
+
+
+def compare_with_brute_force(scorer, index, k=10, n_queries=200, seed=0, **search_args):
+    """Recall@k and mean latency (ms) of an index against a full sort."""
+    rng = np.random.default_rng(seed)
+    vectors = augmented_items(scorer)
+    users = rng.choice(len(scorer.user_factors), min(n_queries, len(scorer.user_factors)),
+                       replace=False)
+    recall, elapsed, brute_elapsed = 0.0, 0.0, 0.0
+    for user in users:
+        query = augmented_query(scorer.user_factors[user])
+        start = time.perf_counter()
+        truth = np.argsort(-(vectors @ query), kind='stable')[:k]
+        brute_elapsed += time.perf_counter() - start
+        start = time.perf_counter()
+        rows, _ = index.search(query, k, **search_args)
+        elapsed += time.perf_counter() - start
+        recall += len(np.intersect1d(rows, truth)) / k
+    n = len(users)
+    return {'recall': recall / n, 'latency_ms': 1000 * elapsed / n,
+            'brute_force_ms': 1000 * brute_elapsed / n}
+
+
+if __name__ == '__main__':
+    import pickle
+    from recommenders.svd_scoring import SVDScorer, bundle_matches, bundle_path
+    model_path = sys.argv[1]
+    bundle_dir = bundle_path(model_path)
+    if bundle_matches(bundle_dir, model_path):
+        scorer = SVDScorer.load(bundle_dir)
+    else:
+        with open(model_path, 'rb') as f:
+            scorer = SVDScorer.from_model(pickle.load(f))
+    ivf = build_mips_index(scorer, 'ivf', index_path(bundle_dir))
+    print(f"IVF index saved to: {index_path(bundle_dir)}")
+    print(f"exact: {compare_with_brute_force(scorer, build_mips_index(scorer))}")
+    for n_probe in (1, 2, 4, 8, 16, 32):
+        print(f"ivf n_probe={n_probe}: "
+              f"{compare_with_brute_force(scorer, ivf, n_probe=n_probe)}")
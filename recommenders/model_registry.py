@@ -0,0 +1,152 @@
+"""
+
+    Versioned model artifacts.
+
+    Author: Explore Data Science Academy.
+
+    Description: Publishes trained models as immutable, versioned
+    artifacts under `resources/models/artifacts/` and keeps a small
+    pointer file per model name (e.g. `resources/models/SVD.json`) naming
+    the version the app should load. Publishing a new version only
+    rewrites the pointer, atomically, so running apps never see a
+    half-written model. Models that were never published are loaded from
+    their original pickle files.
+
+    Matrix factorisation models are also published as a bundle of raw
+    `.npy` parameter arrays (see `recommenders.svd_scoring`), which the
+    collaborative recommenders memory-map instead of unpickling the
+    Surprise model.
+
+"""
+
+# Script dependencies
+import os
+import json
+import time
+import pickle
+import hashlib
+from recommenders.data_cache import _write_json
+from recommenders.svd_scoring import SVDScorer, bundle_matches, bundle_path, pickle_source
+from recommenders.tracing import traced
+
+MODELS_DIR = 'resources/models'
+ARTIFACTS_DIR = 'artifacts'
+
+
+def pointer_path(name, models_dir=MODELS_DIR):
+    """Location of the pointer file of a model name."""
+    return os.path.join(models_dir, name + '.json')
+
+
+def publish_model(model, name, metadata=None, models_dir=MODELS_DIR):
+    """Store a model as a new version and point its name at it.
+
+    Parameters
+    ----------
+    model : object
+        Trained model to pickle.
+    name : str
+        Name the app loads the model by, e.g. `SVD`.
+    metadata : dict, optional
+        Training parameters, scores, data version etc. to keep with the model.
+    models_dir : str
+        Directory holding the pointer files and artifacts.
+
+    Returns
+    -------
+    str
+        Directory of the published artifact.
+
+    """
+    payload = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha1(payload).hexdigest()
+    version = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{digest[:8]}"
+    artifact_dir = os.path.join(models_dir, ARTIFACTS_DIR, version)
+    os.makedirs(artifact_dir, exist_ok=True)
+    model_path = os.path.join(artifact_dir, 'model.pkl')
+    with open(model_path, 'wb') as f:
+        f.write(payload)
+    if hasattr(model, 'qi'):
+        # Factor matrices, biases and id maps for loading without Surprise
+        SVDScorer.from_model(model).save(os.path.join(artifact_dir, 'factors'),
+                                         pickle_source(model_path))
+    with open(os.path.join(artifact_dir, 'metadata.json'), 'w') as f:
+        json.dump(dict(metadata or {}, name=name, version=version, sha1=digest), f,
+                  indent=2)
+    _write_json(pointer_path(name, models_dir),
+                {'name': name, 'version': version,
+                 'path': os.path.join(ARTIFACTS_DIR, version, 'model.pkl')})
+    return artifact_dir
+
+
+def published_model_path(name, default_path, models_dir=MODELS_DIR):
+    """Path of the published version of a model, or `default_path`."""
+    path = pointer_path(name, models_dir)
+    if not os.path.exists(path):
+        return default_path
+    with open(path) as f:
+        pointer = json.load(f)
+    return os.path.join(models_dir, pointer['path'])
+
+
+def load_model(name, default_path, models_dir=MODELS_DIR):
+    """Unpickle the published version of a model.
+
+    Parameters
+    ----------
+    name : str
+        Name the model was published under.
+    default_path : str
+        Pickle file to load when no version has been published.
+    models_dir : str
+        Directory holding the pointer files and artifacts.
+
+    Returns
+    -------
+    object
+        The trained model.
+
+    """
+    with open(published_model_path(name, default_path, models_dir), 'rb') as f:
+        return pickle.load(f)
+
+
+@traced('model_registry.load_scorer')
+def load_scorer(name, default_path, models_dir=MODELS_DIR):
+    """Memory-map the parameters of the published version of a model.
+
+    Falls back to the bundle exported next to `default_path`, and only
+    unpickles the Surprise model when no bundle exists, or when the
+    bundle was exported from another version of the pickle, exporting
+    the bundle there for the next process to map.
+
+    Parameters
+    ----------
+    name : str
+        Name the model was published under.
+    default_path : str
+        Pickle file to load when no version has been published.
+    models_dir : str
+        Directory holding the pointer files and artifacts.
+
+    Returns
+    -------
+    SVDScorer
+        Scorer over the model parameters.
+
+    """
+    model_path = published_model_path(name, default_path, models_dir)
+    if model_path == default_path:
+        factors_dir = bundle_path(default_path)
+    else:
+        factors_dir = os.path.join(os.path.dirname(model_path), 'factors')
+    if bundle_matches(factors_dir, model_path):
+        return SVDScorer.load(factors_dir)
+    with open(model_path, 'rb') as f:
+        scorer = SVDScorer.from_model(pickle.load(f))
+    try:
+        # Exported once, so that every other process maps the bundle
+        scorer.save(factors_dir, pickle_source(model_path))
+    except OSError:
+        return scorer
+    return SVDScorer.load(factors_dir)
@@ -0,0 +1,418 @@
+"""
+
+    Movie title search.
+
+    Author: Explore Data Science Academy.
+
+    Description: Search index over the catalogue titles for the "Search
+    Movies" page, built once per process (by `warmup()`, or in the
+    background when the app starts). Titles are normalised (lower
+    case, accents and punctuation removed, release year kept as a word)
+    and indexed twice: a sorted list of the titles from every word start
+    answers prefix matches by binary search, and the postings of every
+    character trigram narrow substring matches down to the titles sharing
+    all of the query's trigrams, instead of scanning the whole catalogue.
+    Queries shorter than a trigram are looked up in postings of every
+    character and character pair, and queries of punctuation alone in
+    every raw title, so every title containing the query is still found.
+
+    Matches are ranked (exact title, then title prefix, then word prefix,
+    then any substring) and returned a page at a time. Fuzzy matching
+    compares words instead: every query word is matched to the title
+    words at most one typo away (a missing, extra, wrong or swapped
+    letter), found through an index of the words with each letter
+    deleted, and titles are ranked by how closely their words match the
+    whole query. Results can be filtered by release year and genre.
+
+"""
+
+# Script dependencies
+import re
+import bisect
+import threading
+import unicodedata
+import numpy as np
+from operator import itemgetter
+from collections import OrderedDict, defaultdict
+from recommenders.catalogue import get_catalogue, release_years
+from recommenders.data_cache import source_stamp
+from recommenders.genre_encoding import get_genre_matrix
+from recommenders.lazy import register_warmup
+
+MOVIES_PATH = 'resources/data/movies.csv'
+PAGE_SIZE = 20
+# Most matches ranked for a query
+MAX_RESULTS = 500
+# Least similarity of the query's words to a title's words, weighted by
+# their lengths, for a fuzzy match
+FUZZY_THRESHOLD = 0.6
+# Shortest word matched with a typo; shorter words only match exactly
+FUZZY_MIN_LENGTH = 3
+# Ranked matches kept for the most recent queries, e.g. while paging
+QUERY_CACHE_SIZE = 256
+
+_YEAR = re.compile(r'\s*\(\d{4}\)\s*$')
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+_searches = {}
+_searches_lock = threading.Lock()
+
+
+def normalise(text):
+    """Lower-case words of a text, without accents or punctuation."""
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def gram_postings(names, sizes):
+    """Rows of the names containing every character n-gram.
+
+    Parameters
+    ----------
+    names : list (str)
+        Normalised texts, of ASCII letters, digits and spaces.
+    sizes : tuple (int)
+        Lengths of the n-grams to index, at most 3. Trigrams are taken
+        from the names padded with a space at both ends, so that they
+        also mark word starts and ends; shorter n-grams only from within
+        words.
+
+    Returns
+    -------
+    dict
+        Ascending array of rows for every n-gram.
+
+    """
+    # All names in one byte array, split by line feeds no n-gram spans
+    text = '\n'.join(f" {name} " for name in names)
+    codes = np.frombuffer(text.encode('ascii'), dtype=np.uint8).astype(np.int64)
+    row_of = np.repeat(np.arange(len(names)), [len(name) + 3 for name in names])[:len(codes)]
+    postings = {}
+    for size in sizes:
+        n_grams = len(codes) - size + 1
+        windows = [codes[i:i + n_grams] for i in range(size)]
+        valid = np.ones(n_grams, dtype=bool)
+        for window in windows:
+            valid &= window != ord('\n')
+            if size < 3:
+                valid &= window != ord(' ')
+        ids = np.zeros(n_grams, dtype=np.int64)
+        for window in windows:
+            ids = ids * 256 + window
+        # Every (n-gram, row) pair once, grouped by n-gram then ordered by row
+        pairs = np.sort(ids[valid] * len(names) + row_of[:n_grams][valid])
+        pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+        ids, rows = np.divmod(pairs, len(names))
+        starts = np.flatnonzero(np.diff(ids, prepend=-1))
+        groups = np.split(rows.astype(np.int32), starts[1:])
+        for gram_id, gram_rows in zip(ids[starts].tolist(), groups):
+            postings[gram_id.to_bytes(size, 'big').decode('ascii')] = gram_rows
+    return postings
+
+
+def deletions(word):
+    """A word and every string made by deleting one of its letters."""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def edit_distance(a, b):
+    """Number of inserted, deleted, replaced or swapped adjacent letters
+    that turn one word into the other."""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SearchResults:
+    """One page of ranked search results.
+
+    Attributes
+    ----------
+    rows : list (int)
+        Catalogue rows of the movies on the page, best match first.
+    titles : list (str)
+        Titles of those movies.
+    total : int
+        Number of matching titles; only the best `MAX_RESULTS` of them
+        are ranked and paged.
+    page, n_pages : int
+        Number of this page (from 1) and of all pages.
+
+    """
+
+    def __init__(self, rows, titles, total, page, n_pages):
+        self.rows = rows
+        self.titles = titles
+        self.total = total
+        self.page = page
+        self.n_pages = n_pages
+
+
+class MovieSearch:
+    """Trigram, word prefix and word index over the catalogue titles."""
+
+    def __init__(self, catalogue, genre_matrix, source=None):
+        self.catalogue = catalogue
+        self.genre_matrix = genre_matrix
+        self.source = source
+        self.names = [normalise(title) for title in catalogue.titles]
+        self.years = release_years(catalogue.titles)
+        self.name_lengths = np.array([len(name) for name in self.names], dtype=np.int64)
+        # Sort key of every title within its tier: length, then row
+        self._length_keys = self.name_lengths * len(self.names) + np.arange(len(self.names))
+        self._tier_step = (int(self.name_lengths.max(initial=0)) + 1) * len(self.names)
+        # Length of every title without its year (the last word), for exact matches
+        has_year = np.array([_YEAR.search(title) is not None for title in catalogue.titles],
+                            dtype=bool)
+        self.lengths = np.where(has_year, np.maximum(self.name_lengths - 5, 0),
+                                self.name_lengths)
+        self._lower_titles = [title.lower() for title in catalogue.titles]
+        word_postings = defaultdict(list)
+        suffixes = []
+        for row, name in enumerate(self.names):
+            words = name.split(' ')
+            for word in set(words):
+                word_postings[word].append(row)
+            # Every title from each of its word starts, for word prefix matches
+            start = 0
+            for word in words:
+                suffixes.append((name[start:], start, row))
+                start += len(word) + 1
+        self.postings = gram_postings(self.names, (3,))
+        # Characters and character pairs, for queries shorter than a trigram
+        self._short_postings = gram_postings(self.names, (1, 2))
+        self._word_rows = {word: np.array(rows, dtype=np.int32)
+                           for word, rows in word_postings.items() if word}
+        # Built on the first fuzzy search
+        self._deletions = None
+        self._deletions_lock = threading.Lock()
+        suffixes.sort(key=itemgetter(0))
+        self._suffixes = [suffix for suffix, _, _ in suffixes]
+        self._suffix_starts = np.array([start for _, start, _ in suffixes], dtype=np.int64)
+        self._suffix_rows = np.array([row for _, _, row in suffixes], dtype=np.int64)
+        self._genre_masks = {}
+        self._queries = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def _genre_mask(self, genre):
+        """Whether every catalogue movie is of a genre."""
+        mask = self._genre_masks.get(genre)
+        if mask is None:
+            mask = np.zeros(len(self.names), dtype=bool)
+            genres = list(self.genre_matrix.genres)
+            if genre in genres:
+                mask[self.genre_matrix.matrix[:, genres.index(genre)].nonzero()[0]] = True
+            self._genre_masks[genre] = mask
+        return mask
+
+    def _prefix_rows(self, query):
+        """Rows of the titles with a word starting with the query, once
+        per such word, and whether it is the title's first word."""
+        start = bisect.bisect_left(self._suffixes, query)
+        end = bisect.bisect_left(self._suffixes, query + '\uffff', lo=start)
+        return self._suffix_rows[start:end], self._suffix_starts[start:end] == 0
+
+    def _substring_rows(self, query):
+        """Rows of the titles containing the query anywhere."""
+        if len(query) < 3:
+            # No trigram to look up; a normalised query this short has no space
+            return self._short_postings.get(query, np.empty(0, dtype=np.int32))
+        grams = {query[i:i + 3] for i in range(len(query) - 2)}
+        # Intersecting the postings of the query's trigrams, rarest first
+        lists = sorted((self.postings.get(gram, np.empty(0, dtype=np.int32)) for gram in grams),
+                       key=len)
+        rows = lists[0]
+        for other in lists[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        if len(query) > 3:
+            # Sharing all trigrams does not guarantee they are contiguous
+            rows = [row for row in rows.tolist() if query in self.names[row]]
+        return np.asarray(rows, dtype=np.int64)
+
+    def _deletion_index(self):
+        """Title words by each of their one-letter deletions."""
+        if self._deletions is None:
+            with self._deletions_lock:
+                if self._deletions is None:
+                    index = defaultdict(list)
+                    for title_word in self._word_rows:
+                        if len(title_word) >= FUZZY_MIN_LENGTH:
+                            for key in deletions(title_word):
+                                index[key].append(title_word)
+                    self._deletions = index
+        return self._deletions
+
+    def _similar_words(self, word):
+        """Title words at most one typo away from a word, with their
+        similarity to it (1 for the word itself)."""
+        if len(word) < FUZZY_MIN_LENGTH:
+            return {word: 1.0} if word in self._word_rows else {}
+        index = self._deletion_index()
+        similar = {}
+        for key in deletions(word):
+            for other in index.get(key, ()):
+                if other not in similar:
+                    distance = edit_distance(word, other)
+                    if distance <= 1:
+                        similar[other] = 1 - distance / max(len(word), len(other))
+        return similar
+
+    def _fuzzy_rows(self, query):
+        """Rows and similarity of the titles whose words match the query's
+        words closely enough."""
+        words = query.split(' ')
+        score = np.zeros(len(self.names))
+        for word in words:
+            # Each query word counts its closest word in the title
+            best = np.zeros(len(self.names))
+            for other, similarity in sorted(self._similar_words(word).items(),
+                                            key=lambda item: item[1]):
+                best[self._word_rows[other]] = similarity
+            # Longer words weigh more, so that a shared "the" is not half a match
+            score += len(word) * best
+        score /= sum(len(word) for word in words)
+        rows = np.flatnonzero(score >= FUZZY_THRESHOLD)
+        return rows, score[rows]
+
+    def _ranked_rows(self, query, year, genre, max_results):
+        """Matches ranked as exact title, title prefix, word prefix, then
+        any other substring; shorter titles first within each."""
+        rows = self._substring_rows(query)
+        rows = rows[self._keep(rows, year, genre)]
+        # Every match starts as a substring, and is raised by its word prefixes
+        tiers = np.full(len(self.names), 3, dtype=np.int64)
+        prefix_rows, title_prefix = self._prefix_rows(query)
+        tiers[prefix_rows] = 2
+        prefix_rows = prefix_rows[title_prefix]
+        tiers[prefix_rows] = 1
+        # A title prefix of the title's length is the title, with or without its year
+        exact = (self.lengths[prefix_rows] == len(query)) | \
+            (self.name_lengths[prefix_rows] == len(query))
+        tiers[prefix_rows[exact]] = 0
+        # Only the best matches are sorted: tier, then length, then row
+        keys = (tiers * self._tier_step + self._length_keys)[rows]
+        total = len(rows)
+        if total > max_results:
+            keys = keys[np.argpartition(keys, max_results)[:max_results]]
+        keys.sort()
+        return keys % len(self.names), total
+
+    def _keep(self, rows, year, genre):
+        """Mask of the rows passing the year and genre filters."""
+        keep = np.ones(len(rows), dtype=bool)
+        if year is not None:
+            keep &= np.isin(self.years[rows], np.atleast_1d(year))
+        if genre is not None:
+            keep &= self._genre_mask(genre)[rows]
+        return keep
+
+    def _matches(self, query, text, fuzzy, year, genre, max_results):
+        """Ranked rows of the best matches of a query, and the number of
+        all matches.
+
+        `query` is the normalised query; `text` the lower-case query, only
+        looked for in the raw titles when it is all punctuation.
+
+        """
+        if not query:
+            if not text:
+                return np.empty(0, dtype=np.int64), 0
+            rows = np.array([row for row, title in enumerate(self._lower_titles)
+                             if text in title], dtype=np.int64)
+            rows = rows[self._keep(rows, year, genre)]
+            return rows[np.lexsort((rows, self.name_lengths[rows]))][:max_results], len(rows)
+        if fuzzy:
+            rows, similarity = self._fuzzy_rows(query)
+            keep = self._keep(rows, year, genre)
+            rows, similarity = rows[keep], similarity[keep]
+            order = np.lexsort((rows, self.name_lengths[rows], -similarity))
+            return rows[order][:max_results], len(rows)
+        return self._ranked_rows(query, year, genre, max_results)
+
+    def search(self, query, page=1, page_size=PAGE_SIZE, max_results=MAX_RESULTS,
+               fuzzy=False, year=None, genre=None):
+        """Find movies by title.
+
+        Parameters
+        ----------
+        query : str
+            Text to look for in the titles.
+        page : int
+            Page of results to return, from 1.
+        page_size : int
+            Number of results per page.
+        max_results : int
+            Most matches ranked over all pages.
+        fuzzy : bool
+            Rank titles by how closely their words match the query's
+            instead of requiring the query as a substring; tolerates a
+            typo per word.
+        year : int or list (int), optional
+            Only movies released in this year (or these years).
+        genre : str, optional
+            Only movies of this genre, e.g. `Comedy`.
+
+        Returns
+        -------
+        SearchResults
+            The requested page of ranked results.
+
+        """
+        text = query.strip().lower()
+        query = normalise(query)
+        # The raw text only matters for queries of punctuation alone
+        text = None if query else text
+        years = None if year is None else tuple(np.atleast_1d(year).tolist())
+        key = (query, text, fuzzy, years, genre, max_results)
+        with self._queries_lock:
+            matches = self._queries.get(key)
+            if matches is not None:
+                self._queries.move_to_end(key)
+        if matches is None:
+            matches = self._matches(query, text, fuzzy, years, genre, max_results)
+            with self._queries_lock:
+                self._queries[key] = matches
+                if len(self._queries) > QUERY_CACHE_SIZE:
+                    self._queries.popitem(last=False)
+        rows, total = matches
+        n_pages = max(1, -(-len(rows) // page_size))
+        page = min(max(page, 1), n_pages)
+        page_rows = rows[(page - 1) * page_size:page * page_size].tolist()
+        return SearchResults(page_rows, self.catalogue.titles_of_rows(page_rows),
+                             total, page, n_pages)
+
+
+def get_movie_search(movies_path=MOVIES_PATH):
+    """Return the shared search index, building it on first use.
+
+    The index is rebuilt when the movie data file has changed.
+
+    """
+    cached = _searches.get(movies_path)
+    if cached is None or cached.source != source_stamp(movies_path):
+        with _searches_lock:
+            cached = _searches.get(movies_path)
+            if cached is None or cached.source != source_stamp(movies_path):
+                source = source_stamp(movies_path)
+                cached = MovieSearch(get_catalogue(movies_path),
+                                     get_genre_matrix(movies_path), source)
+                _searches[movies_path] = cached
+    return cached
+
+
+@register_warmup
+def warm_movie_search(movies_path=MOVIES_PATH):
+    """Build the shared search index, fuzzy matching included, ahead of
+    the first search."""
+    get_movie_search(movies_path)._deletion_index()
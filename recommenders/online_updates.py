@@ -0,0 +1,275 @@
+"""
+
+    Online updates of the collaborative models from new ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Ratings submitted in the app are appended to a
+    JSON-lines log next to the MovieLens data. The ratings store merges
+    the log into the ratings it serves, and every collaborative model
+    folds the users found in new log entries into its factors: with the
+    item factors held fixed, each affected user's factors and bias are
+    re-solved by a regularised least-squares (ALS) step over that user's
+    ratings. The rated items are then moved towards their new ratings,
+    with the trained item parameters weighing as much as the ratings the
+    item already had, so a new rating shifts a rarely rated movie more
+    than a popular one. The updated parameters are swapped in
+    atomically, so requests never see a half-updated model, and fresh
+    ratings influence recommendations from the next request on instead
+    of after a full retrain with `train_colbased.py`.
+
+"""
+
+# Script dependencies
+import os
+import json
+import time
+import secrets
+import threading
+import numpy as np
+import pandas as pd
+from recommenders.svd_scoring import FOLD_IN_REG, SVDScorer
+
+LOG_PATH = 'resources/data/ratings_log.jsonl'
+# App users get ids far above the MovieLens ones
+APP_USER_ID_BASE = 1_000_000_000
+
+_updaters = []
+
+
+class RatingsLog:
+    """Append-only log of ratings submitted through the app."""
+
+    def __init__(self, path=LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, user_id, movie_id, rating, feedback='', timestamp=None):
+        """Durably append one rating to the log."""
+        record = {'userId': int(user_id), 'movieId': int(movie_id),
+                  'rating': float(rating), 'feedback': feedback,
+                  'timestamp': int(timestamp if timestamp is not None else time.time())}
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self._lock:
+            # A single O_APPEND write keeps concurrent writers' lines whole
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def read(self, offset=0, end=None):
+        """Records appended since byte `offset` (up to byte `end`), and the
+        offset after them.
+
+        A partially written last line is left for the next read.
+
+        """
+        if not os.path.exists(self.path):
+            return [], offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read() if end is None else f.read(max(end - offset, 0))
+        end = data.rfind(b'\n') + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return records, offset + end
+
+    def to_frame(self):
+        """All logged ratings with `userId`, `movieId`, `rating` and `timestamp`."""
+        records, _ = self.read()
+        columns = ['userId', 'movieId', 'rating', 'timestamp']
+        return pd.DataFrame(records, columns=columns + ['feedback'])[columns]
+
+
+def new_user_id():
+    """Random id for a new app user, out of the range of MovieLens ids."""
+    return APP_USER_ID_BASE + secrets.randbelow(1_000_000_000)
+
+
+def fold_in_users(scorer, user_ids, ratings_store, reg=FOLD_IN_REG):
+    """Re-solve the factors of some users against fixed item factors.
+
+    Parameters
+    ----------
+    scorer : SVDScorer
+        Current model parameters; left unchanged.
+    user_ids : list (int)
+        Raw ids of the new or changed users.
+    ratings_store : RatingsStore
+        Ratings to fit the users to, including the logged ones.
+    reg : float
+        L2 regularisation of the user factors and bias.
+
+    Returns
+    -------
+    SVDScorer
+        New parameters in which the users' rows are replaced, or
+        appended for users unknown to the model.
+
+    """
+    user_ids = np.unique(np.asarray(user_ids, dtype=np.int64))
+    rows = scorer.user_rows(user_ids)
+    n_new = int((rows < 0).sum())
+    user_factors = np.concatenate(
+        (scorer.user_factors, np.zeros((n_new, scorer.user_factors.shape[1]), dtype=np.float32)))
+    user_bias = np.concatenate((scorer.user_bias, np.zeros(n_new, dtype=np.float32)))
+    raw_uids = np.concatenate((scorer.raw_uids, user_ids[rows < 0].astype(scorer.raw_uids.dtype)))
+    rows[rows < 0] = len(scorer.raw_uids) + np.arange(n_new)
+
+    for user_id, row in zip(user_ids.tolist(), rows.tolist()):
+        user_ratings = ratings_store.ratings_of_users([user_id])
+        items = scorer.item_rows(user_ratings['movieId'].to_numpy())
+        known = items >= 0
+        if not known.any():
+            continue
+        # Least squares over [factors, bias] with the item side held fixed
+        user_factors[row], user_bias[row] = scorer.fold_in(
+            items[known], user_ratings['rating'].to_numpy()[known], reg=reg)
+
+    return SVDScorer(user_factors=user_factors, item_factors=scorer.item_factors,
+                     user_bias=user_bias, item_bias=scorer.item_bias,
+                     global_mean=scorer.global_mean, rating_scale=scorer.rating_scale,
+                     raw_uids=raw_uids, raw_iids=scorer.raw_iids)
+
+
+def update_items(scorer, records, ratings_store, reg=FOLD_IN_REG):
+    """Move the parameters of newly rated items towards the new ratings.
+
+    With the user factors held fixed, each item's factors and bias are
+    re-solved by least squares over its new ratings, regularised towards
+    the trained values with a weight equal to the number of ratings the
+    item had before (plus `reg`).
+
+    Parameters
+    ----------
+    scorer : SVDScorer
+        Current model parameters, with the rating users folded in; left
+        unchanged.
+    records : list (dict)
+        New log entries with `userId`, `movieId` and `rating`.
+    ratings_store : RatingsStore
+        Ratings including the new ones, to count the items' ratings.
+    reg : float
+        L2 regularisation added to the weight of the trained values.
+
+    Returns
+    -------
+    SVDScorer
+        New parameters with the items' rows replaced, or `scorer` when
+        none of the rated items or users is known to the model.
+
+    """
+    logged = pd.DataFrame(records, columns=['userId', 'movieId', 'rating'])
+    # A user's latest rating of a movie replaces the earlier ones
+    logged = logged.drop_duplicates(['userId', 'movieId'], keep='last')
+    items = scorer.item_rows(logged['movieId'].to_numpy())
+    users = scorer.user_rows(logged['userId'].to_numpy())
+    known = (items >= 0) & (users >= 0)
+    if not known.any():
+        return scorer
+    logged, items, users = logged[known], items[known], users[known]
+    movie_ids = logged['movieId'].to_numpy()
+    counts = dict(zip(movie_ids.tolist(), ratings_store.movie_counts(movie_ids).tolist()))
+    n_factors = scorer.item_factors.shape[1]
+    item_factors = np.array(scorer.item_factors, dtype=np.float32)
+    item_bias = np.array(scorer.item_bias, dtype=np.float32)
+
+    for item in np.unique(items).tolist():
+        rated = items == item
+        features = np.hstack((scorer.user_factors[users[rated]],
+                              np.ones((int(rated.sum()), 1), dtype=np.float32)))
+        targets = logged['rating'].to_numpy(np.float32)[rated] - scorer.global_mean \
+            - scorer.user_bias[users[rated]]
+        # The trained values count for the ratings the item had before
+        prior = reg + max(counts[int(movie_ids[rated][0])] - int(rated.sum()), 0)
+        trained = np.append(item_factors[item], item_bias[item])
+        gram = features.T @ features + prior * np.eye(n_factors + 1, dtype=np.float32)
+        solution = np.linalg.solve(gram, features.T @ targets + prior * trained)
+        item_factors[item], item_bias[item] = solution[:n_factors], solution[n_factors]
+
+    return SVDScorer(user_factors=scorer.user_factors, item_factors=item_factors,
+                     user_bias=scorer.user_bias, item_bias=item_bias,
+                     global_mean=scorer.global_mean, rating_scale=scorer.rating_scale,
+                     raw_uids=scorer.raw_uids, raw_iids=scorer.raw_iids)
+
+
+class OnlineUpdater:
+    """Keeps a model's parameters in step with the ratings log.
+
+    Parameters
+    ----------
+    scorer : Lazy
+        Lazily loaded `SVDScorer` of the model; updated in place.
+    ratings_store : callable
+        Returns the current ratings store.
+    log : RatingsLog
+        The ratings log to follow.
+
+    Attributes
+    ----------
+    items_updated : bool
+        Whether the item parameters differ from the loaded model's.
+
+    """
+
+    def __init__(self, scorer, ratings_store, log=None):
+        self._scorer = scorer
+        self._ratings_store = ratings_store
+        self._log = log or RatingsLog()
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.items_updated = False
+        _updaters.append(self)
+
+    def reset(self):
+        """Follow the log from its start, e.g. after the model was reloaded."""
+        with self._lock:
+            self._offset = 0
+            self.items_updated = False
+
+    def refresh(self):
+        """Fold in the users and items of log entries not seen yet.
+
+        Cheap when the log has not grown: a single `stat` call.
+
+        """
+        size = os.path.getsize(self._log.path) if os.path.exists(self._log.path) else 0
+        if size <= self._offset:
+            return
+        with self._lock:
+            records, offset = self._log.read(self._offset)
+            if not records:
+                return
+            scorer = self._scorer.get()
+            ratings_store = self._ratings_store()
+            users = sorted({record['userId'] for record in records})
+            updated = fold_in_users(scorer, users, ratings_store)
+            updated = update_items(updated, records, ratings_store)
+            # Readers hold either the old or the new parameters, never a mix
+            self._scorer.set(updated)
+            self.items_updated = self.items_updated \
+                or updated.item_factors is not scorer.item_factors
+            self._offset = offset
+
+
+def submit_rating(user_id, movie_id, rating, feedback='', log=None):
+    """Log a rating and fold it into every collaborative model.
+
+    Parameters
+    ----------
+    user_id : int
+        Id of the rating user, e.g. from `new_user_id`.
+    movie_id : int
+        MovieLens movie ID of the rated movie.
+    rating : float
+        The rating given.
+    feedback : str
+        Free-text feedback kept with the rating.
+    log : RatingsLog, optional
+        Log to append to; the shared ratings log by default.
+
+    """
+    (log or RatingsLog()).append(user_id, movie_id, rating, feedback)
+    for updater in list(_updaters):
+        updater.refresh()
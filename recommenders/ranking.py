@@ -0,0 +1,93 @@
+"""
+
+    Multi-seed score aggregation and top-n selection.
+
+    Author: Explore Data Science Academy.
+
+    Description: Shared helpers for recommending from any number of seed
+    movies. The similarity rows of all seeds are combined into a single
+    score per catalogue row with one vectorised reduction, optionally
+    weighting each seed, and the best rows are selected with a partial
+    sort instead of ordering the whole catalogue.
+
+"""
+
+# Script dependencies
+import numpy as np
+import scipy.sparse as sp
+
+REDUCTIONS = ('max', 'sum')
+
+
+def combine_scores(score_rows, weights=None, how='max'):
+    """Combine the score rows of several seeds into one score per item.
+
+    Parameters
+    ----------
+    score_rows : numpy.ndarray or scipy.sparse matrix
+        Scores of shape (seeds, items), one row per seed movie.
+    weights : list (float), optional
+        Weight of every seed; all seeds weigh 1 by default.
+    how : str
+        `max` keeps the best weighted score of every item, `sum` adds the
+        weighted scores up.
+
+    Returns
+    -------
+    numpy.ndarray
+        Combined score of every item.
+
+    """
+    if how not in REDUCTIONS:
+        raise ValueError(f"Unknown score reduction: {how}")
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float32)
+        if len(weights) != score_rows.shape[0]:
+            raise ValueError("Expected one weight per seed movie")
+    if sp.issparse(score_rows):
+        score_rows = sp.csr_matrix(score_rows, dtype=np.float32)
+        if weights is not None:
+            score_rows = sp.diags(weights) @ score_rows
+        if how == 'max':
+            return score_rows.max(axis=0).toarray().ravel()
+        return np.asarray(score_rows.sum(axis=0)).ravel()
+    score_rows = np.asarray(score_rows, dtype=np.float32)
+    if weights is not None:
+        score_rows = score_rows * weights[:, None]
+    return score_rows.max(axis=0) if how == 'max' else score_rows.sum(axis=0)
+
+
+def top_n_rows(scores, n, exclude=()):
+    """Rows of the `n` highest scores, best first.
+
+    Only rows with a positive score are returned. Ties are broken by row
+    number, so results are deterministic.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        Score of every catalogue row.
+    n : int
+        Number of rows to return.
+    exclude : list (int)
+        Rows that must not be returned, e.g. the seed movies.
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to `n` rows ordered by descending score.
+
+    """
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    scores = np.array(scores, dtype=np.float64)
+    scores[list(exclude)] = -np.inf
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > n:
+        # Partial sort: find the n-th best score without ordering the rest
+        candidate_scores = scores[candidates]
+        kth = -np.partition(-candidate_scores, n - 1)[n - 1]
+        above = candidates[candidate_scores > kth]
+        tied = candidates[candidate_scores == kth][:n - len(above)]
+        candidates = np.concatenate((above, tied))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
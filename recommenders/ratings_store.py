@@ -0,0 +1,485 @@
+"""
+
+    Compact ratings store with user and movie adjacency.
+
+    Author: Explore Data Science Academy.
+
+    Description: Holds the ratings as int32 user ids, int32 movie ids and
+    float32 ratings, together with CSR indices grouping them by user and
+    by movie. "All ratings by these users" and "all ratings of these
+    movies" are slices whose cost is proportional to the result rather
+    than to the size of the ratings data. The store is built once per
+    process and shared by the recommenders and the Top Charts
+    aggregates. The EDA pages keep reading the ratings file itself, as
+    they chart the rating timestamps, which the store does not hold.
+
+    Ratings submitted through the app (see `recommenders.online_updates`)
+    are merged in, a user's latest rating of a movie replacing any
+    earlier one. Only the new bytes of the log are read as it grows, and
+    the new ratings are held as a small in-memory delta over the indexed
+    arrays. Every `COMPACT_EVERY` log records the delta is compacted: the
+    arrays are rebuilt once with those records merged in.
+
+    The arrays are published once through `recommenders.data_plane`, so
+    every app and service process maps the same physical copy instead of
+    sorting the ratings into its own. Compaction points are counted in
+    log records from the start of the log, so all processes compact into
+    the same published version. A log replaced by another file, even of
+    the same size or larger, is detected by its modification time and
+    by comparing the last bytes read with the file, and is then followed
+    again from its start.
+
+"""
+
+# Script dependencies
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from recommenders.data_cache import load_ratings, ratings_version
+from recommenders.data_plane import plane_version, set_name, shared_arrays
+from recommenders.lazy import register_warmup
+from recommenders.online_updates import LOG_PATH
+from recommenders.result_cache import sources_version
+
+RATINGS_PATH = 'resources/data/ratings.csv'
+# Number of log records applied as a delta before they are compacted
+COMPACT_EVERY = 1024
+# Bytes at the end of the log part read that must be unchanged for the
+# log to be followed on from there
+CHECK_BYTES = 4096
+DELTA_COLUMNS = ['userId', 'movieId', 'rating']
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _read_only(*arrays):
+    for array in arrays:
+        array.setflags(write=False)
+
+
+def _pair_keys(user_ids, movie_ids):
+    """One int64 key per (user, movie) pair."""
+    return (np.asarray(user_ids, dtype=np.int64) << 32) \
+        | np.asarray(movie_ids, dtype=np.int64) & 0xFFFFFFFF
+
+
+class Adjacency:
+    """CSR grouping of the ratings by one of their id columns.
+
+    Attributes
+    ----------
+    keys : numpy.ndarray
+        Sorted distinct ids the ratings are grouped by.
+    indptr : numpy.ndarray
+        The ratings of `keys[k]` are `order[indptr[k]:indptr[k + 1]]`.
+    order : numpy.ndarray
+        Positions of the ratings, grouped by id.
+
+    """
+
+    def __init__(self, keys, indptr, order):
+        self.keys = keys
+        self.indptr = indptr
+        self.order = order
+        _read_only(self.keys, self.indptr, self.order)
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Group the positions of an id column by id."""
+        order = np.argsort(ids, kind='stable').astype(np.int64)
+        keys, counts = np.unique(ids[order], return_counts=True)
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(keys, indptr, order)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def counts(self):
+        """Number of ratings of every id in `keys`."""
+        return np.diff(self.indptr)
+
+    def positions(self, ids):
+        """Positions of the ratings of several ids; unknown ids are skipped."""
+        ids = np.asarray(ids, dtype=self.keys.dtype)
+        slots = np.searchsorted(self.keys, ids)
+        slots = slots[(slots < len(self.keys))
+                      & (self.keys[np.minimum(slots, len(self.keys) - 1)] == ids)]
+        starts = self.indptr[slots]
+        lengths = self.indptr[slots + 1] - starts
+        # Concatenate the ranges without a Python-level loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.order[offsets + np.arange(lengths.sum())]
+
+
+class RatingsStore:
+    """Ratings with constant-time grouping by user and by movie.
+
+    Attributes
+    ----------
+    user_ids : numpy.ndarray
+        int32 user id of every rating (read-only).
+    movie_ids : numpy.ndarray
+        int32 movie id of every rating (read-only).
+    ratings : numpy.ndarray
+        float32 value of every rating (read-only).
+    by_user : Adjacency
+        Ratings grouped by user (user -> items).
+    by_movie : Adjacency
+        Ratings grouped by movie (item -> users).
+    source : dict
+        Stamp of the ratings file the store was built from.
+    delta : Pandas Dataframe, optional
+        Ratings applied over the arrays, one per (`userId`, `movieId`)
+        pair, with the `replaced` rating of the arrays (NaN for new
+        pairs); see `with_delta`.
+    log_offset : int
+        Bytes of the ratings log merged into the store.
+
+    """
+
+    def __init__(self, user_ids, movie_ids, ratings, source=None, by_user=None, by_movie=None,
+                 delta=None, log_offset=0):
+        self.user_ids = np.ascontiguousarray(user_ids, dtype=np.int32)
+        self.movie_ids = np.ascontiguousarray(movie_ids, dtype=np.int32)
+        self.ratings = np.ascontiguousarray(ratings, dtype=np.float32)
+        _read_only(self.user_ids, self.movie_ids, self.ratings)
+        self.by_user = by_user or Adjacency.from_ids(self.user_ids)
+        self.by_movie = by_movie or Adjacency.from_ids(self.movie_ids)
+        self.source = source
+        self.delta = delta
+        self.log_offset = log_offset
+
+    def __len__(self):
+        if self.delta is None:
+            return len(self.ratings)
+        return len(self.ratings) + int(self.delta['replaced'].isna().sum())
+
+    def with_delta(self, user_ids, movie_ids, ratings, log_offset=None):
+        """Store sharing these arrays, with some ratings applied over them.
+
+        The cost is proportional to the new ratings and to the earlier
+        ratings of their users, not to the size of the store.
+
+        Parameters
+        ----------
+        user_ids, movie_ids, ratings : array-like
+            The new ratings, oldest first; a later rating of a movie by
+            the same user replaces the earlier ones.
+        log_offset : int, optional
+            Bytes of the ratings log merged once they are applied.
+
+        Returns
+        -------
+        RatingsStore
+            Store over the same arrays and indices.
+
+        """
+        delta = pd.DataFrame({'userId': np.asarray(user_ids, dtype=np.int32),
+                              'movieId': np.asarray(movie_ids, dtype=np.int32),
+                              'rating': np.asarray(ratings, dtype=np.float32)})
+        delta = delta.drop_duplicates(['userId', 'movieId'], keep='last', ignore_index=True)
+        # Ratings of the arrays that the delta replaces
+        earlier = self.to_frame(self.by_user.positions(np.unique(delta['userId'].to_numpy())))
+        replaced = pd.Series(earlier['rating'].to_numpy(),
+                             index=_pair_keys(earlier['userId'], earlier['movieId']))
+        delta['replaced'] = replaced.reindex(
+            _pair_keys(delta['userId'], delta['movieId'])).to_numpy()
+        return RatingsStore(self.user_ids, self.movie_ids, self.ratings, self.source,
+                            self.by_user, self.by_movie, delta,
+                            self.log_offset if log_offset is None else log_offset)
+
+    def _apply_delta(self, frame, delta):
+        """Ratings of `frame` with the ratings of `delta` replacing or added to them."""
+        if not len(delta):
+            return frame
+        replaced = np.isin(_pair_keys(frame['userId'], frame['movieId']),
+                           _pair_keys(delta['userId'], delta['movieId']))
+        return pd.concat([frame[~replaced], delta[DELTA_COLUMNS]], ignore_index=True)
+
+    def arrays(self):
+        """The ratings and both adjacency indices, by name.
+
+        The delta is not included; it is compacted into a new store
+        instead.
+
+        """
+        arrays = {'user_ids': self.user_ids, 'movie_ids': self.movie_ids,
+                  'ratings': self.ratings}
+        for prefix, adjacency in (('by_user', self.by_user), ('by_movie', self.by_movie)):
+            for name in ('keys', 'indptr', 'order'):
+                arrays[f'{prefix}.{name}'] = getattr(adjacency, name)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, source=None, log_offset=0):
+        """Store over arrays returned by `arrays`, without copying them."""
+        by_user, by_movie = (Adjacency(*(arrays[f'{prefix}.{name}']
+                                         for name in ('keys', 'indptr', 'order')))
+                             for prefix in ('by_user', 'by_movie'))
+        return cls(arrays['user_ids'], arrays['movie_ids'], arrays['ratings'], source,
+                   by_user, by_movie, log_offset=log_offset)
+
+    def to_frame(self, positions=None):
+        """Dataframe with `userId`, `movieId` and `rating` columns.
+
+        Parameters
+        ----------
+        positions : numpy.ndarray, optional
+            Positions in the arrays of the ratings to include; all
+            ratings, with the delta applied, by default.
+
+        """
+        frame_positions = slice(None) if positions is None else positions
+        frame = pd.DataFrame({'userId': self.user_ids[frame_positions],
+                              'movieId': self.movie_ids[frame_positions],
+                              'rating': self.ratings[frame_positions]})
+        if positions is None and self.delta is not None:
+            frame = self._apply_delta(frame, self.delta)
+        return frame
+
+    def ratings_of_users(self, user_ids):
+        """All ratings by several users, grouped by user."""
+        frame = self.to_frame(self.by_user.positions(user_ids))
+        if self.delta is None:
+            return frame
+        frame = self._apply_delta(frame, self.delta[self.delta['userId'].isin(user_ids)])
+        return frame.sort_values('userId', kind='stable', ignore_index=True)
+
+    def movie_counts(self, movie_ids):
+        """Number of ratings of several movies, 0 for unrated ones."""
+        movie_ids = np.asarray(movie_ids, dtype=self.by_movie.keys.dtype)
+        keys = self.by_movie.keys
+        slots = np.minimum(np.searchsorted(keys, movie_ids), max(len(keys) - 1, 0))
+        found = (keys[slots] == movie_ids) if len(keys) else np.zeros(len(movie_ids), bool)
+        counts = np.where(found, self.by_movie.indptr[slots + 1] - self.by_movie.indptr[slots], 0)
+        if self.delta is not None:
+            added = self.delta.loc[self.delta['replaced'].isna(), 'movieId'].value_counts()
+            counts = counts + added.reindex(movie_ids, fill_value=0).to_numpy()
+        return counts
+
+    def movie_stats(self):
+        """Number, sum and mean of the ratings of every rated movie.
+
+        Returns
+        -------
+        Pandas Dataframe
+            `count`, `sum` and `mean` columns indexed by `movieId`.
+
+        """
+        counts = self.by_movie.counts()
+        # Cumulative sums read at the group boundaries give the per-movie sums
+        cumulative = np.concatenate(
+            ([0.0], np.cumsum(self.ratings[self.by_movie.order], dtype=np.float64)))
+        sums = np.diff(cumulative[self.by_movie.indptr])
+        stats = pd.DataFrame({'count': counts, 'sum': sums},
+                             index=pd.Index(self.by_movie.keys, name='movieId'))
+        if self.delta is not None and len(self.delta):
+            delta = self.delta
+            change = pd.DataFrame({'count': delta['replaced'].isna().astype(np.int64).to_numpy(),
+                                   'sum': (delta['rating'] - delta['replaced'].fillna(0)).to_numpy(
+                                       np.float64)},
+                                  index=pd.Index(delta['movieId'].to_numpy(), name='movieId'))
+            stats = stats.add(change.groupby(level=0).sum(), fill_value=0)
+            stats['count'] = stats['count'].astype(np.int64)
+        stats['mean'] = stats['sum'] / stats['count']
+        return stats
+
+
+class _LogState:
+    """How far a process has followed the ratings log.
+
+    Attributes
+    ----------
+    offset : int
+        Bytes of whole lines read.
+    stamp : tuple (int, int)
+        Size and modification time of the log when it was last read.
+    tail : bytes
+        The last (at most `CHECK_BYTES`) bytes read.
+    n_records : int
+        Number of records read.
+    digest : hashlib.sha1
+        Hash of the bytes read.
+    compacted : tuple (int, str)
+        Length and SHA-1 of the log prefix merged into `base`, which
+        always ends at a multiple of `COMPACT_EVERY` records.
+    pending : list (dict)
+        Records read after that prefix.
+    base : RatingsStore
+        Published store over the ratings file and the compacted prefix.
+
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.stamp = (0, 0)
+        self.tail = b''
+        self.n_records = 0
+        self.digest = hashlib.sha1()
+        self.compacted = (0, self.digest.hexdigest())
+        self.pending = []
+        self.base = None
+
+    def copy(self):
+        state = _LogState()
+        state.__dict__.update(self.__dict__)
+        state.digest = self.digest.copy()
+        state.pending = list(self.pending)
+        return state
+
+    def continues(self, log_path):
+        """Whether the log still holds the bytes read, i.e. it was only
+        appended to since."""
+        if not self.offset:
+            return True
+        if not os.path.exists(log_path):
+            return False
+        with open(log_path, 'rb') as f:
+            f.seek(self.offset - len(self.tail))
+            return f.read(len(self.tail)) == self.tail
+
+
+def _log_stamp(log_path):
+    """Size and modification time of the log, (0, 0) if missing."""
+    try:
+        stat = os.stat(log_path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _read_lines(log_path, offset=0, end=None):
+    """Whole lines of the log from byte `offset` (to byte `end`)."""
+    if not os.path.exists(log_path):
+        return b''
+    with open(log_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read() if end is None else f.read(end - offset)
+    # A partially written last line is left for the next read
+    return data[:data.rfind(b'\n') + 1]
+
+
+def build_ratings_store(ratings_path=RATINGS_PATH, log_path=LOG_PATH, log_bytes=None,
+                        log_digest=None):
+    """Build a ratings store over a ratings file and the start of the ratings log.
+
+    Parameters
+    ----------
+    ratings_path : str
+        Path to the ratings data stored in .csv format.
+    log_path : str
+        Path to the log of ratings submitted through the app.
+    log_bytes : int, optional
+        Length of the start of the log to merge; the whole log by default.
+    log_digest : str, optional
+        SHA-1 of those bytes, if already known.
+
+    Returns
+    -------
+    RatingsStore
+        Ratings and adjacency indices for the current version of the
+        files, memory-mapped from the data plane.
+
+    """
+    if log_bytes is None or log_digest is None:
+        prefix = _read_lines(log_path, 0, log_bytes)
+        log_bytes, log_digest = len(prefix), hashlib.sha1(prefix).hexdigest()
+    # The ratings are versioned by their contents, the log by its merged bytes
+    version = plane_version(ratings_version(ratings_path), log_bytes, log_digest)
+    arrays = shared_arrays(set_name('ratings', ratings_path, log_path), version,
+                           lambda: _merge_ratings(ratings_path, log_path, log_bytes).arrays())
+    return RatingsStore.from_arrays(arrays, sources_version((ratings_path,)), log_bytes)
+
+
+def _merge_ratings(ratings_path, log_path, log_bytes=None):
+    """Store over the ratings file and the start of the ratings log, held in memory."""
+    ratings = load_ratings(ratings_path)[DELTA_COLUMNS]
+    records = [json.loads(line) for line in _read_lines(log_path, 0, log_bytes).splitlines()
+               if line.strip()]
+    if records:
+        # The latest rating of a movie by a user replaces the earlier ones
+        logged = pd.DataFrame(records, columns=DELTA_COLUMNS)
+        ratings = pd.concat([ratings, logged], ignore_index=True)
+        ratings = ratings.drop_duplicates(['userId', 'movieId'], keep='last')
+    return RatingsStore(ratings['userId'].to_numpy(), ratings['movieId'].to_numpy(),
+                        ratings['rating'].to_numpy())
+
+
+def _follow_log(state, ratings_path, log_path, stamp):
+    """Read the new lines of the log, compacting at every `COMPACT_EVERY` records.
+
+    Returns
+    -------
+    tuple (_LogState, RatingsStore)
+        The advanced state, and the store with the pending records
+        applied as a delta.
+
+    """
+    state = state.copy()
+    data = _read_lines(log_path, state.offset)
+    position = state.offset
+    for line in data.splitlines(keepends=True):
+        position += len(line)
+        state.digest.update(line)
+        if not line.strip():
+            continue
+        state.pending.append(json.loads(line))
+        state.n_records += 1
+        if state.n_records % COMPACT_EVERY == 0:
+            state.compacted = (position, state.digest.hexdigest())
+            state.pending = []
+            state.base = None
+    state.offset, state.stamp = position, stamp
+    state.tail = (state.tail + data)[-CHECK_BYTES:]
+    if state.base is None:
+        state.base = build_ratings_store(ratings_path, log_path, *state.compacted)
+    if not state.pending:
+        return state, state.base
+    pending = pd.DataFrame(state.pending, columns=DELTA_COLUMNS)
+    return state, state.base.with_delta(pending['userId'], pending['movieId'], pending['rating'],
+                                        state.offset)
+
+
+@register_warmup
+def get_ratings_store(ratings_path=RATINGS_PATH, log_path=LOG_PATH):
+    """Return the shared ratings store, building it on first use.
+
+    The store is rebuilt when the ratings file has changed. When only
+    the ratings log has grown, just its new lines are read and applied
+    as a delta, and the arrays are only rebuilt at a compaction point.
+    A truncated or replaced log is read again from its start.
+
+    Parameters
+    ----------
+    ratings_path : str
+        Path to the ratings data stored in .csv format.
+    log_path : str
+        Path to the log of ratings submitted through the app.
+
+    Returns
+    -------
+    RatingsStore
+        Shared, read-only ratings store.
+
+    """
+    key = (ratings_path, log_path)
+    source = sources_version((ratings_path,))
+    stamp = _log_stamp(log_path)
+    cached = _stores.get(key)
+    if cached is None or cached[0] != source or cached[1].stamp != stamp:
+        with _stores_lock:
+            cached = _stores.get(key)
+            if cached is None or cached[0] != source or cached[1].stamp != stamp:
+                state = cached[1] if cached is not None and cached[0] == source else None
+                # A truncated or replaced log is followed again from its start
+                if state is None or not state.continues(log_path):
+                    state = _LogState()
+                state, store = _follow_log(state, ratings_path, log_path, stamp)
+                cached = (source, state, store)
+                _stores[key] = cached
+    return cached[2]
@@ -0,0 +1,141 @@
+"""
+
+    Shared cache of recommendation results.
+
+    Author: Explore Data Science Academy.
+
+    Description: Serves repeated recommendation requests from memory. The
+    app only offers a few hundred selectable favourites, so the same
+    triples come up again and again across sessions. Results are keyed by
+    the recommender, the favourites (in any order) and `top_n`, and every
+    key also carries the versions of the data and model files the result
+    was computed from, so a changed file makes old results unreachable.
+    The cache is bounded (least recently used entries are evicted first)
+    and entries expire after a time-to-live.
+
+"""
+
+# Script dependencies
+import os
+import time
+import threading
+import functools
+from collections import OrderedDict
+
+MAX_SIZE = 4096
+# Seconds before a cached result is recomputed
+TTL = 3600
+
+
+class ResultCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of lookups served from and missing from the cache.
+    evictions, expirations : int
+        Number of entries dropped for space and for age.
+
+    """
+
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Cached value of a key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries if full."""
+        with self._lock:
+            self._entries[key] = (self._clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        """Size, counters and hit rate of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'max_size': self.max_size,
+                    'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+# Shared by every recommender in the process
+results = ResultCache()
+
+
+def sources_version(paths):
+    """Version of a set of files, from their modification times and sizes."""
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append((path, None, None))
+    return tuple(version)
+
+
+def cached_recommender(sources, cache=results):
+    """Serve a recommender's results through the shared result cache.
+
+    The decorated function keeps its `(movie_list, top_n)` signature and
+    always returns a fresh list.
+
+    Parameters
+    ----------
+    sources : tuple (str)
+        Data and model files the recommender's results depend on.
+    cache : ResultCache
+        Cache to store the results in.
+
+    """
+    def decorator(model):
+        name = f'{model.__module__}.{model.__qualname__}'
+
+        @functools.wraps(model)
+        def wrapper(movie_list, top_n=10):
+            # The favourites are a set: their order does not change the result
+            key = (name, tuple(sorted(movie_list)), top_n, sources_version(sources))
+            recommended = cache.get(key)
+            if recommended is None:
+                recommended = tuple(model(movie_list, top_n))
+                cache.put(key, recommended)
+            return list(recommended)
+
+        wrapper.uncached = model
+        return wrapper
+    return decorator
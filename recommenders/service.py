@@ -0,0 +1,251 @@
+"""
+
+    Recommendation HTTP service.
+
+    Author: Explore Data Science Academy.
+
+    Description: Serves the recommenders over HTTP from a standalone
+    asyncio process, so that scoring no longer runs in the Streamlit
+    script thread and scoring workers can be scaled independently of the
+    UI. Requests are CPU-bound, so they are scored in a pool of worker
+    processes, each holding its own lazily loaded data and models. While
+    a request is being scored, identical requests (same recommender,
+    favourites in any order and `top_n`) wait for its result instead of
+    being scored again.
+
+    Endpoints:
+
+        GET  /health     Liveness, pool size and request counters.
+        POST /recommend  One request, or a batch of them:
+
+            {"algorithm": "content_based", "movie_list": [...], "top_n": 10}
+            {"requests": [{"algorithm": ..., "movie_list": [...]}, ...]}
+
+    A request whose favourites are not all catalogue titles is answered
+    with 404, naming the unknown titles.
+
+    Start the service from the root of this repository with:
+
+        python -m recommenders.service --port 8000 --workers 4
+
+    and point the app at it with `RECOMMENDER_SERVICE_URL`
+    (see `recommenders.service_client`).
+
+"""
+
+# Script dependencies
+import os
+import json
+import asyncio
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+
+# Recommenders served, by name: module and function
+ALGORITHMS = {
+    'content_based': ('recommenders.content_based', 'content_model'),
+    'content_based2': ('recommenders.content_based2', 'content_model'),
+    'collaborative_based': ('recommenders.collaborative_based', 'collab_model'),
+    'collaborative_based2': ('recommenders.collaborative_based2', 'collab_model'),
+}
+MAX_BODY_SIZE = 1 << 20
+MAX_BATCH_SIZE = 256
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class RequestError(ValueError):
+    """A request the service cannot serve, reported back to the client."""
+
+
+class UnknownTitleError(RequestError):
+    """A request naming favourite movies that are not in the catalogue."""
+
+
+def recommend(algorithm, movie_list, top_n=10):
+    """Run one recommender in the current process."""
+    from recommenders.catalogue import get_catalogue
+    if not movie_list:
+        raise RequestError("'movie_list' must name at least one movie")
+    # The recommenders look the favourites up by title
+    catalogue = get_catalogue()
+    unknown = [title for title in movie_list if title not in catalogue]
+    if unknown:
+        raise UnknownTitleError(f"Unknown movie titles: {', '.join(map(repr, unknown))}")
+    module_name, function_name = ALGORITHMS[algorithm]
+    model = getattr(importlib.import_module(module_name), function_name)
+    return list(model(movie_list=list(movie_list), top_n=top_n))
+
+
+def _init_worker(warm):
+    # Loading every recommender's data and models before the first request
+    if warm:
+        from recommenders.lazy import RECOMMENDER_MODULES, warmup
+        warmup(RECOMMENDER_MODULES)
+
+
+def parse_request(item):
+    """Validate one request, returning (algorithm, favourites, top_n)."""
+    if not isinstance(item, dict):
+        raise RequestError("A request must be a JSON object")
+    algorithm = item.get('algorithm')
+    if algorithm not in ALGORITHMS:
+        raise RequestError(f"Unknown algorithm: {algorithm!r}")
+    movie_list = item.get('movie_list')
+    if not isinstance(movie_list, list) or not all(isinstance(title, str) for title in movie_list):
+        raise RequestError("'movie_list' must be a list of movie titles")
+    if not movie_list:
+        raise RequestError("'movie_list' must name at least one movie")
+    top_n = item.get('top_n', 10)
+    if not isinstance(top_n, int) or not 0 < top_n <= 100:
+        raise RequestError("'top_n' must be an integer between 1 and 100")
+    return algorithm, tuple(movie_list), top_n
+
+
+class RecommendationService:
+    """Scores requests in a worker pool, coalescing identical ones.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Pool the recommenders run in.
+
+    Attributes
+    ----------
+    requests, coalesced : int
+        Requests received, and those answered by an identical request
+        that was already in flight.
+
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.requests = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    async def recommend(self, algorithm, movie_list, top_n=10):
+        """Recommendations for one request, shared with identical ones."""
+        self.requests += 1
+        key = (algorithm, tuple(sorted(movie_list)), top_n)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = asyncio.ensure_future(loop.run_in_executor(
+                self.executor, recommend, algorithm, movie_list, top_n))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A cancelled client does not cancel the request others wait for
+        return await asyncio.shield(future)
+
+    async def handle(self, payload):
+        """Answer a single request or a batch of requests."""
+        if isinstance(payload, dict) and 'requests' in payload:
+            items = payload['requests']
+            if not isinstance(items, list) or len(items) > MAX_BATCH_SIZE:
+                raise RequestError(f"'requests' must be a list of at most {MAX_BATCH_SIZE}")
+            return {'results': await asyncio.gather(*(self._answer(item) for item in items))}
+        return {'recommendations': await self.recommend(*parse_request(payload))}
+
+    async def _answer(self, item):
+        # Failures are reported per request, so one bad request does not fail a batch
+        try:
+            return {'recommendations': await self.recommend(*parse_request(item))}
+        except RequestError as error:
+            return {'error': str(error)}
+        except Exception as error:
+            return {'error': f"{type(error).__name__}: {error}"}
+
+    def health(self):
+        return {'status': 'ok', 'workers': getattr(self.executor, '_max_workers', None),
+                'requests': self.requests, 'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight)}
+
+    async def serve_connection(self, reader, writer):
+        """Serve the HTTP/1.1 requests of one (keep-alive) connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, {'error': "Request body too large"}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, response = await self._route(method, path, body)
+                close = headers.get('connection', '').lower() == 'close'
+                await self._respond(writer, status, response, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if path == '/health':
+            return 200, self.health()
+        if path != '/recommend':
+            return 404, {'error': f"Unknown path: {path}"}
+        if method != 'POST':
+            return 405, {'error': "Use POST"}
+        try:
+            return 200, await self.handle(json.loads(body or b'null'))
+        except json.JSONDecodeError:
+            return 400, {'error': "Request body is not valid JSON"}
+        except UnknownTitleError as error:
+            return 404, {'error': str(error)}
+        except RequestError as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': f"{type(error).__name__}: {error}"}
+
+    @staticmethod
+    async def _respond(writer, status, response, close=False):
+        payload = json.dumps(response).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+
+async def serve(host='127.0.0.1', port=8000, workers=None, warm=True):
+    """Run the service until cancelled."""
+    executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                   initializer=_init_worker, initargs=(warm,))
+    service = RecommendationService(executor)
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    print(f"Recommendation service listening on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--no-warmup', action='store_true',
+                        help="load data and models on first use instead of at start")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, not args.no_warmup))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,99 @@
+"""
+
+    Client of the recommendation HTTP service.
+
+    Author: Explore Data Science Academy.
+
+    Description: Lets the Streamlit app hand recommendation requests to
+    the standalone service in `recommenders.service` instead of scoring
+    them in the script thread. The service is used when
+    `RECOMMENDER_SERVICE_URL` is set (e.g. `http://127.0.0.1:8000`);
+    otherwise the recommenders keep running in the app process.
+
+"""
+
+# Script dependencies
+import os
+import json
+import functools
+import urllib.error
+import urllib.request
+
+SERVICE_URL = os.environ.get('RECOMMENDER_SERVICE_URL')
+# Seconds to wait for the service before giving up on a request
+TIMEOUT = 30
+
+
+class ServiceError(RuntimeError):
+    """The service could not answer a request."""
+
+
+class RecommendationClient:
+    """Sends single or batched recommendation requests to the service."""
+
+    def __init__(self, url=SERVICE_URL, timeout=TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _post(self, payload):
+        request = urllib.request.Request(
+            self.url + '/recommend', data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as error:
+            message = json.load(error).get('error', error.reason)
+            raise ServiceError(f"{error.code}: {message}") from error
+        except urllib.error.URLError as error:
+            raise ServiceError(f"Recommendation service unavailable: {error.reason}") from error
+
+    def recommend(self, algorithm, movie_list, top_n=10):
+        """Titles of the top-n recommendations of one recommender."""
+        return self._post({'algorithm': algorithm, 'movie_list': list(movie_list),
+                           'top_n': top_n})['recommendations']
+
+    def recommend_batch(self, requests):
+        """Answer several requests in one round trip.
+
+        Parameters
+        ----------
+        requests : list (dict)
+            Requests with `algorithm`, `movie_list` and optionally `top_n`.
+
+        Returns
+        -------
+        list (dict)
+            Per request, either `recommendations` or an `error`.
+
+        """
+        return self._post({'requests': list(requests)})['results']
+
+
+def remote(model, algorithm, url=SERVICE_URL):
+    """Serve a recommender function from the service, if one is configured.
+
+    Parameters
+    ----------
+    model : callable
+        Local recommender, e.g. `content_model`.
+    algorithm : str
+        Name of the same recommender in the service.
+    url : str, optional
+        Base URL of the service; `RECOMMENDER_SERVICE_URL` by default.
+
+    Returns
+    -------
+    callable
+        Function with the signature of `model`, which sends its requests
+        to the service, or `model` itself when no service is configured.
+
+    """
+    if not url:
+        return model
+    client = RecommendationClient(url)
+
+    @functools.wraps(model)
+    def wrapper(movie_list, top_n=10):
+        return client.recommend(algorithm, movie_list, top_n)
+    return wrapper
@@ -0,0 +1,266 @@
+"""
+
+    Precomputed top-K similarity index for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Offline build step and loader for a sparse index which
+    stores only the `top_k` most similar movies of every movie in the
+    catalogue. The index is kept in CSR layout as raw `.npy` arrays so
+    that it can be memory-mapped read-only, meaning a recommendation only
+    needs a handful of row lookups instead of an all-pairs similarity
+    matrix.
+
+    Every build is written to its own directory next to the index and
+    renamed into place, and `meta.json` then points to it, so processes
+    that have the previous arrays memory-mapped keep reading whole files.
+    Building takes half a minute and about a gigabyte of memory, so it
+    belongs in this offline step or in `warmup()`; a process that finds
+    the index missing or stale builds it under a file lock, so that only
+    one process builds at a time and the others load its result.
+
+    Usage (from the root of this repository):
+
+        python -m recommenders.similarity_index
+
+"""
+
+# Script dependencies
+import os
+import json
+import fcntl
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+from recommenders.data_cache import load_movies, movies_version, _read_json, _write_json
+from recommenders.genre_encoding import build_genre_matrix
+from recommenders.lazy import Lazy
+
+MOVIES_PATH = 'resources/data/movies.csv'
+INDEX_DIR = 'resources/models/content_index'
+TOP_K = 50
+BLOCK_SIZE = 1024
+# Bumped whenever the features or layout of the index change
+INDEX_FORMAT = 3
+INDEX_ARRAYS = ('movie_ids', 'indptr', 'indices', 'scores')
+
+
+class SimilarityIndex:
+    """Read-only top-K neighbour lists stored in CSR layout.
+
+    Row `i` of the index corresponds to row `i` of the movie catalogue the
+    index was built from. The neighbours of row `i` are held in
+    `indices[indptr[i]:indptr[i + 1]]`, sorted by descending similarity.
+
+    """
+
+    def __init__(self, movie_ids, indptr, indices, scores):
+        self.movie_ids = movie_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbours(self, rows):
+        """Gather the neighbour lists of several catalogue rows.
+
+        Parameters
+        ----------
+        rows : list (int)
+            Catalogue rows of the seed movies.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Concatenated neighbour rows and their similarity scores.
+
+        """
+        slices = [slice(self.indptr[row], self.indptr[row + 1]) for row in rows]
+        indices = np.concatenate([self.indices[s] for s in slices])
+        scores = np.concatenate([self.scores[s] for s in slices])
+        return indices, scores
+
+    def score_rows(self, rows):
+        """Similarity rows of several catalogue rows as a sparse matrix.
+
+        Parameters
+        ----------
+        rows : list (int)
+            Catalogue rows of the seed movies.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            Matrix of shape (seeds, catalogue) holding the top-k scores.
+
+        """
+        lengths = [int(self.indptr[row + 1] - self.indptr[row]) for row in rows]
+        indices, scores = self.neighbours(rows)
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        return sp.csr_matrix((scores, indices, indptr), shape=(len(rows), len(self)))
+
+
+def build_similarity_index(movies, top_k=TOP_K, block_size=BLOCK_SIZE):
+    """Compute the top-k cosine neighbours of every movie.
+
+    Similarities are computed one block of rows at a time, so peak memory
+    is bounded by `block_size` x catalogue size instead of the full
+    all-pairs matrix.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie catalogue with `movieId` and `genres` columns.
+    top_k : int
+        Number of neighbours to keep per movie.
+    block_size : int
+        Number of rows scored per block.
+
+    Returns
+    -------
+    SimilarityIndex
+        Sparse top-k neighbour index over the rows of `movies`.
+
+    """
+    # One-hot genre vectors, shared with the other content recommenders
+    genre_matrix = build_genre_matrix(movies).matrix
+    # Cosine similarity is the dot product of L2-normalised rows
+    vectors = normalize(genre_matrix.astype(np.float32), norm='l2')
+    vectors_t = vectors.T.toarray()
+    n_movies = vectors.shape[0]
+    k = min(top_k, n_movies - 1)
+
+    indptr = [0]
+    indices = []
+    scores = []
+    for start in range(0, n_movies, block_size):
+        stop = min(start + block_size, n_movies)
+        block = vectors[start:stop] @ vectors_t
+        # A movie should never be recommended as its own neighbour
+        block[np.arange(stop - start), np.arange(start, stop)] = -1
+        # Partial sort: only the k best columns of each row are ordered
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for row_indices, row_scores in zip(top, top_scores):
+            # Movies without any overlap are not neighbours
+            keep = row_scores > 0
+            indices.append(row_indices[keep])
+            scores.append(row_scores[keep])
+            indptr.append(indptr[-1] + int(keep.sum()))
+
+    return SimilarityIndex(
+        movie_ids=movies['movieId'].to_numpy(dtype=np.int32),
+        indptr=np.asarray(indptr, dtype=np.int64),
+        indices=np.concatenate(indices).astype(np.int32),
+        scores=np.concatenate(scores).astype(np.float32))
+
+
+def save_similarity_index(index, index_dir=INDEX_DIR, source=None, top_k=TOP_K):
+    """Publish a similarity index as raw `.npy` arrays, in one step.
+
+    The arrays are written to a new directory, which `meta.json` is then
+    pointed at. The arrays of the previous build are kept for processes
+    that read the old `meta.json` but have not mapped its arrays yet;
+    older builds are removed.
+
+    Parameters
+    ----------
+    index : SimilarityIndex
+        Index to store.
+    index_dir : str
+        Directory to store the index in.
+    source : str
+        Cache version of the movie data the index was built from.
+    top_k : int
+        Number of neighbours kept per movie.
+
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=index_dir, prefix='.build-')
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(build_dir, name + '.npy'), getattr(index, name))
+    version = os.path.basename(build_dir)[len('.build-'):]
+    os.rename(build_dir, os.path.join(index_dir, version))
+    meta_path = os.path.join(index_dir, 'meta.json')
+    previous = _read_json(meta_path)
+    _write_json(meta_path, {'format': INDEX_FORMAT, 'top_k': top_k, 'n_movies': len(index),
+                            'source': source, 'version': version})
+    keep = {version, previous and previous.get('version')}
+    for entry in os.listdir(index_dir):
+        if os.path.isdir(os.path.join(index_dir, entry)) and not entry.startswith('.') \
+                and entry not in keep:
+            shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+
+
+def _current_meta(index_dir, source, top_k):
+    """Metadata of the stored index, or None if missing or stale."""
+    meta = _read_json(os.path.join(index_dir, 'meta.json'))
+    if meta is None or meta.get('format') != INDEX_FORMAT or 'version' not in meta \
+            or meta['source'] != source or meta['top_k'] != top_k:
+        return None
+    return meta
+
+
+def load_similarity_index(index_dir=INDEX_DIR, movies_path=MOVIES_PATH,
+                          top_k=TOP_K):
+    """Memory-map a stored similarity index, building it first if needed.
+
+    The index is (re)built when it is missing, or when the contents of
+    the movie data it was built from have changed since. Processes
+    finding it so wait for the one holding the build lock instead of
+    building it as well.
+
+    Parameters
+    ----------
+    index_dir : str
+        Directory holding the index.
+    movies_path : str
+        Path to the movie catalogue in .csv format.
+    top_k : int
+        Number of neighbours kept per movie when building.
+
+    Returns
+    -------
+    SimilarityIndex
+        Read-only, memory-mapped similarity index.
+
+    """
+    source = movies_version(movies_path)
+    meta = _current_meta(index_dir, source, top_k)
+    if meta is None:
+        os.makedirs(index_dir, exist_ok=True)
+        with open(os.path.join(index_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Built by the process that held the lock before this one
+            meta = _current_meta(index_dir, source, top_k)
+            if meta is None:
+                movies = load_movies(movies_path).dropna()
+                save_similarity_index(build_similarity_index(movies, top_k=top_k),
+                                      index_dir, source=source, top_k=top_k)
+                meta = _current_meta(index_dir, source, top_k)
+    version_dir = os.path.join(index_dir, meta['version'])
+    arrays = {name: np.load(os.path.join(version_dir, name + '.npy'), mmap_mode='r')
+              for name in INDEX_ARRAYS}
+    return SimilarityIndex(**arrays)
+
+
+_index = Lazy(load_similarity_index)
+
+
+def get_similarity_index():
+    """Return the process-wide similarity index, loading it on first use."""
+    return _index.get()
+
+
+if __name__ == '__main__':
+    movies = load_movies(MOVIES_PATH).dropna()
+    index = build_similarity_index(movies)
+    save_similarity_index(index, INDEX_DIR, source=movies_version(MOVIES_PATH))
+    print(f"Similarity index with {len(index)} movies saved to: {INDEX_DIR}")
@@ -0,0 +1,277 @@
+"""
+
+    Vectorised user scoring for trained SVD models.
+
+    Author: Explore Data Science Academy.
+
+    Description: Extracts the learnt factor matrices and biases from a
+    trained Surprise `SVD`/`SVDpp` model once, so that users can be
+    folded into the model and items retrieved with numpy alone, instead
+    of calling `model.predict` once per user and item.
+
+    The parameters can be exported to a bundle of raw `.npy` arrays which
+    is memory-mapped read-only when loaded. Loading a bundle needs
+    neither Surprise nor the trainset, and every process serving the app
+    shares one physical copy of the factors through the page cache.
+    A bundle records the size, modification time and hash of the pickle
+    it was exported from, so a retrained pickle is never served with the
+    factors of the previous one. Export a pickled model with:
+
+        python -m recommenders.svd_scoring resources/models/SVD.pkl
+
+"""
+
+# Script dependencies
+import os
+import sys
+import json
+import shutil
+import pickle
+import tempfile
+import numpy as np
+from recommenders.data_cache import file_digest
+
+# Bumped whenever the layout of a bundle changes
+BUNDLE_FORMAT = 1
+BUNDLE_ARRAYS = ('user_factors', 'item_factors', 'user_bias', 'item_bias',
+                 'raw_uids', 'raw_iids')
+# Sorted id maps, stored so that processes map them instead of sorting
+# the ids themselves; computed on load for bundles without them
+ID_INDEX_ARRAYS = ('user_order', 'sorted_uids', 'item_order', 'sorted_iids')
+# L2 regularisation when solving for a user's factors from their ratings
+FOLD_IN_REG = 0.1
+
+
+class SVDScorer:
+    """Score users against items with the parameters of an SVD model.
+
+    Predictions follow Surprise's own estimate, i.e.
+    `global_mean + bu + bi + qi . pu`, clipped to the rating scale. Users
+    or items unknown to the model contribute no bias and no factors.
+
+    """
+
+    def __init__(self, user_factors, item_factors, user_bias, item_bias,
+                 global_mean, rating_scale, raw_uids, raw_iids, id_index=None):
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self.global_mean = global_mean
+        self.rating_scale = rating_scale
+        self.raw_uids = raw_uids
+        self.raw_iids = raw_iids
+        # Sorted raw ids map raw ids to model rows by binary search
+        if id_index is None:
+            id_index = {}
+            for side, raw_ids in (('user', raw_uids), ('item', raw_iids)):
+                order = np.argsort(raw_ids, kind='stable')
+                id_index[f'{side}_order'] = order
+                id_index[f'sorted_{side[0]}ids'] = np.asarray(raw_ids)[order]
+        self._user_order = id_index['user_order']
+        self._sorted_uids = id_index['sorted_uids']
+        self._item_order = id_index['item_order']
+        self._sorted_iids = id_index['sorted_iids']
+
+    @classmethod
+    def from_model(cls, model):
+        """Pull the factors, biases and id maps out of a trained model.
+
+        Parameters
+        ----------
+        model : surprise.SVD or surprise.SVDpp
+            A fitted Surprise matrix factorisation model.
+
+        Returns
+        -------
+        SVDScorer
+            Scorer holding float32 copies of the model parameters.
+
+        """
+        trainset = model.trainset
+        user_factors = np.asarray(model.pu, dtype=np.float32)
+        if hasattr(model, 'yj'):
+            # SVD++ adds the normalised implicit feedback of every user
+            # to its factors; this only depends on the trainset, so it is
+            # folded into the user factors once here.
+            yj = np.asarray(model.yj, dtype=np.float32)
+            user_factors = user_factors.copy()
+            for row in range(trainset.n_users):
+                rated = [j for j, _ in trainset.ur[row]]
+                if rated:
+                    user_factors[row] += yj[rated].sum(axis=0) / np.sqrt(len(rated))
+        if getattr(model, 'biased', True):
+            user_bias = np.asarray(model.bu, dtype=np.float32)
+            item_bias = np.asarray(model.bi, dtype=np.float32)
+            global_mean = float(trainset.global_mean)
+        else:
+            user_bias = np.zeros(trainset.n_users, dtype=np.float32)
+            item_bias = np.zeros(trainset.n_items, dtype=np.float32)
+            global_mean = 0.0
+        return cls(
+            user_factors=user_factors,
+            item_factors=np.asarray(model.qi, dtype=np.float32),
+            user_bias=user_bias,
+            item_bias=item_bias,
+            global_mean=global_mean,
+            rating_scale=trainset.rating_scale,
+            raw_uids=np.array([trainset.to_raw_uid(u) for u in range(trainset.n_users)]),
+            raw_iids=np.array([trainset.to_raw_iid(i) for i in range(trainset.n_items)]))
+
+    def save(self, bundle_dir, source=None):
+        """Write the parameters to a bundle of raw `.npy` arrays.
+
+        The bundle is written to a temporary directory first and then
+        moved into place, replacing any previous bundle.
+
+        Parameters
+        ----------
+        bundle_dir : str
+            Directory to store the bundle in.
+        source : dict, optional
+            Stamp of the pickle the parameters come from, see
+            `pickle_source`.
+
+        """
+        parent = os.path.dirname(os.path.abspath(bundle_dir))
+        os.makedirs(parent, exist_ok=True)
+        build_dir = tempfile.mkdtemp(dir=parent, prefix='.build-')
+        for name in BUNDLE_ARRAYS:
+            np.save(os.path.join(build_dir, name + '.npy'), np.asarray(getattr(self, name)))
+        for name in ID_INDEX_ARRAYS:
+            np.save(os.path.join(build_dir, name + '.npy'), getattr(self, '_' + name))
+        meta = {'format': BUNDLE_FORMAT, 'global_mean': self.global_mean,
+                'rating_scale': list(self.rating_scale), 'source': source}
+        with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if os.path.isdir(bundle_dir):
+            shutil.rmtree(bundle_dir)
+        os.rename(build_dir, bundle_dir)
+
+    @classmethod
+    def load(cls, bundle_dir, mmap=True):
+        """Load a bundle written by `save`.
+
+        Parameters
+        ----------
+        bundle_dir : str
+            Directory holding the bundle.
+        mmap : bool
+            Memory-map the arrays read-only instead of reading them.
+
+        Returns
+        -------
+        SVDScorer
+            Scorer over the stored parameters.
+
+        """
+        with open(os.path.join(bundle_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['format'] != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported SVD bundle format: {meta['format']}")
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(bundle_dir, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in BUNDLE_ARRAYS}
+        id_paths = {name: os.path.join(bundle_dir, name + '.npy') for name in ID_INDEX_ARRAYS}
+        id_index = None
+        if all(os.path.exists(path) for path in id_paths.values()):
+            id_index = {name: np.load(path, mmap_mode=mmap_mode)
+                        for name, path in id_paths.items()}
+        return cls(global_mean=meta['global_mean'],
+                   rating_scale=tuple(meta['rating_scale']), id_index=id_index, **arrays)
+
+    def user_rows(self, raw_uids):
+        """Map raw user ids to model rows, using -1 for unknown users."""
+        return self._rows(self._sorted_uids, self._user_order, raw_uids)
+
+    def item_rows(self, raw_iids):
+        """Map raw item ids to model rows, using -1 for unknown items."""
+        return self._rows(self._sorted_iids, self._item_order, raw_iids)
+
+    @staticmethod
+    def _rows(sorted_ids, order, raw_ids):
+        raw_ids = np.asarray(raw_ids)
+        if len(sorted_ids) == 0:
+            return np.full(len(raw_ids), -1, dtype=np.int64)
+        slots = np.minimum(np.searchsorted(sorted_ids, raw_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[slots] == raw_ids, order[slots], -1).astype(np.int64)
+
+    def fold_in(self, item_rows, ratings, weights=None, reg=FOLD_IN_REG):
+        """Solve for the factors and bias of a user from their ratings.
+
+        With the item factors and biases held fixed, this is a (weighted)
+        ridge regression of the ratings on the rated items' factors, i.e.
+        a single ALS step for one user.
+
+        Parameters
+        ----------
+        item_rows : numpy.ndarray
+            Model rows of the rated items.
+        ratings : numpy.ndarray
+            Ratings given to those items.
+        weights : numpy.ndarray, optional
+            Weight of every rating; all ratings weigh 1 by default.
+        reg : float
+            L2 regularisation of the factors and bias.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, float)
+            User factors and user bias.
+
+        """
+        n_factors = self.item_factors.shape[1]
+        features = np.hstack((self.item_factors[item_rows],
+                              np.ones((len(item_rows), 1), dtype=np.float32)))
+        targets = np.asarray(ratings, dtype=np.float32) - self.global_mean \
+            - self.item_bias[item_rows]
+        if weights is not None:
+            scale = np.sqrt(np.asarray(weights, dtype=np.float32))
+            features = features * scale[:, None]
+            targets = targets * scale
+        gram = features.T @ features + reg * np.eye(n_factors + 1, dtype=np.float32)
+        solution = np.linalg.solve(gram, features.T @ targets)
+        return solution[:n_factors].astype(np.float32), float(solution[n_factors])
+
+
+def bundle_path(model_path):
+    """Default location of the bundle exported from a pickled model."""
+    return os.path.splitext(model_path)[0] + '_factors'
+
+
+def pickle_source(model_path):
+    """Size, modification time and SHA-1 hash of a pickled model."""
+    stat = os.stat(model_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha1': file_digest(model_path)}
+
+
+def bundle_matches(bundle_dir, model_path):
+    """Whether a bundle was exported from the current pickle.
+
+    Only a size or modification time change makes the pickle be hashed.
+    Bundles that do not record their pickle never match.
+
+    """
+    meta_path = os.path.join(bundle_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    if not os.path.exists(model_path):
+        # The bundle was deployed without its pickle
+        return True
+    with open(meta_path) as f:
+        source = json.load(f).get('source')
+    if not source:
+        return False
+    stat = os.stat(model_path)
+    if (stat.st_size, stat.st_mtime_ns) == (source['size'], source['mtime_ns']):
+        return True
+    return stat.st_size == source['size'] and file_digest(model_path) == source['sha1']
+
+
+if __name__ == '__main__':
+    model_path = sys.argv[1]
+    with open(model_path, 'rb') as f:
+        scorer = SVDScorer.from_model(pickle.load(f))
+    scorer.save(bundle_path(model_path), pickle_source(model_path))
+    print(f"Model parameters exported to: {bundle_path(model_path)}")
@@ -0,0 +1,279 @@
+"""
+
+    Top Charts engine.
+
+    Author: Explore Data Science Academy.
+
+    Description: Per-movie rating aggregates for the "Top Charts" pages.
+    The number, sum and mean of every movie's ratings are read in one
+    vectorised pass over the shared ratings store, which already has the
+    ratings logged in the app merged in, along with a Bayesian-weighted
+    score that shrinks the mean of rarely rated
+    movies towards the mean of all ratings:
+
+        score = (prior_weight * global_mean + sum) / (prior_weight + count)
+
+    so that a movie with a single 5-star rating does not top the chart.
+    The aggregates are kept as a small table under `resources/models`
+    and updated incrementally from the ratings log as app users rate
+    movies, without re-reading the ratings file. Charts can be sliced by
+    genre and release year, and every chart is computed once per version
+    of the aggregates, so showing a chart again is a dictionary lookup.
+
+"""
+
+# Script dependencies
+import os
+import json
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from recommenders.catalogue import get_catalogue, release_years
+from recommenders.genre_encoding import get_genre_matrix
+from recommenders.lazy import register_warmup
+from recommenders.online_updates import APP_USER_ID_BASE, LOG_PATH, RatingsLog
+from recommenders.ratings_store import get_ratings_store
+from recommenders.result_cache import sources_version
+
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+CHARTS_PATH = 'resources/models/top_charts.npz'
+# Movies with fewer ratings are left out of charts by default
+MIN_COUNT = 10
+# Weight (in ratings) of the global mean in the Bayesian score; the mean
+# number of ratings of a rated movie when None
+PRIOR_WEIGHT = None
+
+_charts = {}
+_charts_lock = threading.Lock()
+
+
+class TopCharts:
+    """Rating aggregates of every catalogue movie.
+
+    Instances are not modified once built: updates return a new
+    instance, so readers never see half-applied ratings.
+
+    Parameters
+    ----------
+    catalogue : Catalogue
+        Movies the aggregates are kept for; arrays follow its rows.
+    genre_matrix : GenreMatrix
+        Genres of the catalogue movies.
+    counts, sums : numpy.ndarray
+        Number and sum of the ratings of every catalogue movie.
+    logged : dict, optional
+        Rating of every (userId, movieId) pair counted from the ratings
+        log, so that re-ratings replace earlier ones.
+    source : list, optional
+        Version of the ratings and movie files the aggregates cover.
+    log_offset : int
+        Bytes of the ratings log already counted.
+    years : numpy.ndarray, optional
+        Release year of every catalogue movie; parsed from the titles
+        when omitted.
+
+    """
+
+    def __init__(self, catalogue, genre_matrix, counts, sums, logged=None,
+                 source=None, log_offset=0, years=None, prior_weight=PRIOR_WEIGHT):
+        self.catalogue = catalogue
+        self.genre_matrix = genre_matrix
+        self.counts = counts
+        self.sums = sums
+        self.logged = logged or {}
+        self.source = source
+        self.log_offset = log_offset
+        rated = counts > 0
+        self.global_mean = sums.sum() / max(counts.sum(), 1)
+        self.prior_weight = prior_weight or (counts[rated].mean() if rated.any() else 1.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.means = np.where(rated, sums / counts, np.nan)
+        self.scores = (self.prior_weight * self.global_mean + sums) / (self.prior_weight + counts)
+        self.years = release_years(catalogue.titles) if years is None else years
+        self._charts = {}
+
+    def genre_rows(self, genre):
+        """Catalogue rows of the movies of a genre."""
+        genres = list(self.genre_matrix.genres)
+        if genre not in genres:
+            return np.empty(0, dtype=np.int64)
+        return self.genre_matrix.matrix[:, genres.index(genre)].nonzero()[0]
+
+    def chart(self, n=10, genre=None, year=None, min_count=MIN_COUNT, by='score'):
+        """The n best rated movies, optionally of one genre or period.
+
+        Parameters
+        ----------
+        n : int
+            Number of movies in the chart.
+        genre : str, optional
+            Only movies of this genre, e.g. `Comedy`.
+        year : int or list (int), optional
+            Only movies released in this year (or these years).
+        min_count : int
+            Only movies with at least this many ratings.
+        by : str
+            Order by the Bayesian `score`, the plain `mean` or the `count`.
+
+        Returns
+        -------
+        Pandas Dataframe
+            `movieId`, `title`, `count`, `mean` and `score` of the chart
+            movies, best first.
+
+        """
+        years = None if year is None else tuple(np.atleast_1d(year).tolist())
+        key = (n, genre, years, min_count, by)
+        chart = self._charts.get(key)
+        if chart is None:
+            chart = self._charts[key] = self._build_chart(n, genre, years, min_count, by)
+        return chart
+
+    def _build_chart(self, n, genre, years, min_count, by):
+        keep = self.counts >= max(min_count, 1)
+        if genre is not None:
+            in_genre = np.zeros(len(keep), dtype=bool)
+            in_genre[self.genre_rows(genre)] = True
+            keep &= in_genre
+        if years is not None:
+            keep &= np.isin(self.years, years)
+        rows = np.flatnonzero(keep)
+        values = {'score': self.scores, 'mean': self.means, 'count': self.counts}[by][rows]
+        # Best first; ties go to the more often rated movie, then catalogue order
+        rows = rows[np.lexsort((rows, -self.counts[rows], -values))[:n]]
+        return pd.DataFrame({
+            'movieId': self.catalogue.movie_ids[rows],
+            'title': self.catalogue.titles_of_rows(rows),
+            'count': self.counts[rows],
+            'mean': self.means[rows],
+            'score': self.scores[rows],
+        })
+
+    def updated(self, records, log_offset):
+        """Aggregates with logged ratings added, or None if a rebuild is needed.
+
+        A rating by a user who already rated the movie through the app
+        replaces the earlier one. A logged rating by a MovieLens user may
+        replace a rating in the ratings file, which needs a rebuild.
+
+        """
+        counts = self.counts.copy()
+        sums = self.sums.copy()
+        logged = dict(self.logged)
+        for record in records:
+            key = (int(record['userId']), int(record['movieId']))
+            row = int(self.catalogue.rows_of_movie_ids([key[1]])[0])
+            if key in logged:
+                previous = logged[key]
+            elif key[0] < APP_USER_ID_BASE:
+                return None
+            else:
+                previous = None
+            logged[key] = float(record['rating'])
+            if row < 0:
+                continue
+            if previous is None:
+                counts[row] += 1
+            else:
+                sums[row] -= previous
+            sums[row] += float(record['rating'])
+        return TopCharts(self.catalogue, self.genre_matrix, counts, sums, logged,
+                         self.source, log_offset, self.years)
+
+
+def build_top_charts(ratings_path=RATINGS_PATH, movies_path=MOVIES_PATH, log_path=LOG_PATH):
+    """Aggregate the ratings store, logged ratings included.
+
+    Returns
+    -------
+    TopCharts
+        Aggregates of every catalogue movie.
+
+    """
+    source = [list(version) for version in sources_version((ratings_path, movies_path))]
+    catalogue = get_catalogue(movies_path)
+    store = get_ratings_store(ratings_path, log_path)
+    stats = store.movie_stats()
+    rows = catalogue.rows_of_movie_ids(stats.index.to_numpy())
+    known = rows >= 0
+    counts = np.zeros(len(catalogue), dtype=np.int64)
+    sums = np.zeros(len(catalogue), dtype=np.float64)
+    counts[rows[known]] = stats['count'].to_numpy()[known]
+    sums[rows[known]] = stats['sum'].to_numpy()[known]
+    # The logged ratings the store merged, so that re-ratings replace them
+    records, log_offset = RatingsLog(log_path).read(end=store.log_offset)
+    logged = {(int(record['userId']), int(record['movieId'])): float(record['rating'])
+              for record in records}
+    return TopCharts(catalogue, get_genre_matrix(movies_path), counts, sums, logged,
+                     source, log_offset)
+
+
+def save_top_charts(charts, path=CHARTS_PATH):
+    """Store the aggregates, replacing the previous file in one step."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    keys = np.array(list(charts.logged), dtype=np.int64).reshape(-1, 2)
+    meta = {'source': charts.source, 'log_offset': charts.log_offset}
+    # A temp file of its own, as every process saves after applying ratings
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, movie_ids=charts.catalogue.movie_ids, counts=charts.counts,
+                 sums=charts.sums, logged_keys=keys,
+                 logged_ratings=np.array(list(charts.logged.values()), dtype=np.float64),
+                 meta=np.array(json.dumps(meta)))
+    os.replace(tmp_path, path)
+
+
+def load_top_charts(path=CHARTS_PATH, ratings_path=RATINGS_PATH, movies_path=MOVIES_PATH):
+    """Load stored aggregates, or None if missing or out of date."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as stored:
+        meta = json.loads(str(stored['meta']))
+        source = [list(version) for version in sources_version((ratings_path, movies_path))]
+        catalogue = get_catalogue(movies_path)
+        if meta['source'] != source or not np.array_equal(stored['movie_ids'], catalogue.movie_ids):
+            return None
+        logged = dict(zip(map(tuple, stored['logged_keys'].tolist()),
+                          stored['logged_ratings'].tolist()))
+        return TopCharts(catalogue, get_genre_matrix(movies_path), stored['counts'],
+                         stored['sums'], logged, source, meta['log_offset'])
+
+
+@register_warmup
+def get_top_charts(ratings_path=RATINGS_PATH, movies_path=MOVIES_PATH, log_path=LOG_PATH,
+                   path=CHARTS_PATH):
+    """Return the shared, up-to-date Top Charts aggregates.
+
+    The stored aggregates are loaded on first use (or built and stored if
+    missing or out of date), and ratings logged since are applied
+    incrementally; that check is a single `stat` call when nothing was
+    logged.
+
+    """
+    key = (ratings_path, movies_path, log_path)
+    source = [list(version) for version in sources_version((ratings_path, movies_path))]
+    charts = _charts.get(key)
+    log_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+    if charts is not None and charts.source == source and charts.log_offset == log_size:
+        return charts
+    with _charts_lock:
+        charts = _charts.get(key)
+        if charts is None or charts.source != source:
+            charts = load_top_charts(path, ratings_path, movies_path)
+        if charts is not None and charts.log_offset != log_size:
+            if log_size < charts.log_offset:
+                # The log was truncated or replaced
+                charts = None
+            else:
+                records, offset = RatingsLog(log_path).read(charts.log_offset)
+                if records:
+                    charts = charts.updated(records, offset)
+                    if charts is not None:
+                        save_top_charts(charts, path)
+        if charts is None:
+            charts = build_top_charts(ratings_path, movies_path, log_path)
+            save_top_charts(charts, path)
+        _charts[key] = charts
+    return charts
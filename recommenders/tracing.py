@@ -0,0 +1,275 @@
+"""
+
+    Timing spans for the recommendation hot paths.
+
+    Author: Explore Data Science Academy.
+
+    Description: Named spans around the stages of a recommendation (data
+    loading, model loading, scoring, title lookups) show where the time
+    of a slow "Recommend" click goes. Finished spans are aggregated into
+    in-process latency histograms, which can be exported in the
+    Prometheus text format, served over HTTP, or logged as one JSON line
+    per span. Tracing is off by default, in which case a span is a single
+    flag check. It is switched on with environment variables:
+
+        RECOMMENDER_TRACING=1             aggregate spans into histograms
+        RECOMMENDER_TRACE_LOG=spans.jsonl also log every span as JSON
+        RECOMMENDER_METRICS_PORT=9100     serve the histograms on /metrics
+
+    or from code with `enable()`. Spans nest: a span opened inside
+    another records it as its parent. The metrics endpoint is only
+    started by an entry point calling `serve_metrics_from_env()` (the
+    Streamlit app does), never on import, as only one process can bind
+    the port.
+
+"""
+
+# Script dependencies
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (s) of the histogram buckets, from 50µs to 30s
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_NAME = 'recommender_span_seconds'
+
+
+class Histogram:
+    """Counts of span durations per bucket, with their sum and errors."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # One count per bucket, plus one for durations above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, duration, error=False):
+        self.counts[bisect.bisect_left(self.buckets, duration)] += 1
+        self.count += 1
+        self.sum += duration
+        self.max = max(self.max, duration)
+        self.errors += error
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (s).
+
+        Above the last bucket, whose upper bound is infinite, the longest
+        duration observed is reported instead, which keeps the value
+        finite and valid in JSON.
+
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.max
+
+
+class Tracer:
+    """Aggregates finished spans into one histogram per span name.
+
+    Parameters
+    ----------
+    log_path : str, optional
+        JSON-lines file that every finished span is appended to.
+
+    """
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, name, start, duration, parent=None, error=None):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(duration, error is not None)
+            if self.log_path:
+                record = {'span': name, 'parent': parent, 'start': start,
+                          'duration_ms': 1000 * duration, 'error': error}
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+    def snapshot(self):
+        """Count, total and approximate percentiles (ms) of every span."""
+        with self._lock:
+            return {name: {'count': h.count, 'errors': h.errors, 'total_ms': 1000 * h.sum,
+                           'mean_ms': 1000 * h.sum / h.count,
+                           **{f"p{int(100 * q)}_ms": 1000 * h.quantile(q)
+                              for q in (0.5, 0.95, 0.99)}}
+                    for name, h in sorted(self.histograms.items())}
+
+    def prometheus_text(self):
+        """The histograms in the Prometheus text exposition format."""
+        lines = [f"# HELP {METRIC_NAME} Duration of recommender spans.",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        errors = []
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'{METRIC_NAME}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_sum{{span="{name}"}} {h.sum}')
+                lines.append(f'{METRIC_NAME}_count{{span="{name}"}} {h.count}')
+                errors.append(f'recommender_span_errors_total{{span="{name}"}} {h.errors}')
+        lines += ["# HELP recommender_span_errors_total Spans that raised an exception.",
+                  "# TYPE recommender_span_errors_total counter"] + errors
+        return '\n'.join(lines) + '\n'
+
+
+class _Span:
+    """Times the block it wraps and reports it to the tracer."""
+
+    __slots__ = ('tracer', 'name', 'parent', 'start', '_wall')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(self.tracer._local, 'stack', None)
+        if stack is None:
+            stack = self.tracer._local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self._wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.start
+        self.tracer._local.stack.pop()
+        self.tracer.record(self.name, self._wall, duration, self.parent,
+                           exc_type.__name__ if exc_type is not None else None)
+        return False
+
+
+class _NoSpan:
+    """Span used while tracing is off; does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+# The active tracer, or None while tracing is off
+_tracer = None
+_metrics_server = None
+_metrics_lock = threading.Lock()
+
+
+def span(name):
+    """Context manager timing a named stage, e.g. `span('content_based.rank')`."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _Span(_tracer, name)
+
+
+def traced(name):
+    """Decorator timing every call of a function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _Span(_tracer, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(log_path=None):
+    """Start recording spans into a fresh tracer, and return it."""
+    global _tracer
+    _tracer = Tracer(log_path)
+    return _tracer
+
+
+def disable():
+    """Stop recording spans."""
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    """The active tracer, or None while tracing is off."""
+    return _tracer
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        tracer = _tracer
+        if self.path == '/metrics':
+            body, content_type = (tracer.prometheus_text() if tracer else ''), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(tracer.snapshot() if tracer else {}), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host='0.0.0.0'):
+    """Serve `/metrics` (Prometheus) and `/metrics.json` from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True,
+                     name='recommender-metrics').start()
+    return server
+
+
+if os.environ.get('RECOMMENDER_TRACING', '0') != '0' or os.environ.get('RECOMMENDER_TRACE_LOG'):
+    enable(os.environ.get('RECOMMENDER_TRACE_LOG') or None)
+
+
+def serve_metrics_from_env():
+    """Serve the metrics on `RECOMMENDER_METRICS_PORT`, if it is set.
+
+    Tracing is switched on as well. Safe to call repeatedly, e.g. on
+    every Streamlit rerun: the endpoint is started once per process.
+
+    Returns
+    -------
+    ThreadingHTTPServer or None
+        The metrics server, or None when no port is configured.
+
+    """
+    global _metrics_server
+    port = os.environ.get('RECOMMENDER_METRICS_PORT')
+    if not port:
+        return None
+    with _metrics_lock:
+        if _metrics_server is None:
+            if _tracer is None:
+                enable()
+            _metrics_server = serve_metrics(int(port))
+    return _metrics_server
@@ -6,8 +6,7 @@
 
 """
 # Data handling dependencies
-import pandas as pd
-import numpy as np
+from recommenders.catalogue import get_catalogue
 
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
@@ -24,7 +23,6 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
-    df = df.dropna()
-    movie_list = df['title'].to_list()
+    # Titles come from the shared catalogue index, parsed once per process
+    movie_list = list(get_catalogue(path_to_movies).titles)
     return movie_list
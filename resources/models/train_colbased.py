@@ -4,36 +4,163 @@
 
     Author: Explore Data Science Academy.
 
-    Description: Simple script to train and save an instance of the
-    SVDpp algorithm on MovieLens data.
+    Description: Trains and saves an instance of the SVD or SVDpp
+    algorithm on MovieLens data. Besides training a single model with
+    fixed parameters, the script can run a grid or random search over the
+    number of factors, learning rate, regularisation and epochs. Every
+    (configuration, fold) pair is trained in its own worker process,
+    using all cores, and reported with its RMSE, wall time and peak
+    memory. The best configuration is refitted on all ratings and
+    published as a versioned artifact, which the app then loads.
+
+    Usage (from the root of this repository):
+
+        python -m resources.models.train_colbased --search grid
+        python -m resources.models.train_colbased --search random --n-iter 8
 
 """
 # Script dependencies
+import os
+import json
+import time
+import random
+import pickle
+import resource
+import argparse
+import itertools
 import numpy as np
 import pandas as pd
-from surprise import SVD
+from concurrent.futures import ProcessPoolExecutor
+from surprise import SVD, SVDpp
+from surprise.model_selection import KFold
+from surprise import accuracy
 import surprise
-import pickle
+from recommenders.data_cache import load_ratings, ratings_version
+from recommenders.model_registry import publish_model
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
+RATINGS_PATH = 'resources/data/ratings.csv'
+ALGORITHMS = {'svd': SVD, 'svdpp': SVDpp}
+# Model names loaded by `collaborative_based2` and `collaborative_based`
+MODEL_NAMES = {'svd': 'SVD', 'svdpp': 'SVDpp_model'}
+DEFAULT_PARAMS = {'n_factors': 200, 'lr_all': 0.005, 'reg_all': 0.02,
+                  'n_epochs': 40, 'init_std_dev': 0.05}
+# Search space of the hyperparameter sweep
+PARAM_GRID = {
+    'n_factors': [50, 100, 200],
+    'lr_all': [0.005, 0.01],
+    'reg_all': [0.02, 0.05],
+    'n_epochs': [20, 40],
+}
 
-def svd_pp(save_path):
+def load_data(ratings_path=RATINGS_PATH):
+    # Importing datasets
+    ratings = load_ratings(ratings_path)[['userId', 'movieId', 'rating']]
     # Check the range of the rating
     min_rat = ratings['rating'].min()
     max_rat = ratings['rating'].max()
     # Changing ratings to their standard form
-    reader = surprise.Reader(rating_scale = (min_rat,max_rat))
-    # Loading the data frame using surprice
-    data_load = surprise.Dataset.load_from_df(ratings, reader)
-    # Insatntiating surpricce
-    method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
-    # Loading a trainset into the model
-    model = method.fit(data_load.build_full_trainset())
-    print (f"Training completed. Saving model to: {save_path}")
+    reader = surprise.Reader(rating_scale = (float(min_rat),float(max_rat)))
+    # Loading the data frame using surprise
+    return surprise.Dataset.load_from_df(ratings, reader)
+
+def peak_memory_mb():
+    # Peak resident set size of this process (reported in KiB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def train_fold(algorithm, params, fold, n_folds, ratings_path=RATINGS_PATH, seed=0):
+    """Train one configuration on one cross-validation fold.
+
+    Returns
+    -------
+    dict
+        Parameters, fold, test RMSE, wall time (s) and peak memory (MiB).
+
+    """
+    start = time.perf_counter()
+    data = load_data(ratings_path)
+    # Every worker draws the same folds from the same seed
+    splits = KFold(n_splits=n_folds, random_state=seed, shuffle=True).split(data)
+    trainset, testset = next(itertools.islice(splits, fold, None))
+    model = ALGORITHMS[algorithm](random_state=seed, **dict(DEFAULT_PARAMS, **params))
+    model.fit(trainset)
+    rmse = accuracy.rmse(model.test(testset), verbose=False)
+    return {'params': params, 'fold': fold, 'rmse': rmse,
+            'wall_time': time.perf_counter() - start, 'peak_memory_mb': peak_memory_mb()}
 
-    return pickle.dump(model, open(save_path,'wb'))
+def candidate_params(search, n_iter, seed=0):
+    # All combinations of the grid, or a random sample of them
+    grid = [dict(zip(PARAM_GRID, values)) for values in itertools.product(*PARAM_GRID.values())]
+    if search == 'random':
+        return random.Random(seed).sample(grid, min(n_iter, len(grid)))
+    return grid
+
+def sweep(algorithm, configs, n_folds=3, workers=None, ratings_path=RATINGS_PATH):
+    """Cross-validate configurations in parallel, one fold per task.
+
+    Each task runs in a fresh worker process, so that its peak memory is
+    measured on its own.
+
+    Returns
+    -------
+    list (dict)
+        Mean RMSE, total wall time and peak memory of every configuration,
+        best first.
+
+    """
+    tasks = [(params, fold) for params in configs for fold in range(n_folds)]
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        futures = [pool.submit(train_fold, algorithm, params, fold, n_folds, ratings_path)
+                   for params, fold in tasks]
+        folds = [future.result() for future in futures]
+    results = []
+    for i, params in enumerate(configs):
+        runs = folds[i * n_folds:(i + 1) * n_folds]
+        results.append({'params': params,
+                        'rmse': float(np.mean([run['rmse'] for run in runs])),
+                        'rmse_std': float(np.std([run['rmse'] for run in runs])),
+                        'wall_time': sum(run['wall_time'] for run in runs),
+                        'peak_memory_mb': max(run['peak_memory_mb'] for run in runs)})
+    return sorted(results, key=lambda result: result['rmse'])
+
+def fit_full(algorithm, params, ratings_path=RATINGS_PATH):
+    # Loading a trainset with all ratings into the model
+    method = ALGORITHMS[algorithm](**dict(DEFAULT_PARAMS, **params))
+    return method.fit(load_data(ratings_path).build_full_trainset())
+
+def svd_pp(save_path, ratings_path=RATINGS_PATH):
+    model = fit_full('svd', {}, ratings_path)
+    print (f"Training completed. Saving model to: {save_path}")
+    with open(save_path, 'wb') as f:
+        pickle.dump(model, f)
+    return model
 
 if __name__ == '__main__':
-    svd_pp('SVD.pkl')
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='svd')
+    parser.add_argument('--search', choices=['none', 'grid', 'random'], default='none')
+    parser.add_argument('--n-iter', type=int, default=8)
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    args = parser.parse_args()
+
+    params = {}
+    report = []
+    if args.search != 'none':
+        configs = candidate_params(args.search, args.n_iter)
+        report = sweep(args.algorithm, configs, args.folds, args.workers, args.ratings)
+        print(pd.DataFrame([dict(result['params'], rmse=result['rmse'],
+                                 wall_time=result['wall_time'],
+                                 peak_memory_mb=result['peak_memory_mb'])
+                            for result in report]).to_string(index=False))
+        params = report[0]['params']
+
+    start = time.perf_counter()
+    model = fit_full(args.algorithm, params, args.ratings)
+    metadata = {'algorithm': args.algorithm, 'params': dict(DEFAULT_PARAMS, **params),
+                'ratings_version': ratings_version(args.ratings),
+                'fit_time': time.perf_counter() - start, 'sweep': report}
+    artifact_dir = publish_model(model, MODEL_NAMES[args.algorithm], metadata)
+    print(f"Training completed. Model published to: {artifact_dir}")
+    print(json.dumps(metadata['params']))
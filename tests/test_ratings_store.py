@@ -0,0 +1,125 @@
+"""
+
+    Tests of the ratings store's handling of the ratings log.
+
+    Author: Explore Data Science Academy.
+
+    Description: Checks that the store followed through the log (logged
+    ratings applied as a delta, re-ratings, compaction, a replaced log)
+    always holds the same ratings as merging the whole log into the
+    ratings file at once.
+
+"""
+
+# Script dependencies
+import os
+import json
+import functools
+import numpy as np
+import pandas as pd
+import pytest
+from recommenders import ratings_store
+from recommenders.data_cache import load_ratings, ratings_version
+from recommenders.data_plane import shared_arrays
+from recommenders.online_updates import APP_USER_ID_BASE, RatingsLog
+
+COLUMNS = ['userId', 'movieId', 'rating']
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    """A small random ratings file and an empty log, with caches under tmp_path."""
+    rng = np.random.default_rng(0)
+    pairs = rng.choice(40 * 60, size=400, replace=False)
+    ratings = pd.DataFrame({'userId': pairs // 60 + 1, 'movieId': pairs % 60 + 1,
+                            'rating': rng.integers(1, 11, size=len(pairs)) / 2,
+                            'timestamp': rng.integers(10 ** 9, 2 * 10 ** 9, size=len(pairs))})
+    ratings_path = str(tmp_path / 'ratings.csv')
+    ratings.to_csv(ratings_path, index=False)
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(ratings_store, 'load_ratings',
+                        functools.partial(load_ratings, cache_dir=cache_dir))
+    monkeypatch.setattr(ratings_store, 'ratings_version',
+                        functools.partial(ratings_version, cache_dir=cache_dir))
+    monkeypatch.setattr(ratings_store, 'shared_arrays',
+                        functools.partial(shared_arrays, plane_dir=str(tmp_path / 'plane')))
+    monkeypatch.setattr(ratings_store, 'COMPACT_EVERY', 16)
+    monkeypatch.setattr(ratings_store, '_stores', {})
+    return ratings_path, str(tmp_path / 'ratings_log.jsonl')
+
+
+def merged(ratings_path, log_path):
+    """The ratings file with the whole log merged in at once."""
+    ratings = pd.read_csv(ratings_path)[COLUMNS]
+    if os.path.exists(log_path):
+        with open(log_path) as f:
+            logged = pd.DataFrame([json.loads(line) for line in f if line.strip()],
+                                  columns=COLUMNS)
+        ratings = pd.concat([ratings, logged], ignore_index=True)
+        ratings = ratings.drop_duplicates(['userId', 'movieId'], keep='last')
+    return ratings
+
+
+def sorted_frame(frame):
+    frame = frame[COLUMNS].astype({'userId': np.int64, 'movieId': np.int64,
+                                   'rating': np.float64})
+    return frame.sort_values(['userId', 'movieId'], ignore_index=True)
+
+
+def assert_matches(store, expected):
+    pd.testing.assert_frame_equal(sorted_frame(store.to_frame()), sorted_frame(expected))
+    assert len(store) == len(expected)
+    users = expected['userId'].drop_duplicates().to_numpy()[:5]
+    pd.testing.assert_frame_equal(sorted_frame(store.ratings_of_users(users)),
+                                  sorted_frame(expected[expected['userId'].isin(users)]))
+    grouped = expected.groupby('movieId')['rating']
+    movie_ids = np.array(sorted(expected['movieId'].unique()) + [10 ** 6])
+    counts = grouped.count().reindex(movie_ids, fill_value=0).to_numpy()
+    np.testing.assert_array_equal(store.movie_counts(movie_ids), counts)
+    stats = store.movie_stats()
+    stats = stats[stats['count'] > 0]
+    np.testing.assert_array_equal(stats['count'].to_numpy(), grouped.count().to_numpy())
+    np.testing.assert_allclose(stats['sum'].to_numpy(), grouped.sum().to_numpy())
+
+
+def test_followed_log_matches_full_merge(paths):
+    ratings_path, log_path = paths
+    rng = np.random.default_rng(1)
+    ratings = pd.read_csv(ratings_path)
+    log = RatingsLog(log_path)
+    logged = []
+    assert_matches(ratings_store.get_ratings_store(ratings_path, log_path),
+                   merged(ratings_path, log_path))
+    for _ in range(25):
+        for _ in range(rng.integers(1, 12)):
+            kind = rng.integers(3)
+            if kind == 0:
+                # A MovieLens user rating a movie again
+                user, movie = ratings.iloc[rng.integers(len(ratings))][['userId', 'movieId']]
+            elif kind == 1 and logged:
+                # An app user rating a movie again
+                user, movie = logged[rng.integers(len(logged))]
+            else:
+                user, movie = APP_USER_ID_BASE + rng.integers(10), rng.integers(1, 80)
+            logged.append((int(user), int(movie)))
+            log.append(user, movie, rng.integers(1, 11) / 2)
+        assert_matches(ratings_store.get_ratings_store(ratings_path, log_path),
+                       merged(ratings_path, log_path))
+
+
+@pytest.mark.parametrize('extra_records', [0, 5])
+def test_replaced_log_is_read_again(paths, extra_records):
+    ratings_path, log_path = paths
+    log = RatingsLog(log_path)
+    for movie in range(1, 21):
+        log.append(APP_USER_ID_BASE, movie, 1.0)
+    ratings_store.get_ratings_store(ratings_path, log_path)
+    # Another log of the same size (or larger), with other ratings
+    replacement = RatingsLog(log_path + '.new')
+    for movie in range(1, 21 + extra_records):
+        replacement.append(APP_USER_ID_BASE, movie, 2.0)
+    os.replace(log_path + '.new', log_path)
+    stat = os.stat(log_path)
+    os.utime(log_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    store = ratings_store.get_ratings_store(ratings_path, log_path)
+    assert_matches(store, merged(ratings_path, log_path))